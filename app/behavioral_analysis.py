@@ -1,10 +1,31 @@
 #!/usr/bin/env python
+import cPickle as pickle
 import happyfuntokenizing
 from happyfuntokenizing import * 
 import numpy as np 
 import pandas as pd
 
 
+BIG_FIVE_PATH = "big_five/"
+TRAIT_FILES = ["agreeableness.txt", "disagreeable.txt", "open.txt", "closed.txt",
+"extraversion.txt", "introversion.txt", "unconscientious.txt", "conscientious.txt", 
+"neurotic.txt", "stability.txt"]
+TRAITS = ["agreeable", "disagreeable", "open", "closed", "extraversion",
+"introversion", "unconscientious", "conscientious", "neurotic", "stability"]
+
+# currently arbitrary :\ 
+RISK_WEIGHTS = {"disagreeable":1, 
+"open": 1, 
+"extraversion":1, 
+"unconscientious":0.5, 
+"stability":0.5,
+"neurotic":-0.5, 
+"agreeable":-1, 
+"conscientious":-0.5, 
+"introversion":-1, 
+"closed":-1}
+
+
 def count_pos(tagged_words):
 	"""return counts of each part of speech"""
 	pos = {}
@@ -23,13 +44,13 @@ def read_list(filename):
 		lines = [line.strip().lower() for line in f.readlines()]
 	return lines
 
+_tokenizer = Tokenizer(preserve_case=False)
+
 def count_words(msg):
 	"""return dict of word counts in msg
 	At this point not worth using sklearn data structs..."""
 	counts = {}
-	tokenizer = Tokenizer(preserve_case=False)
-	toks = tokenizer.tokenize(msg)
-	for word in toks:
+	for word in _tokenizer.iter_tokens(msg):
 		try:
 			counts[word] = counts[word] + 1
 		except KeyError:
@@ -52,27 +73,137 @@ def count_trait_words(word_freqs, trait_words):
 	return relevant_words/total_words
 
 
-def big_five(msg):
+class TraitLexicon(object):
+	"""the big five word lists frozen into one index of word -> trait ids,
+	so a message's word counts can be scored for every trait in one pass.
+	Load it once with get_lexicon() (or from a file written by save())
+	instead of re-reading the word lists for every message."""
+
+	def __init__(self, traits, index):
+		self.traits = tuple(traits)
+		self.index = index # word -> tuple of ids into traits
+
+	@classmethod
+	def from_lists(cls, path=BIG_FIVE_PATH, traits=TRAITS, files=TRAIT_FILES):
+		"""build the index from one word list file per trait"""
+		index = {}
+		for trait_id in range(len(traits)):
+			for word in read_list(path + files[trait_id]):
+				if word:
+					# a word listed twice counts twice, as in count_trait_words
+					index[word] = index.get(word, ()) + (trait_id,)
+		return cls(traits, index)
+
+	@classmethod
+	def load(cls, filename):
+		"""read a lexicon written by save()"""
+		with open(filename, 'rb') as f:
+			traits, index = pickle.load(f)
+		return cls(traits, index)
+
+	def save(self, filename):
+		"""write the lexicon to filename as a compact binary pickle"""
+		with open(filename, 'wb') as f:
+			pickle.dump((self.traits, self.index), f, pickle.HIGHEST_PROTOCOL)
+
+	def score(self, word_freqs):
+		"""given dict of word frequencies, return dict of {trait : percentage
+		of words relevant to trait}, like count_trait_words for each trait"""
+		total_words = sum(word_freqs.values())
+		relevant_words = [0.0] * len(self.traits)
+		index = self.index
+		for word, count in word_freqs.iteritems():
+			for trait_id in index.get(word, ()):
+				relevant_words[trait_id] += count
+		return dict((self.traits[i], relevant_words[i]/total_words)
+			for i in range(len(self.traits)))
+
+	def trait_matrix(self):
+		"""return (vocabulary, matrix) where vocabulary maps each word to a row
+		of matrix, a vocabulary x trait array of how often the word counts
+		towards each trait"""
+		try:
+			return self._trait_matrix
+		except AttributeError:
+			vocabulary = dict((word, i) for i, word in enumerate(self.index))
+			matrix = np.zeros((len(vocabulary), len(self.traits)))
+			for word, row in vocabulary.iteritems():
+				for trait_id in self.index[word]:
+					matrix[row, trait_id] += 1
+			self._trait_matrix = (vocabulary, matrix)
+			return self._trait_matrix
+
+
+_lexicons = {}
+
+def get_lexicon(path=BIG_FIVE_PATH):
+	"""return the TraitLexicon for the word lists in path, loading it on first use"""
+	try:
+		return _lexicons[path]
+	except KeyError:
+		lexicon = _lexicons[path] = TraitLexicon.from_lists(path)
+		return lexicon
+
+
+def big_five(msg, lexicon=None):
 	"""
 	calculate rough estimate on this based on occurrence of most relevant
 	words according to 
 	http://www.ncbi.nlm.nih.gov/pmc/articles/PMC3783449/#pone.0073791.s002
 	"Personality, Gender, and Age in the Language of Social Media: The Open-Vocabulary Approach"
 	"""
-	PATH = "big_five/"
-	freqs = count_words(msg)
-	files = ["agreeableness.txt", "disagreeable.txt", "open.txt", "closed.txt",
-	"extraversion.txt", "introversion.txt", "unconscientious.txt", "conscientious.txt", 
-	"neurotic.txt", "stability.txt"]
-	traits = ["agreeable", "disagreeable", "open", "closed", "extraversion",
-	"introversion", "unconscientious", "conscientious", "neurotic", "stability"]
-	trait_words = {}
-	for i in range(len(traits)):
-		trait_words[traits[i]] = read_list(PATH + files[i])
-	five = {}
-	for trait in traits:
-		five[trait] = count_trait_words(freqs,trait_words[trait])
-	return five
+	lexicon = lexicon or get_lexicon()
+	return lexicon.score(count_words(msg))
+
+
+def score_corpus_batch(messages, lexicon=None):
+	"""
+	big five and risk scores for many messages at once (e.g. one corpus per
+	user), returned as a DataFrame with one row per message and one column
+	per trait plus "risk". messages is a list of strings, or a dict/Series
+	whose keys become the index.
+
+	the messages are tokenized into a sparse message x vocabulary count
+	matrix (coordinate form, lexicon words only), which is multiplied by the
+	lexicon's vocabulary x trait matrix and then by the risk weight vector.
+	where big_five and risk_metric would divide by zero, the scores are NaN
+	instead: messages without words score NaN in every column, and messages
+	without trait words score 0.0 for every trait and NaN for "risk".
+	"""
+	lexicon = lexicon or get_lexicon()
+	if hasattr(messages, "keys"):
+		index = list(messages.keys())
+		messages = [messages[key] for key in index]
+	else:
+		messages = list(messages)
+		index = None
+	vocabulary, trait_matrix = lexicon.trait_matrix()
+
+	rows = []
+	cols = []
+	total_words = np.zeros(len(messages))
+	for row, toks in enumerate(_tokenizer.tokenize_many(messages)):
+		for word in toks:
+			total_words[row] += 1
+			col = vocabulary.get(word)
+			if col is not None:
+				rows.append(row)
+				cols.append(col)
+	rows = np.asarray(rows, dtype=np.intp)
+	cols = np.asarray(cols, dtype=np.intp)
+
+	# sparse counts . trait_matrix, one bincount per trait column
+	relevant_words = np.column_stack([
+		np.bincount(rows, weights=trait_matrix[cols, t], minlength=len(messages))
+		for t in range(len(lexicon.traits))])
+	with np.errstate(divide="ignore", invalid="ignore"):
+		five = relevant_words / total_words[:, np.newaxis]
+		normed = five / five.sum(axis=1)[:, np.newaxis]
+	weights = np.array([RISK_WEIGHTS[trait] for trait in lexicon.traits])
+
+	scores = pd.DataFrame(five, index=index, columns=list(lexicon.traits))
+	scores["risk"] = normed.dot(weights)
+	return scores
 
 
 def display_five(data):
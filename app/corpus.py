@@ -0,0 +1,61 @@
+#Builds a user's message/post/like corpora from Graph API items.
+#Items can be fed in a page (or a single item) at a time, e.g. straight from
+#GraphAPI.iter_connections, so a user's history never has to be held as
+#JSON in memory. Nothing here depends on Kivy.
+
+
+class CorpusBuilder(object):
+    """Accumulates the corpora of the user with the given Graph id.
+
+    messages    -- list of messages the user wrote in their outbox threads
+    posts       -- list of the text of the user's posts
+    post_times  -- list of the updated_time of every post
+    likes       -- list of the categories of the pages the user likes
+    """
+
+    def __init__(self, user_id, name=''):
+        self.user_id = user_id
+        self.name = name
+        self.messages = []
+        self.posts = []
+        self.post_times = []
+        self.likes = []
+
+    def add_messages(self, threads):
+        """Adds the user's own messages from an iterable of outbox threads.
+        Messages are matched by the author's id, not their display name."""
+        for thread in threads:
+            for comment in thread.get('comments', {}).get('data', []):
+                if 'message' in comment and \
+                        comment.get('from', {}).get('id') == self.user_id:
+                    self.messages.append(comment['message'])
+
+    def add_posts(self, posts):
+        """Adds the text and update time of an iterable of posts."""
+        for post in posts:
+            self.post_times.append(post['updated_time'])
+            text = post.get('message', post.get('story'))
+            if text:
+                self.posts.append(text)
+
+    def add_likes(self, likes):
+        """Adds the categories of an iterable of liked pages."""
+        for like in likes:
+            self.likes.append(like['category'])
+
+    def message_text(self):
+        """Returns all messages as one big string."""
+        return u' '.join(self.messages)
+
+    def post_text(self):
+        """Returns all posts as one big string."""
+        return u' '.join(self.posts)
+
+    def to_dict(self):
+        return {'id': self.user_id,
+                'name': self.name,
+                'messages': self.messages,
+                'posts': self.posts,
+                'post_times': self.post_times,
+                'likes': self.likes}
+
@@ -0,0 +1,247 @@
+#Local store of the Graph items that make up users' corpora.
+#Items are kept in a sqlite file keyed by user, connection and item id, along
+#with the newest item time seen on each connection. sync() then only asks
+#Graph for items since that mark, so a run after the first one downloads a
+#day of activity rather than a user's whole history, and corpus() rebuilds
+#the CorpusBuilder that stats/behavioral_analysis work from without
+#touching the network. The profile and the first page of every connection
+#are fetched in one batch request.
+import calendar
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from corpus import CorpusBuilder
+
+CONNECTIONS = ('outbox', 'posts', 'likes')
+
+#connections whose pages are decoded an item at a time (see GraphAPI.request)
+STREAMED = ('outbox',)
+
+#rows written per transaction while syncing
+WRITE_BATCH = 500
+
+
+def parse_time(stamp):
+    """Returns a Graph time as a unix timestamp, or None if it is empty."""
+    if not stamp:
+        return None
+    #Graph writes '2014-08-01T02:13:55+0000'; the offset is always +0000
+    return calendar.timegm(time.strptime(stamp[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def item_time(item):
+    """Returns the updated (or else created) time of a Graph item as a unix
+    timestamp, or None if it has neither."""
+    return parse_time(item.get('updated_time') or item.get('created_time'))
+
+
+def mark_time(item):
+    """Returns the time that since= filters an item on: its created time,
+    or the updated time of items that have none (e.g. message threads).
+
+    An edit moves a post's updated time but not where since= finds it, so
+    marking by updated time would skip posts created before the edit."""
+    return parse_time(item.get('created_time') or item.get('updated_time'))
+
+
+def full_name(profile):
+    """Returns 'first last' from a Graph profile, or its name field."""
+    names = [profile[key] for key in ('first_name', 'last_name')
+             if profile.get(key)]
+    return ' '.join(names) or profile.get('name', '')
+
+
+def item_key(item, body):
+    """Returns the id of an item, or a digest of its body if it has none."""
+    return item.get('id') or hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class CorpusStore(object):
+    """The Graph items of many users, in the sqlite database at filename.
+
+    One store can be shared by several threads (see ingest.ingest_users).
+    """
+
+    def __init__(self, filename='corpora.sqlite'):
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id TEXT PRIMARY KEY, name TEXT);"
+                "CREATE TABLE IF NOT EXISTS items ("
+                " user_id TEXT, connection TEXT, item_id TEXT, time INTEGER,"
+                " body TEXT, PRIMARY KEY (user_id, connection, item_id));"
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                " user_id TEXT, connection TEXT, since INTEGER, synced REAL,"
+                " PRIMARY KEY (user_id, connection));"
+                "CREATE TABLE IF NOT EXISTS aliases ("
+                " alias TEXT PRIMARY KEY, user_id TEXT);")
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def sync(self, graph, user='me', connections=CONNECTIONS, page_size=None,
+             until=None):
+        """Fetches the items of user that are newer than the store's copy
+        and returns the user's Graph id.
+
+        until (a unix timestamp) leaves out anything newer, e.g. to sync up
+        to the start of today only.
+
+        The profile and the first page of each connection are fetched in
+        one batch, using the marks of the id that user resolved to last
+        time. A first page is only kept if those marks are still the
+        user's; otherwise that connection is fetched again.
+        """
+        alias = self._alias(graph, user)
+        known = self._resolve(alias)
+        marks = dict((connection, self.since(known, connection)
+                      if known is not None else None)
+                     for connection in connections)
+        with graph.batch() as batch:
+            profile = batch.get_object(user)
+            pages = dict((connection,
+                          batch.get_connections(user, connection,
+                                                **self._args(marks[connection],
+                                                             page_size, until)))
+                         for connection in connections)
+        profile = profile.result()
+        user_id = profile['id']
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO users VALUES (?, ?)",
+                (user_id, full_name(profile)))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO aliases VALUES (?, ?)",
+                (alias, user_id))
+            self.connection.commit()
+        for connection in connections:
+            first_page = None
+            if marks[connection] == self.since(user_id, connection):
+                first_page = pages[connection].result()
+            self.sync_connection(graph, user_id, connection,
+                                 page_size=page_size, until=until,
+                                 first_page=first_page)
+        return user_id
+
+    def _alias(self, graph, user):
+        #'me' is a different user for every access token
+        if user == 'me' and graph.access_token:
+            token = graph.access_token.encode('utf-8')
+            return 'me:' + hashlib.sha1(token).hexdigest()
+        return user
+
+    def _resolve(self, alias):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT user_id FROM aliases WHERE alias = ?",
+                (alias,)).fetchone()
+        return row[0] if row else None
+
+    def _args(self, since, page_size, until):
+        args = {}
+        if since is not None:
+            args['since'] = since
+        if until is not None:
+            args['until'] = until
+        if page_size:
+            args['limit'] = page_size
+        return args
+
+    def sync_connection(self, graph, user_id, connection, page_size=None,
+                        until=None, first_page=None):
+        """Fetches the items of one connection newer than its high-water mark
+        and returns how many were fetched.
+
+        The mark is the newest mark_time seen. It only moves once the whole
+        connection has been read, so an interrupted sync starts over from
+        the old mark; items that are fetched twice (or that changed) replace
+        the stored copy. first_page is the connection's first page if it
+        was already fetched from the current mark (see sync).
+        """
+        since = self.since(user_id, connection)
+        items = graph.iter_connections(user_id, connection,
+                                       stream=connection in STREAMED,
+                                       first_page=first_page,
+                                       **self._args(since, page_size, until))
+        newest = since
+        count = 0
+        rows = []
+        for item in items:
+            body = json.dumps(item)
+            mark = mark_time(item)
+            if mark is not None and (newest is None or mark > newest):
+                newest = mark
+            rows.append((user_id, connection, item_key(item, body),
+                         item_time(item), body))
+            count += 1
+            if len(rows) >= WRITE_BATCH:
+                self._write(rows)
+                rows = []
+        self._write(rows)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+                (user_id, connection, newest, time.time()))
+            self.connection.commit()
+        return count
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+    def since(self, user_id, connection):
+        """Returns the high-water mark of a connection (a unix timestamp), or
+        None if it has never been synced."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT since FROM sync_state WHERE user_id = ? AND"
+                " connection = ?", (user_id, connection)).fetchone()
+        return row[0] if row else None
+
+    def users(self):
+        """Returns the ids of the users in the store."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT user_id FROM users ORDER BY user_id").fetchall()
+        return [row[0] for row in rows]
+
+    def items(self, user_id, connection):
+        """Returns the stored items of a connection, oldest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT body FROM items WHERE user_id = ? AND connection = ?"
+                " ORDER BY time, item_id", (user_id, connection)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def corpus(self, user_id):
+        """Returns a CorpusBuilder of everything stored for user_id."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT name FROM users WHERE user_id = ?",
+                (user_id,)).fetchone()
+        corpus = CorpusBuilder(user_id, row[0] if row else '')
+        corpus.add_messages(self.items(user_id, 'outbox'))
+        corpus.add_posts(self.items(user_id, 'posts'))
+        corpus.add_likes(self.items(user_id, 'likes'))
+        return corpus
+
+    def corpora(self):
+        """Returns a dict of user id -> CorpusBuilder for every user, e.g.
+        for behavioral_analysis.score_corpus_batch:
+
+            corpora = store.corpora()
+            scores = score_corpus_batch(dict((user_id, corpus.message_text())
+                                             for user_id, corpus in corpora.items()))
+        """
+        return dict((user_id, self.corpus(user_id)) for user_id in self.users())
@@ -33,25 +33,50 @@ if user:
 
 """
 
-import urllib
 import hashlib
 import hmac
 import base64
 import requests
 import json
 import re
+import threading
+
+from requests.adapters import HTTPAdapter
 
 # Find a query string parser
 try:
-    from urllib.parse import parse_qs
+    from urllib.parse import parse_qs, urlencode
 except ImportError:
     from urlparse import parse_qs
+    from urllib import urlencode
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
 
 from . import version
+from .cache import ExpiringCache, is_fresh
+from .jsonstream import CHUNK_SIZE, StreamedResponse
 
 
 __version__ = version.__version__
 
+FACEBOOK_GRAPH_URL = "https://graph.facebook.com/"
+
+# The Graph API rejects batch requests with more than this many operations.
+MAX_BATCH_SIZE = 50
+
+# get_user_from_cookie remembers users for at most this many seconds (or
+# until their access token expires, if that is sooner).
+COOKIE_CACHE_TTL = 300
+cookie_cache = ExpiringCache(max_entries=10000)
+
 
 class GraphAPI(object):
     """A client for the Facebook Graph API.
@@ -81,26 +106,32 @@ class GraphAPI(object):
     get_user_from_cookie() method below to get the OAuth access token
     for the active user from the cookie saved by the SDK.
 
+    Every request goes through a requests.Session owned by the client,
+    so connections to the Graph API are kept alive and reused. The pool
+    size and retry policy of that session can be set with pool_size and
+    retries (an integer or a urllib3 Retry object), or an existing
+    session can be passed in directly.
+
+    Pass a facebook.cache.GraphCache as cache to cache the responses of
+    GET requests.
+
     """
-    def __init__(self, access_token=None, timeout=None, version=None):
+    def __init__(self, access_token=None, timeout=None, version=None,
+                 session=None, pool_size=10, retries=0, cache=None):
         self.access_token = access_token
         self.timeout = timeout
+        self.cache = cache
 
-        valid_API_versions = ["1.0", "2.0", "2.1"]
-        if version:
-            version_regex = re.compile("^\d\.\d$")
-            match = version_regex.search(str(version))
-            if match is not None:
-                if str(version) not in valid_API_versions:
-                    raise GraphAPIError("Valid API versions are " +
-                                        str(valid_API_versions).strip('[]'))
-                else:
-                    self.version = "v" + str(version)
-            else:
-                raise GraphAPIError("Version number should be in the"
-                                    " following format: #.# (e.g. 1.0).")
-        else:
-            self.version = ""
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size,
+                                  max_retries=retries)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        self.version = _parse_version(version)
 
     def get_object(self, id, **args):
         """Fetchs the given object from the graph."""
@@ -111,14 +142,106 @@ class GraphAPI(object):
 
         We return a map from ID to object. If any of the IDs are
         invalid, we raise an exception.
+
+        With a cache, only the objects that are not fresh in the cache
+        are requested, and they are cached one by one.
         """
-        args["ids"] = ",".join(ids)
-        return self.request("", args)
+        if self.cache is None:
+            args["ids"] = ",".join(ids)
+            return self.request("", args)
+
+        key_args = dict(args)
+        if self.access_token:
+            key_args["access_token"] = self.access_token
+        result = {}
+        missing = []
+        for id in ids:
+            entry = self.cache.get(self.cache.key(id, key_args))
+            if entry is not None and is_fresh(entry):
+                self.cache.hit(entry)
+                result[id] = json.loads(entry.body)
+            else:
+                missing.append(id)
+        if missing:
+            self.cache.count("misses", len(missing))
+            args["ids"] = ",".join(missing)
+            fetched = self.request("", args)
+            for id, obj in fetched.items():
+                self.cache.set(id, self.cache.key(id, key_args),
+                               json.dumps(obj))
+            result.update(fetched)
+        return result
 
     def get_connections(self, id, connection_name, **args):
         """Fetchs the connections for given object."""
         return self.request(id + "/" + connection_name, args)
 
+    def iter_connections(self, id, connection_name, page_size=None,
+                         prefetch=0, stream=False, first_page=None, **args):
+        """Yields every connection of the given object, one at a time.
+
+        Pages are requested lazily by following the paging cursors (or
+        the paging "next" URL) of each response, so only the pages that
+        are being consumed are kept in memory. page_size sets the limit
+        of every request, and a positive prefetch fetches up to that
+        many pages ahead on a background thread. With stream=True the
+        items of each page are decoded one at a time as they arrive (see
+        request()) instead; prefetch is then ignored.
+
+            for post in graph.iter_connections("me", "posts", prefetch=2):
+                print(post["created_time"])
+
+        first_page is a page of the connection that was already fetched
+        with these arguments (e.g. in a batch); its items are yielded
+        and the pages after it are requested as above.
+
+        """
+        if page_size:
+            args["limit"] = page_size
+        if first_page is not None:
+            for item in first_page.get("data", []):
+                yield item
+            args = _next_page_args(first_page, args)
+            if args is None:
+                return
+        if stream:
+            for item in self._iter_streamed(id + "/" + connection_name,
+                                            args):
+                yield item
+            return
+        pages = self._iter_pages(id + "/" + connection_name, args)
+        if prefetch > 0:
+            pages = _prefetch(pages, prefetch)
+        try:
+            for page in pages:
+                for item in page.get("data", []):
+                    yield item
+        finally:
+            pages.close()
+
+    def _iter_pages(self, path, args):
+        """Yields the pages of a paginated connection in order."""
+        while args is not None:
+            page = self.request(path, dict(args))
+            yield page
+            args = _next_page_args(page, args)
+
+    def _iter_streamed(self, path, args):
+        """Yields the items of a paginated connection, streaming each page."""
+        while args is not None:
+            items = self.request(path, dict(args), stream=True)
+            count = 0
+            try:
+                for item in items:
+                    count += 1
+                    yield item
+            finally:
+                items.close()
+            # Only whether the page had any data matters here.
+            args = _next_page_args({"data": count,
+                                    "paging": items.members.get("paging", {})},
+                                   args)
+
     def put_object(self, parent_object, connection_name, **data):
         """Writes the given object to the graph, connected to the given parent.
 
@@ -203,11 +326,10 @@ class GraphAPI(object):
         """Fetches the current version number of the Graph API being used."""
         args = {"access_token": self.access_token}
         try:
-            response = requests.request("GET",
-                                        "https://graph.facebook.com/" +
-                                        self.version + "/me",
-                                        params=args,
-                                        timeout=self.timeout)
+            response = self.session.request("GET",
+                                            _graph_url(self.version, "me"),
+                                            params=args,
+                                            timeout=self.timeout)
         except requests.HTTPError as e:
             response = json.loads(e.read())
             raise GraphAPIError(response)
@@ -219,14 +341,27 @@ class GraphAPI(object):
         except Exception:
             raise GraphAPIError("API version number not available")
 
-    def request(
-            self, path, args=None, post_args=None, files=None, method=None):
+    def request(self, path, args=None, post_args=None, files=None,
+                method=None, stream=False):
         """Fetches the given path in the Graph API.
 
         We translate args to a valid query string. If post_args is
         given, we send a POST request to the given path with the given
         arguments.
 
+        GET requests are answered from the cache, if the client has one
+        and it holds a fresh response. A stale response with an ETag is
+        revalidated with If-None-Match. Requests for several ids are
+        cached per object by get_objects instead.
+
+        With stream=True, the response must be a JSON object and a
+        StreamedResponse is returned instead of the decoded object. It
+        decodes the items of the "data" array one at a time, as they are
+        read from the connection, so memory is bounded by the largest
+        item rather than the page. The other members (e.g. "paging")
+        are in its members dict once it has been iterated over. Streamed
+        responses are not cached.
+
         """
         args = args or {}
 
@@ -236,18 +371,44 @@ class GraphAPI(object):
             else:
                 args["access_token"] = self.access_token
 
+        cache_key = entry = None
+        request_headers = {}
+        if self.cache is not None and (method or "GET") == "GET" and \
+                not files and not stream and "ids" not in args:
+            cache_key = self.cache.key(path, args)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                if is_fresh(entry):
+                    self.cache.hit(entry)
+                    return json.loads(entry.body)
+                if entry.etag:
+                    request_headers["If-None-Match"] = entry.etag
+            # A revalidation only counts as a miss if the object changed.
+            if not request_headers:
+                self.cache.count("misses")
+
         try:
-            response = requests.request(method or "GET",
-                                        "https://graph.facebook.com/" +
-                                        self.version + path,
-                                        timeout=self.timeout,
-                                        params=args,
-                                        data=post_args,
-                                        files=files)
+            response = self.session.request(method or "GET",
+                                            _graph_url(self.version, path),
+                                            timeout=self.timeout,
+                                            params=args,
+                                            data=post_args,
+                                            files=files,
+                                            headers=request_headers,
+                                            stream=stream)
         except requests.HTTPError as e:
             response = json.loads(e.read())
             raise GraphAPIError(response)
 
+        if stream:
+            return self._stream_response(response)
+
+        if entry is not None and response.status_code == 304:
+            self.cache.refresh(path, cache_key, entry)
+            return json.loads(entry.body)
+        if request_headers:
+            self.cache.count("misses")
+
         headers = response.headers
         if 'json' in headers['content-type']:
             result = response.json()
@@ -269,8 +430,46 @@ class GraphAPI(object):
 
         if result and isinstance(result, dict) and result.get("error"):
             raise GraphAPIError(result)
+        if cache_key is not None and 'json' in headers['content-type']:
+            self.cache.set(path, cache_key, response.text,
+                           headers.get("etag"))
         return result
 
+    def _stream_response(self, response):
+        """Returns a StreamedResponse over the body of response."""
+        if response.status_code >= 400:
+            # Errors are small, and raising them here (rather than once
+            # iteration starts) lets callers retry the request.
+            try:
+                raise GraphAPIError(response.json())
+            finally:
+                response.close()
+        if 'json' not in response.headers.get('content-type', ''):
+            response.close()
+            raise GraphAPIError('Streamed responses must be JSON')
+        return StreamedResponse(response.iter_content(CHUNK_SIZE),
+                                error_class=GraphAPIError,
+                                close=response.close)
+
+    def batch(self):
+        """Returns a GraphBatch for sending several requests at once.
+
+        Requests added to the batch are not sent until the batch is
+        executed, at which point they are packed into as few Graph API
+        batch calls as possible. Each call returns a BatchResult:
+
+            batch = graph.batch()
+            profile = batch.get_object("me")
+            posts = batch.get_connections("me", "posts")
+            batch.execute()
+            print(profile.result()["name"])
+
+        See https://developers.facebook.com/docs/graph-api/making-multiple-requests
+        for details.
+
+        """
+        return GraphBatch(self)
+
     def fql(self, query):
         """FQL query.
 
@@ -320,6 +519,155 @@ class GraphAPI(object):
         return self.request("access_token", args=args)
 
 
+class GraphBatch(object):
+    """A queue of Graph API requests sent together as batch requests.
+
+    The batch can also be used as a context manager, in which case it
+    is executed when the block exits without an exception:
+
+        with graph.batch() as batch:
+            likes = batch.get_connections("me", "likes")
+        print(likes.result()["data"])
+
+    Results that are read before the batch has been executed trigger
+    the execution of the whole batch.
+
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.pending = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def get_object(self, id, **args):
+        """Queues a fetch of the given object."""
+        return self.add("GET", id, args)
+
+    def get_objects(self, ids, **args):
+        """Queues a fetch of all of the given objects."""
+        args["ids"] = ",".join(ids)
+        return self.add("GET", "", args)
+
+    def get_connections(self, id, connection_name, **args):
+        """Queues a fetch of the connections for the given object."""
+        return self.add("GET", id + "/" + connection_name, args)
+
+    def put_object(self, parent_object, connection_name, **data):
+        """Queues a write of the given object to the given parent."""
+        assert self.graph.access_token, \
+            "Write operations require an access token"
+        return self.add("POST", parent_object + "/" + connection_name,
+                        body=data)
+
+    def delete_object(self, id):
+        """Queues a delete of the object with the given ID."""
+        return self.add("DELETE", id)
+
+    def add(self, method, path, args=None, body=None):
+        """Queues a request and returns its BatchResult.
+
+        path is relative to the API version, args are sent in the query
+        string and body (for POST requests) in the request body.
+
+        """
+        relative_url = path
+        if args:
+            relative_url += "?" + urlencode(args)
+        operation = {"method": method, "relative_url": relative_url}
+        if body:
+            operation["body"] = urlencode(body)
+        result = BatchResult(self)
+        self.pending.append((operation, result))
+        return result
+
+    def execute(self):
+        """Sends all queued requests, MAX_BATCH_SIZE at a time.
+
+        A failure of a whole batch call is recorded on every result in
+        that call, so one failure does not prevent the other calls from
+        being made. Any other exception (e.g. a connection error) puts
+        the requests that were not sent back in the queue.
+
+        """
+        pending, self.pending = self.pending, []
+        while pending:
+            chunk = pending[:MAX_BATCH_SIZE]
+            post_args = {
+                "batch": json.dumps([operation for operation, _ in chunk]),
+                "include_headers": "false"}
+            try:
+                responses = self.graph.request("", post_args=post_args,
+                                               method="POST")
+            except GraphAPIError as e:
+                for _, result in chunk:
+                    result.set_error(e)
+            except Exception:
+                self.pending = pending + self.pending
+                raise
+            else:
+                for (_, result), response in zip(chunk, responses):
+                    result.set_response(response)
+                # A short response list is treated like null responses.
+                for _, result in chunk[len(responses):]:
+                    result.set_error(
+                        GraphAPIError("Batch operation did not complete"))
+            pending = pending[MAX_BATCH_SIZE:]
+
+
+class BatchResult(object):
+    """The eventual result of a single request in a GraphBatch."""
+    def __init__(self, batch):
+        self.batch = batch
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def done(self):
+        """Returns True if the request has completed."""
+        return self._done
+
+    def result(self):
+        """Returns the decoded response, executing the batch if needed.
+
+        Raises GraphAPIError if the request failed.
+
+        """
+        if not self._done:
+            self.batch.execute()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def set_response(self, response):
+        # The Graph API returns null for operations that did not
+        # complete before the batch timed out.
+        if response is None:
+            self.set_error(GraphAPIError("Batch operation did not complete"))
+            return
+        body = response.get("body")
+        try:
+            value = json.loads(body) if body else None
+        except ValueError:
+            value = body
+        if isinstance(value, dict) and value.get("error"):
+            self.set_error(GraphAPIError(value))
+            return
+        self._value = value
+        self._done = True
+
+    def set_error(self, error):
+        self._error = error
+        self._done = True
+
+
 class GraphAPIError(Exception):
     def __init__(self, result):
         self.result = result
@@ -328,6 +676,17 @@ class GraphAPIError(Exception):
         except:
             self.type = ""
 
+        # Graph API errors carry a numeric code (e.g. 4, 17 or 613 when
+        # the application, user or method is being rate limited), and so
+        # do REST server style errors. Other errors have no code.
+        try:
+            code = result["error"]["code"]
+        except:
+            code = self.type
+        if isinstance(code, bool) or not isinstance(code, int):
+            code = None
+        self.code = code
+
         # OAuth 2.0 Draft 10
         try:
             self.message = result["error_description"]
@@ -345,7 +704,102 @@ class GraphAPIError(Exception):
         Exception.__init__(self, self.message)
 
 
-def get_user_from_cookie(cookies, app_id, app_secret):
+def _parse_version(version):
+    """Returns the URL prefix of the given Graph API version, e.g. "v2.0".
+
+    Returns an empty string (the unversioned API) if version is None.
+
+    """
+    valid_API_versions = ["1.0", "2.0", "2.1"]
+    if version:
+        version_regex = re.compile("^\d\.\d$")
+        match = version_regex.search(str(version))
+        if match is not None:
+            if str(version) not in valid_API_versions:
+                raise GraphAPIError("Valid API versions are " +
+                                    str(valid_API_versions).strip('[]'))
+            else:
+                return "v" + str(version)
+        else:
+            raise GraphAPIError("Version number should be in the"
+                                " following format: #.# (e.g. 1.0).")
+    else:
+        return ""
+
+
+def _graph_url(version, path):
+    """Returns the URL of path in the given version of the Graph API."""
+    if version:
+        return FACEBOOK_GRAPH_URL + version + "/" + path
+    return FACEBOOK_GRAPH_URL + path
+
+
+def _next_page_args(page, args):
+    """Returns the request arguments for the page after the given one.
+
+    Returns None if the given page is the last one.
+
+    """
+    paging = page.get("paging", {})
+    if not page.get("data") or "next" not in paging:
+        return None
+    after = paging.get("cursors", {}).get("after")
+    if after:
+        args = dict(args)
+        args["after"] = after
+        return args
+    # Time-based pagination (since/until) only has a "next" URL.
+    query = parse_qs(urlparse(paging["next"]).query)
+    query.pop("access_token", None)
+    return dict((key, values[0]) for key, values in query.items())
+
+
+def _prefetch(iterator, count):
+    """Consumes iterator on a background thread, count items ahead.
+
+    Exceptions raised by iterator are re-raised by the returned
+    generator. Closing the generator stops the background thread.
+
+    """
+    queue = Queue(maxsize=count)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=produce, name="graph-prefetch")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def get_user_from_cookie(cookies, app_id, app_secret, cache=cookie_cache):
     """Parses the cookie set by the official Facebook JavaScript SDK.
 
     cookies should be a dictionary-like object mapping cookie names to
@@ -362,10 +816,22 @@ def get_user_from_cookie(cookies, app_id, app_secret):
     authentication at
     http://developers.facebook.com/docs/authentication/.
 
+    Users are cached by their signed cookie for COOKIE_CACHE_TTL seconds,
+    or until their access token expires if that is sooner, so repeated
+    page views from the same session neither verify the signature nor
+    exchange the code again. Pass cache=None to disable this.
+
     """
     cookie = cookies.get("fbsr_" + app_id, "")
     if not cookie:
         return None
+    # The whole cookie is the key: the signature only vouches for the
+    # payload it was computed over.
+    cache_key = app_id + ":" + cookie
+    if cache is not None:
+        user = cache.get(cache_key)
+        if user is not None:
+            return dict(user)
     parsed_request = parse_signed_request(cookie, app_secret)
     if not parsed_request:
         return None
@@ -375,6 +841,13 @@ def get_user_from_cookie(cookies, app_id, app_secret):
     except GraphAPIError:
         return None
     result["uid"] = parsed_request["user_id"]
+    if cache is not None:
+        ttl = COOKIE_CACHE_TTL
+        try:
+            ttl = min(ttl, int(result["expires"]))
+        except (KeyError, ValueError):
+            pass
+        cache.set(cache_key, dict(result), ttl)
     return result
 
 
@@ -426,7 +899,7 @@ def auth_url(app_id, canvas_url, perms=None, **kwargs):
     if perms:
         kvps['scope'] = ",".join(perms)
     kvps.update(kwargs)
-    return url + urllib.urlencode(kvps)
+    return url + urlencode(kvps)
 
 
 def get_access_token_from_code(code, redirect_uri, app_id, app_secret):
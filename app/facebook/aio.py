@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""asyncio client for the Facebook Graph API.
+
+AsyncGraphAPI has the same methods as facebook.GraphAPI, as coroutines,
+so a single event loop can keep many Graph API requests in flight:
+
+    async with AsyncGraphAPI(access_token, max_concurrency=200) as graph:
+        profiles = await asyncio.gather(
+            *[graph.get_object(id) for id in ids])
+        async for post in graph.iter_connections("me", "posts"):
+            print(post["created_time"])
+
+This module requires Python 3.6 or later and the aiohttp package.
+
+"""
+
+import asyncio
+
+import aiohttp
+
+from . import (GraphAPIError, _graph_url, _next_page_args, _parse_version,
+               parse_qs)
+
+
+class AsyncGraphAPI(object):
+    """An asyncio client for the Facebook Graph API.
+
+    Requests go through an aiohttp.ClientSession, which keeps a pool of
+    up to pool_size connections. Pass session to share one pool between
+    several clients (the client then leaves closing it to the caller).
+    At most max_concurrency requests of a client are in flight at once;
+    the others wait for their turn.
+
+    """
+    def __init__(self, access_token=None, timeout=None, version=None,
+                 session=None, pool_size=100, max_concurrency=100):
+        self.access_token = access_token
+        self.timeout = timeout
+        self.version = _parse_version(version)
+        self.pool_size = pool_size
+        self.session = session
+        self._owns_session = session is None
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Closes the client's session, unless it was passed in."""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def _get_semaphore(self):
+        # Created in the running loop: before Python 3.10, a Semaphore is
+        # bound to the loop that is current when it is created.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def get_object(self, id, **args):
+        """Fetchs the given object from the graph."""
+        return await self.request(id, args)
+
+    async def get_objects(self, ids, **args):
+        """Fetchs all of the given object from the graph.
+
+        We return a map from ID to object. If any of the IDs are
+        invalid, we raise an exception.
+        """
+        args["ids"] = ",".join(ids)
+        return await self.request("", args)
+
+    async def get_connections(self, id, connection_name, **args):
+        """Fetchs the connections for given object."""
+        return await self.request(id + "/" + connection_name, args)
+
+    async def iter_connections(self, id, connection_name, page_size=None,
+                               prefetch=0, **args):
+        """Yields every connection of the given object, one at a time.
+
+        Like GraphAPI.iter_connections, but an asynchronous generator. A
+        positive prefetch fetches up to that many pages ahead in a
+        background task.
+
+        """
+        if page_size:
+            args["limit"] = page_size
+        pages = self._iter_pages(id + "/" + connection_name, args)
+        if prefetch > 0:
+            pages = _prefetch(pages, prefetch)
+        try:
+            async for page in pages:
+                for item in page.get("data", []):
+                    yield item
+        finally:
+            await pages.aclose()
+
+    async def _iter_pages(self, path, args):
+        while args is not None:
+            page = await self.request(path, dict(args))
+            yield page
+            args = _next_page_args(page, args)
+
+    async def put_object(self, parent_object, connection_name, **data):
+        """Writes the given object to the graph, connected to the given parent.
+
+        See GraphAPI.put_object.
+
+        """
+        assert self.access_token, "Write operations require an access token"
+        return await self.request(parent_object + "/" + connection_name,
+                                  post_args=data,
+                                  method="POST")
+
+    async def delete_object(self, id):
+        """Deletes the object with the given ID from the graph."""
+        await self.request(id, method="DELETE")
+
+    async def request(
+            self, path, args=None, post_args=None, files=None, method=None):
+        """Fetches the given path in the Graph API.
+
+        We translate args to a valid query string. If post_args is
+        given, we send a POST request to the given path with the given
+        arguments.
+
+        """
+        args = dict((key, str(value)) for key, value in (args or {}).items())
+
+        if self.access_token:
+            if post_args is not None:
+                post_args["access_token"] = self.access_token
+            else:
+                args["access_token"] = self.access_token
+
+        data = post_args
+        if files:
+            data = aiohttp.FormData()
+            for key, value in (post_args or {}).items():
+                data.add_field(key, str(value))
+            for key, value in files.items():
+                data.add_field(key, value)
+
+        timeout = None
+        if self.timeout:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with self._get_semaphore():
+            async with self._get_session().request(
+                    method or "GET", _graph_url(self.version, path),
+                    params=args, data=data, timeout=timeout) as response:
+                content_type = response.headers.get("content-type", "")
+                if 'json' in content_type:
+                    result = await response.json(content_type=None)
+                elif 'image/' in content_type:
+                    result = {"data": await response.read(),
+                              "mime-type": content_type,
+                              "url": str(response.url)}
+                else:
+                    query_str = parse_qs(await response.text())
+                    if "access_token" in query_str:
+                        result = {"access_token": query_str["access_token"][0]}
+                        if "expires" in query_str:
+                            result["expires"] = query_str["expires"][0]
+                    else:
+                        raise GraphAPIError('Maintype was not text, image, '
+                                            'or querystring')
+
+        if result and isinstance(result, dict) and result.get("error"):
+            raise GraphAPIError(result)
+        return result
+
+
+async def _prefetch(iterator, count):
+    """Consumes iterator in a background task, count items ahead."""
+    queue = asyncio.Queue(maxsize=count)
+    done = object()
+
+    async def produce():
+        try:
+            async for item in iterator:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((None, e))
+        else:
+            await queue.put((done, None))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        task.cancel()
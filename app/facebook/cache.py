@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Response caching for GraphAPI.
+
+A GraphCache passed to GraphAPI caches the JSON responses of GET
+requests:
+
+    cache = facebook.cache.GraphCache(max_entries=10000, ttl=600,
+                                      ttls={"*/feed": 60},
+                                      filename="graph-cache.sqlite")
+    graph = facebook.GraphAPI(access_token, cache=cache)
+
+Fresh responses are served from memory (or from the optional sqlite
+file) without a request. Stale responses that came with an ETag are
+revalidated with If-None-Match, so an unchanged object costs a 304
+instead of a full body. cache.stats() returns hit, miss, revalidation,
+eviction and byte counters; a revalidated response counts as a
+revalidation, not a miss.
+
+ExpiringCache is the simpler map that get_user_from_cookie keeps the
+users of recently seen cookies in.
+
+"""
+
+import fnmatch
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+# body is the response text (so every hit returns a fresh copy of the
+# object), expires a time.time() timestamp.
+CacheEntry = namedtuple("CacheEntry", ["body", "etag", "expires"])
+
+
+class LRUCache(object):
+    """A thread-safe in-memory map of at most max_entries entries that
+    evicts the least recently used entry first."""
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ExpiringCache(object):
+    """A thread-safe LRU map whose values expire after their own TTL."""
+    def __init__(self, max_entries=1024):
+        self.entries = LRUCache(max_entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the value stored under key, or None if it expired."""
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires <= time.time():
+            self.entries.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        """Stores value under key for ttl seconds."""
+        self.entries.set(key, (value, time.time() + ttl))
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SqliteCache(object):
+    """An on-disk map of at most max_entries cache entries, kept in a
+    sqlite database, that evicts the least recently used entry first."""
+    def __init__(self, filename, max_entries=65536):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS graph_cache ("
+                "key TEXT PRIMARY KEY, body TEXT, etag TEXT, expires REAL)")
+            columns = [row[1] for row in self.connection.execute(
+                "PRAGMA table_info(graph_cache)")]
+            if "used" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE graph_cache ADD COLUMN used INTEGER "
+                    "NOT NULL DEFAULT 0")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS graph_cache_used "
+                "ON graph_cache (used)")
+            self.connection.commit()
+            self.entries, self.clock = self.connection.execute(
+                "SELECT COUNT(*), MAX(used) FROM graph_cache").fetchone()
+            self.clock = self.clock or 0
+
+    def __len__(self):
+        return self.entries
+
+    def tick(self):
+        """Returns the next value of the use counter."""
+        self.clock += 1
+        return self.clock
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, etag, expires FROM graph_cache WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE graph_cache SET used = ? WHERE key = ?",
+                (self.tick(), key))
+            self.connection.commit()
+        return CacheEntry(*row)
+
+    def set(self, key, entry):
+        with self.lock:
+            updated = self.connection.execute(
+                "UPDATE graph_cache SET body = ?, etag = ?, expires = ?, "
+                "used = ? WHERE key = ?",
+                tuple(entry) + (self.tick(), key)).rowcount
+            if not updated:
+                self.connection.execute(
+                    "INSERT INTO graph_cache (key, body, etag, expires, used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key,) + tuple(entry) + (self.clock,))
+                self.entries += 1
+            if self.entries > self.max_entries:
+                # Another process may share the file, so count again.
+                self.entries = self.connection.execute(
+                    "SELECT COUNT(*) FROM graph_cache").fetchone()[0]
+                excess = self.entries - self.max_entries
+                if excess > 0:
+                    self.connection.execute(
+                        "DELETE FROM graph_cache WHERE key IN ("
+                        "SELECT key FROM graph_cache ORDER BY used LIMIT ?)",
+                        (excess,))
+                    self.entries -= excess
+                    self.evictions += excess
+            self.connection.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.entries -= self.connection.execute(
+                "DELETE FROM graph_cache WHERE key = ?", (key,)).rowcount
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM graph_cache")
+            self.connection.commit()
+            self.entries = 0
+
+
+class GraphCache(object):
+    """Caches Graph API GET responses in memory and, optionally, on disk.
+
+    Responses stay fresh for ttl seconds, or for the TTL of the first
+    pattern in ttls (a dict of fnmatch patterns, e.g. "*/feed", to
+    seconds) that matches the request path. Responses are keyed by path,
+    arguments and (a hash of) the access token, since what "me" is
+    depends on who is asking. The sqlite file keeps at most
+    max_disk_entries responses.
+
+    """
+    def __init__(self, max_entries=1024, ttl=300, ttls=None, filename=None,
+                 max_disk_entries=65536):
+        self.memory = LRUCache(max_entries)
+        self.disk = SqliteCache(filename, max_disk_entries) \
+            if filename else None
+        self.default_ttl = ttl
+        self.ttls = list((ttls or {}).items())
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ["hits", "misses", "revalidations", "stores",
+             "bytes_served", "bytes_fetched"], 0)
+
+    def ttl(self, path):
+        """Returns the number of seconds a response to path stays fresh."""
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatchcase(path, pattern):
+                return ttl
+        return self.default_ttl
+
+    def key(self, path, args):
+        """Returns the cache key of a GET of path with the given args."""
+        args = dict(args)
+        token = args.pop("access_token", None) or ""
+        token = hashlib.sha1(token.encode("utf-8")).hexdigest()
+        return "%s %s?%s" % (token, path, urlencode(sorted(args.items())))
+
+    def get(self, key):
+        """Returns the entry stored under key, fresh or not, or None."""
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    def set(self, path, key, body, etag=None):
+        """Stores a response body for path under key."""
+        entry = CacheEntry(body, etag, time.time() + self.ttl(path))
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+        self.count("stores")
+        self.count("bytes_fetched", len(body))
+
+    def refresh(self, path, key, entry):
+        """Marks an entry fresh again after a 304 Not Modified."""
+        entry = entry._replace(expires=time.time() + self.ttl(path))
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+        self.count("revalidations")
+        self.count("bytes_served", len(entry.body))
+
+    def hit(self, entry):
+        """Counts a response served from entry without a request."""
+        self.count("hits")
+        self.count("bytes_served", len(entry.body))
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """Returns a dict of the cache's counters."""
+        with self.lock:
+            stats = dict(self.counters)
+        stats["evictions"] = self.memory.evictions
+        stats["entries"] = len(self.memory)
+        if self.disk is not None:
+            stats["disk_evictions"] = self.disk.evictions
+            stats["disk_entries"] = len(self.disk)
+        return stats
+
+
+def is_fresh(entry):
+    return entry.expires > time.time()
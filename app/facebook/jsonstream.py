@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Incremental decoding of Graph API responses.
+
+GraphAPI.request(..., stream=True) returns a StreamedResponse, which
+decodes the items of the response's "data" array one at a time as they
+come off the socket, so that only the item being decoded (and not the
+whole page) is held in memory.
+
+"""
+
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+
+class StreamedResponse(object):
+    """Iterates over the items of the "data" array of a JSON object.
+
+    chunks is an iterable of bytes, e.g. response.iter_content(). The
+    other members of the object (such as "paging") are decoded as they
+    are met and can be read from the members dict once iteration is
+    over. If the object has an "error" member, error_class is raised
+    with the object.
+
+    """
+    def __init__(self, chunks, error_class=ValueError, close=None):
+        self.members = {}
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._error_class = error_class
+        self._close = close
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def close(self):
+        """Releases the underlying connection."""
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __iter__(self):
+        try:
+            for item in self._items():
+                yield item
+        finally:
+            self.close()
+
+    def _items(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "data" and self._peek() == "[":
+                self._pos += 1
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.members[key] = self._value()
+                if key == "error":
+                    raise self._error_class(self.members)
+            if self._expect(",}") == "}":
+                return
+
+    def _fill(self):
+        """Reads another chunk into the buffer; returns False at the end."""
+        if self._eof:
+            return False
+        # Drop what has been decoded already, so the buffer only ever
+        # holds the item being decoded.
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._decoder.decode(b"", True)
+        self._eof = True
+        return True
+
+    def _peek(self):
+        """Returns the next non-whitespace character, without consuming it."""
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON response")
+
+    def _expect(self, characters):
+        """Consumes and returns the next character, one of characters."""
+        character = self._peek()
+        if character not in characters:
+            raise ValueError("Expected one of %r in JSON response, got %r"
+                             % (characters, character))
+        self._pos += 1
+        return character
+
+    def _value(self):
+        """Decodes the next JSON value, reading chunks until it is whole."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number (or literal) at the very end of the buffer may go
+            # on in the next chunk.
+            if end < len(self._buffer) or self._eof:
+                self._pos = end
+                return value
+            self._fill()
@@ -21,12 +21,20 @@
 
 """
 In-memory persistent stub for the Python datastore API. Gets, queries,
-and searches are implemented as in-memory scans over all entities.
+and searches are implemented as in-memory scans over all entities. Queries
+with filters or sort orders on a property first narrow the scan with a
+sorted in-memory index of that property, built on first use.
 
 Stores entities across sessions as pickled proto bufs in a single file. On
 startup, all entities are read from the file and loaded into memory. On
 every Put(), the file is wiped and all entities are written from scratch.
 Clients can also manually Read() and Write() the file themselves.
+
+With use_journal=True, each commit instead appends the entities it changed
+to a journal next to the datastore file, which is replayed on startup. When
+the journal grows past journal_compaction_ratio times the size of the
+datastore file, a background thread rewrites the datastore file and starts
+a new journal.
 """
 
 
@@ -40,6 +48,7 @@ Clients can also manually Read() and Write() the file themselves.
 
 
 
+import bisect
 import collections
 import logging
 import os
@@ -58,6 +67,7 @@ from google.appengine.api import datastore
 from google.appengine.api import datastore_types
 from google.appengine.datastore import datastore_pb
 from google.appengine.datastore import datastore_stub_util
+from google.appengine.datastore import sortable_pb_encoder
 from google.appengine.runtime import apiproxy_errors
 from google.net.proto import ProtocolBuffer
 from google.appengine.datastore import entity_pb
@@ -67,11 +77,74 @@ from google.appengine.datastore import entity_pb
 datastore_pb.Query.__hash__ = lambda self: hash(self.Encode())
 
 
+
+_JOURNAL_RECORD = struct.Struct('>cI')
+_JOURNAL_PUT = 'P'
+_JOURNAL_DELETE = 'D'
+_JOURNAL_COMMIT = 'C'
+
+
+
+_JOURNAL_MIN_COMPACTION_SIZE = 1 << 20
+
+
+
+
+
+_INDEX_RANGE_TYPES = frozenset([
+    entity_pb.PropertyValue.kint64Value,
+    entity_pb.PropertyValue.kbooleanValue,
+    entity_pb.PropertyValue.kstringValue,
+    entity_pb.PropertyValue.kdoubleValue,
+])
+
+
+
+
+_INDEX_JOIN_RATIO = 8
+
+
 def _FinalElement(key):
   """Return final element of a key's path."""
   return key.path().element_list()[-1]
 
 
+def _EncodeIndexValue(value):
+  """Encodes an entity_pb.PropertyValue so that encodings sort like values."""
+  encoder = sortable_pb_encoder.Encoder()
+  value.Output(encoder)
+  return encoder.buffer().tostring()
+
+
+def _IndexSlice(index, op, value):
+  """Returns the (start, end) positions of the rows matching a filter.
+
+  Args:
+    index: a sorted list of (encoded value, entity key) rows.
+    op: a datastore_pb.Query_Filter operator.
+    value: the encoded value the filter compares against.
+
+  Returns:
+    A (start, end) tuple, or None if op is not supported.
+  """
+
+
+
+  below = bisect.bisect_left(index, (value,))
+  above = bisect.bisect_left(index, (value + '\x00',))
+  if op == datastore_pb.Query_Filter.EQUAL:
+    return below, above
+  elif op == datastore_pb.Query_Filter.GREATER_THAN:
+    return above, len(index)
+  elif op == datastore_pb.Query_Filter.GREATER_THAN_OR_EQUAL:
+    return below, len(index)
+  elif op == datastore_pb.Query_Filter.LESS_THAN:
+    return 0, below
+  elif op == datastore_pb.Query_Filter.LESS_THAN_OR_EQUAL:
+    return 0, above
+  return None
+
+
 class _StoredEntity(object):
   """Simple wrapper around an entity stored by the stub.
 
@@ -304,7 +377,9 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
                save_changes=True,
                root_path=None,
                use_atexit=True,
-               auto_id_policy=datastore_stub_util.SEQUENTIAL):
+               auto_id_policy=datastore_stub_util.SEQUENTIAL,
+               use_journal=False,
+               journal_compaction_ratio=1.0):
     """Constructor.
 
     Initializes and loads the datastore from the backing files, if they exist.
@@ -327,6 +402,12 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
       root_path: string, the root path of the app.
       use_atexit: bool, indicates if the stub should save itself atexit.
       auto_id_policy: enum, datastore_stub_util.SEQUENTIAL or .SCATTERED
+      use_journal: bool, default False. If True, writes append the changed
+        entities to datastore_file + '.journal' instead of rewriting
+        datastore_file.
+      journal_compaction_ratio: float, the journal is compacted into
+        datastore_file once it is this many times larger than
+        datastore_file (and at least 1MB).
     """
 
 
@@ -339,6 +420,22 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
 
 
+    self.__journal_pending = None
+    if use_journal and self.__IsSaveable():
+      self.__journal_pending = {}
+    self.__journal_file = '%s.journal' % datastore_file
+    self.__compacting_file = '%s.compacting' % self.__journal_file
+    self.__journal_compaction_ratio = journal_compaction_ratio
+    self.__journal = None
+    self.__journal_size = 0
+    self.__journal_reset = False
+    self.__journal_lock = threading.Lock()
+    self.__snapshot_size = 0
+    self.__compaction_thread = None
+
+
+
+
 
 
 
@@ -349,6 +446,10 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
 
 
+    self.__property_indexes = collections.defaultdict(dict)
+
+
+
 
     self.__schema_cache = {}
 
@@ -384,7 +485,13 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
       self.__entities_by_kind = collections.defaultdict(dict)
       self.__entities_by_group = collections.defaultdict(dict)
+      self.__property_indexes = collections.defaultdict(dict)
       self.__schema_cache = {}
+
+
+      if self.__journal_pending is not None:
+        self.__journal_pending = {}
+        self.__journal_reset = True
     finally:
       self.__entities_lock.release()
 
@@ -431,6 +538,12 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
     assert not insert or k not in self.__entities_by_kind[app_kind]
 
+    if app_kind in self.__property_indexes:
+      old = self.__entities_by_kind[app_kind].get(k)
+      if old is not None:
+        self.__UnindexEntity(app_kind, k, old.protobuf)
+      self.__IndexEntity(app_kind, k, entity)
+
     self.__entities_by_kind[app_kind][k] = _StoredEntity(entity)
     self.__entities_by_group[eg_k][k] = entity
 
@@ -489,6 +602,82 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
         if last_path.id():
           self._SetMaxId(last_path.id())
 
+      if os.path.isfile(self.__datastore_file):
+        self.__snapshot_size = os.path.getsize(self.__datastore_file)
+
+      if self.__journal_pending is not None:
+
+
+        self.__ReplayJournal(self.__compacting_file)
+        self.__journal_size = self.__ReplayJournal(self.__journal_file)
+
+  def __ReplayJournal(self, filename):
+    """Applies the committed changes in a journal file to memory.
+
+    An incomplete commit at the end of the file (e.g. from a crash while it
+    was being appended) is dropped and truncated away.
+
+    Returns:
+      The size of the committed part of the file.
+    """
+    if not os.path.isfile(filename):
+      return 0
+    journal = open(filename, 'rb')
+    try:
+      data = journal.read()
+    finally:
+      journal.close()
+
+    changes = []
+    committed = pos = 0
+    while pos + _JOURNAL_RECORD.size <= len(data):
+      op, length = _JOURNAL_RECORD.unpack_from(data, pos)
+      start = pos + _JOURNAL_RECORD.size
+      pos = start + length
+      if pos > len(data):
+        break
+      if op == _JOURNAL_COMMIT:
+        for op, encoded in changes:
+          self.__ReplayChange(filename, op, encoded)
+        changes = []
+        committed = pos
+      elif op in (_JOURNAL_PUT, _JOURNAL_DELETE):
+        changes.append((op, data[start:pos]))
+      else:
+        raise apiproxy_errors.ApplicationError(
+            datastore_pb.Error.INTERNAL_ERROR,
+            self.READ_ERROR_MSG % (filename, 'Bad journal record %r' % op))
+
+    if committed < len(data):
+      logging.warning('Dropping an incomplete commit at the end of %s',
+                      filename)
+      journal = open(filename, 'r+b')
+      try:
+        journal.truncate(committed)
+      finally:
+        journal.close()
+    return committed
+
+  def __ReplayChange(self, filename, op, encoded):
+    """Applies one journaled put or delete to memory."""
+    try:
+      if op == _JOURNAL_PUT:
+        entity = entity_pb.EntityProto(encoded)
+      else:
+        key = entity_pb.Reference(encoded)
+    except self.READ_PB_EXCEPTIONS, e:
+      raise apiproxy_errors.ApplicationError(
+          datastore_pb.Error.INTERNAL_ERROR,
+          self.READ_ERROR_MSG % (filename, e))
+
+    if op == _JOURNAL_PUT:
+      self._StoreEntity(entity)
+      last_path = _FinalElement(entity.key())
+      if last_path.id():
+        self._SetMaxId(last_path.id())
+    else:
+      self.__RemoveEntity(key)
+
   def Write(self):
     """Writes out the datastore and history files.
 
@@ -505,13 +694,109 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     """ Writes out the datastore file. Be careful! If the file already exists,
     this method overwrites it!
     """
-    if self.__IsSaveable():
+    if self.__journal_pending is not None:
+      self.__WriteJournal()
+    elif self.__IsSaveable():
       encoded = []
       for kind_dict in self.__entities_by_kind.values():
         encoded.extend(entity.encoded_protobuf for entity in kind_dict.values())
 
       self.__WritePickled(encoded, self.__datastore_file)
 
+  def __WriteJournal(self):
+    """Appends the changes since the last write to the journal.
+
+    Compacts the journal into the datastore file if it has grown too large,
+    or if the datastore was cleared since the last write.
+    """
+
+
+    self.__journal_lock.acquire()
+    try:
+      if self.__journal_reset and self.__compaction_thread:
+        self.__compaction_thread.join()
+
+      self.__entities_lock.acquire()
+      try:
+        pending, self.__journal_pending = self.__journal_pending, {}
+        compact, self.__journal_reset = self.__journal_reset, False
+        if not compact and not (self.__compaction_thread and
+                                self.__compaction_thread.is_alive()):
+          compact = self.__journal_size > (
+              self.__journal_compaction_ratio *
+              max(self.__snapshot_size, _JOURNAL_MIN_COMPACTION_SIZE))
+        if compact:
+          encoded = []
+          for kind_dict in self.__entities_by_kind.values():
+            encoded.extend(entity.encoded_protobuf
+                           for entity in kind_dict.values())
+      finally:
+        self.__entities_lock.release()
+
+      if pending:
+        self.__AppendJournal(pending.values())
+      if compact:
+        self.__RotateJournal()
+        self.__compaction_thread = threading.Thread(
+            target=self.__Compact, args=(encoded,))
+        self.__compaction_thread.daemon = True
+        self.__compaction_thread.start()
+    finally:
+      self.__journal_lock.release()
+
+  def __AppendJournal(self, changes):
+    """Appends a list of (op, encoded) changes and a commit record."""
+    records = []
+    for op, encoded in changes:
+      records.append(_JOURNAL_RECORD.pack(op, len(encoded)))
+      records.append(encoded)
+    records.append(_JOURNAL_RECORD.pack(_JOURNAL_COMMIT, 0))
+    data = ''.join(records)
+
+    if self.__journal is None:
+      self.__journal = open(self.__journal_file, 'ab')
+    self.__journal.write(data)
+    self.__journal.flush()
+    self.__journal_size += len(data)
+
+  def __RotateJournal(self):
+    """Moves the journal aside for compaction and starts a new one."""
+    if self.__journal is not None:
+      self.__journal.close()
+      self.__journal = None
+    if not os.path.isfile(self.__journal_file):
+      return
+    if os.path.isfile(self.__compacting_file):
+
+
+      compacting = open(self.__compacting_file, 'ab')
+      journal = open(self.__journal_file, 'rb')
+      try:
+        compacting.write(journal.read())
+      finally:
+        journal.close()
+        compacting.close()
+      os.remove(self.__journal_file)
+    else:
+      os.rename(self.__journal_file, self.__compacting_file)
+    self.__journal_size = 0
+
+  def __Compact(self, encoded):
+    """Writes the given entities as the datastore file and drops the journal
+    they were compacted from."""
+    try:
+      if encoded:
+        self.__WritePickled(encoded, self.__datastore_file)
+      elif os.path.isfile(self.__datastore_file):
+        os.remove(self.__datastore_file)
+      if os.path.isfile(self.__datastore_file):
+        self.__snapshot_size = os.path.getsize(self.__datastore_file)
+      else:
+        self.__snapshot_size = 0
+      os.remove(self.__compacting_file)
+    except (IOError, OSError), e:
+      logging.warning('Could not compact %s: %s', self.__journal_file, e)
+
   def __ReadPickled(self, filename):
     """Reads a pickled object from the given file and returns it.
     """
@@ -610,6 +895,10 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     self.__entities_lock.acquire()
     try:
       self._StoreEntity(entity, insert)
+      if self.__journal_pending is not None:
+        app_kind, _, k = self._GetEntityLocation(entity.key())
+        self.__journal_pending[k] = (
+            _JOURNAL_PUT, self.__entities_by_kind[app_kind][k].encoded_protobuf)
     finally:
       self.__entities_lock.release()
 
@@ -624,10 +913,26 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
       pass
 
   def _Delete(self, key):
+    self.__entities_lock.acquire()
+    try:
+      self.__RemoveEntity(key)
+      if self.__journal_pending is not None:
+        k = datastore_types.ReferenceToKeyValue(key)
+        self.__journal_pending[k] = (_JOURNAL_DELETE, key.Encode())
+    finally:
+      self.__entities_lock.release()
+
+  def __RemoveEntity(self, key):
+    """Removes the entity with the given key, if any.
+
+    Any needed locking should be managed by the caller.
+    """
     app_kind, eg_k, k = self._GetEntityLocation(key)
 
-    self.__entities_lock.acquire()
     try:
+      if app_kind in self.__property_indexes:
+        self.__UnindexEntity(app_kind, k,
+                             self.__entities_by_kind[app_kind][k].protobuf)
       del self.__entities_by_kind[app_kind][k]
       del self.__entities_by_group[eg_k][k]
       if not self.__entities_by_kind[app_kind]:
@@ -640,8 +945,118 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     except KeyError:
 
       pass
-    finally:
-      self.__entities_lock.release()
+
+  def __IndexEntity(self, app_kind, k, entity):
+    """Adds the rows of an entity to the property indexes of its kind."""
+    indexes = self.__property_indexes[app_kind]
+    for prop in entity.property_list():
+      index = indexes.get(prop.name())
+      if index is not None:
+        bisect.insort(index, (_EncodeIndexValue(prop.value()), k))
+
+  def __UnindexEntity(self, app_kind, k, entity):
+    """Removes the rows of an entity from the property indexes of its kind."""
+    indexes = self.__property_indexes[app_kind]
+    for prop in entity.property_list():
+      index = indexes.get(prop.name())
+      if index is not None:
+        row = (_EncodeIndexValue(prop.value()), k)
+        i = bisect.bisect_left(index, row)
+        if i < len(index) and index[i] == row:
+          del index[i]
+
+  def __GetPropertyIndex(self, app_kind, name):
+    """Returns the sorted (encoded value, entity key) rows of a property.
+
+    The index is built from the entities of the kind the first time it is
+    asked for, and kept up to date by _StoreEntity and _Delete afterwards.
+    Any needed locking should be managed by the caller.
+    """
+    indexes = self.__property_indexes[app_kind]
+    index = indexes.get(name)
+    if index is None:
+      index = []
+      for k, stored in self.__entities_by_kind.get(app_kind, {}).iteritems():
+        for prop in stored.protobuf.property_list():
+          if prop.name() == name:
+            index.append((_EncodeIndexValue(prop.value()), k))
+      index.sort()
+      indexes[name] = index
+    return index
+
+  def __IndexedQueryResults(self, app_kind, filters, orders):
+    """Uses the property indexes to narrow down the results of a query.
+
+    Each filter on a property selects a range of that property's index. The
+    narrowest range gives the candidate entities, which are intersected with
+    the entities of any other range that is not much larger. Without
+    filters, the index of the first sort order selects the entities that have
+    the property. Candidates come out in the order of the range they were
+    taken from, which saves most of the work of sorting them when that is the
+    order of the query.
+
+    The result is a superset of the query's results, which still has to be
+    filtered and sorted. Any needed locking should be managed by the caller.
+
+    Returns:
+      A list of entity_pb.EntityProto, or None if no index applies.
+    """
+    ranges = []
+    for filt in filters:
+      if filt.property_size() != 1:
+        continue
+      prop = filt.property(0)
+      if prop.name() == datastore_types.KEY_SPECIAL_PROPERTY:
+        continue
+      value = prop.value()
+      if filt.op() != datastore_pb.Query_Filter.EQUAL:
+
+
+        if datastore_types.GetPropertyValueTag(value) not in _INDEX_RANGE_TYPES:
+          continue
+      elif value.has_uservalue():
+
+        continue
+      index = self.__GetPropertyIndex(app_kind, prop.name())
+      bounds = _IndexSlice(index, filt.op(), _EncodeIndexValue(value))
+      if bounds is not None:
+        ranges.append((bounds[1] - bounds[0], prop.name(), index, bounds))
+
+    descending = False
+    if ranges:
+      ranges.sort()
+      _, name, index, (start, end) = ranges[0]
+      if orders and orders[0].property() == name:
+        descending = (orders[0].direction() ==
+                      datastore_pb.Query_Order.DESCENDING)
+    elif (orders and
+          orders[0].property() != datastore_types.KEY_SPECIAL_PROPERTY):
+      name = orders[0].property()
+      index = self.__GetPropertyIndex(app_kind, name)
+      start, end = 0, len(index)
+      descending = (orders[0].direction() ==
+                    datastore_pb.Query_Order.DESCENDING)
+    else:
+      return None
+
+    rows = index[start:end]
+    if descending:
+      rows.reverse()
+    candidates = []
+    seen = set()
+    for _, k in rows:
+      if k not in seen:
+        seen.add(k)
+        candidates.append(k)
+
+    for size, _, other_index, (other_start, other_end) in ranges[1:]:
+      if size > _INDEX_JOIN_RATIO * len(candidates):
+        break
+      matches = set(k for _, k in other_index[other_start:other_end])
+      candidates = [k for k in candidates if k in matches]
+
+    entities = self.__entities_by_kind.get(app_kind, {})
+    return [entities[k].protobuf for k in candidates]
 
   def _GetEntitiesInEntityGroup(self, entity_group):
     eg_k = datastore_types.ReferenceToKeyValue(entity_group)
@@ -666,8 +1081,11 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
         (results, filters, orders) = pseudo_kind.Query(query, filters, orders)
       elif query.has_kind():
-        results = [entity.protobuf for entity in
-                   self.__entities_by_kind[app_ns, query.kind()].values()]
+        results = self.__IndexedQueryResults((app_ns, query.kind()),
+                                             filters, orders)
+        if results is None:
+          results = [entity.protobuf for entity in
+                     self.__entities_by_kind[app_ns, query.kind()].values()]
       else:
         results = []
         for (cur_app_ns, _), entities in self.__entities_by_kind.iteritems():
@@ -1,7 +1,9 @@
 """Context class."""
 
+import collections
 import logging
 import sys
+import time
 
 from .google_imports import datastore  # For taskqueue coordination
 from .google_imports import datastore_errors
@@ -25,6 +27,7 @@ __all__ = ['Context', 'ContextOptions', 'TransactionOptions', 'AutoBatcher',
 
 _LOCK_TIME = 32  # Time to lock out memcache.add() after datastore updates.
 _LOCKED = 0  # Special value to store in memcache indicating locked value.
+_EWMA_WEIGHT = 0.2  # Weight of the newest sample in AutoBatcher averages.
 
 
 # Constant for read_policy.
@@ -76,6 +79,34 @@ class ContextOptions(datastore_rpc.Configuration):
         'memcache_deadline should be an integer (%r)' % (value,))
     return value
 
+  @datastore_rpc.ConfigOption
+  def max_cache_items(value):
+    if not isinstance(value, (int, long)):
+      raise datastore_errors.BadArgumentError(
+        'max_cache_items should be an integer (%r)' % (value,))
+    return value
+
+  @datastore_rpc.ConfigOption
+  def max_cache_bytes(value):
+    if not isinstance(value, (int, long)):
+      raise datastore_errors.BadArgumentError(
+        'max_cache_bytes should be an integer (%r)' % (value,))
+    return value
+
+  @datastore_rpc.ConfigOption
+  def adaptive_batching(value):
+    if not isinstance(value, bool):
+      raise datastore_errors.BadArgumentError(
+        'adaptive_batching should be a bool (%r)' % (value,))
+    return value
+
+  @datastore_rpc.ConfigOption
+  def batch_coalesce_delay(value):
+    if not isinstance(value, (int, long, float)) or value < 0:
+      raise datastore_errors.BadArgumentError(
+        'batch_coalesce_delay should be a non-negative number (%r)' % (value,))
+    return value
+
 class TransactionOptions(ContextOptions, datastore_rpc.TransactionOptions):
   """Support both context options and transaction options."""
 
@@ -141,9 +172,17 @@ class AutoBatcher(object):
   arguments into batches and passes along results back to respective futures.
   This class is mainly a helper that invokes todo_tasklet with the right
   arguments at the right time.
+
+  Flushing on idle can send many tiny batches when tasklets add their
+  items one at a time.  In adaptive mode, while a batch is in flight,
+  _on_idle holds back queues smaller than the effective flush limit;
+  they go out when that batch completes.  The effective flush limit is
+  an average of how many items were added while a batch was in flight.
+  A coalescing delay also makes _on_idle hold a queue until it is that
+  old (in adaptive mode, at most half the average batch latency).
   """
 
-  def __init__(self, todo_tasklet, limit):
+  def __init__(self, todo_tasklet, limit, adaptive=False, coalesce_delay=0):
     """Init.
 
     Args:
@@ -151,26 +190,103 @@ class AutoBatcher(object):
         It should take a list of (future, arg) pairs and an "options" as
         arguments. "options" are rpc options.
       limit: max number of items to batch for each distinct value of "options".
+      adaptive: whether to hold back small batches while one is in flight.
+      coalesce_delay: seconds to let a queue collect items before flushing
+        it on idle; 0 to flush right away.
     """
     self._todo_tasklet = todo_tasklet
     self._limit = limit
+    self._adaptive = adaptive
+    self._coalesce_delay = coalesce_delay
     # A map from "options" to a list of (future, arg) tuple.
     # future is the future return from a single async operations.
     self._queues = {}
+    self._queue_times = {}  # Maps "options" to when its queue was created.
     self._running = []  # A list of in-flight todo_tasklet futures.
     self._cache = {}  # Cache of in-flight todo_tasklet futures.
+    self._timer_loop = None  # The event loop _on_timer is queued in.
+    # Telemetry.
+    self._added = 0  # Items ever added.
+    self._batches = 0
+    self._items = 0
+    self._flush_reasons = {'limit': 0, 'idle': 0, 'delay': 0, 'flush': 0}
+    self._latency = None  # Average seconds from run_queue to completion.
+    self._arrivals = None  # Average items added while a batch was in flight.
+    self._flush_limit = 1
+    self._peak_flush_limit = 1
 
   def __repr__(self):
     return '%s(%s)' % (self.__class__.__name__, self._todo_tasklet.__name__)
 
-  def run_queue(self, options, todo):
+  def run_queue(self, options, todo, reason='flush'):
     """Actually run the _todo_tasklet."""
-    utils.logging_debug('AutoBatcher(%s): %d items',
-                        self._todo_tasklet.__name__, len(todo))
+    utils.logging_debug('AutoBatcher(%s): %d items (%s)',
+                        self._todo_tasklet.__name__, len(todo), reason)
+    self._batches += 1
+    self._items += len(todo)
+    self._flush_reasons[reason] += 1
+    started = time.time()
     batch_fut = self._todo_tasklet(todo, options)
     self._running.append(batch_fut)
     # Add a callback when we're done.
-    batch_fut.add_callback(self._finished_callback, batch_fut, todo)
+    batch_fut.add_callback(self._finished_callback, batch_fut, todo,
+                           started, self._added)
+
+  def stats(self):
+    """Returns a dict of counters describing the batches sent so far.
+
+    The keys are 'batches', 'items', 'mean_size', 'flush_reasons' (a
+    dict counting batches sent because a queue reached the limit, the
+    event loop was idle, the coalescing delay expired or flush() was
+    called), 'mean_latency' (seconds, or None), 'flush_limit' and
+    'peak_flush_limit' (the highest flush limit so far; the flush limit
+    itself falls back towards 1 as the items stop coming).
+    """
+    return {'batches': self._batches,
+            'items': self._items,
+            'mean_size': float(self._items) / max(self._batches, 1),
+            'flush_reasons': dict(self._flush_reasons),
+            'mean_latency': self._latency,
+            'flush_limit': self._flush_limit,
+            'peak_flush_limit': self._peak_flush_limit,
+            }
+
+  def _get_delay(self):
+    delay = self._coalesce_delay
+    if delay and self._adaptive and self._latency is not None:
+      delay = min(delay, self._latency / 2)
+    return delay
+
+  def _pop_ready_queue(self):
+    """Removes and returns an (options, todo) pair that needn't be held.
+
+    In adaptive mode a queue smaller than the flush limit is held while a
+    batch is in flight, and with a coalescing delay a queue is held until
+    it is that old.  If all queues are held, arms the coalescing timer for
+    the first delay to expire (if any) and returns None.
+    """
+    now = time.time()
+    delay = self._get_delay()
+    hold_small = self._adaptive and self._running
+    deadline = None
+    for options, todo in self._queues.iteritems():
+      if hold_small and len(todo) < self._flush_limit:
+        continue
+      ready_at = self._queue_times[options] + delay
+      if delay and ready_at > now:
+        if deadline is None or ready_at < deadline:
+          deadline = ready_at
+        continue
+      del self._queues[options]
+      del self._queue_times[options]
+      return options, todo
+    if deadline is not None:
+      ev = eventloop.get_event_loop()
+      if self._timer_loop is not ev:
+        self._timer_loop = ev
+        # Times over a billion seconds are absolute for queue_call().
+        ev.queue_call(deadline, self._on_timer)
+    return None
 
   def _on_idle(self):
     """An idler eventloop can run.
@@ -178,10 +294,25 @@ class AutoBatcher(object):
     Eventloop calls this when it has finished processing all immediate
     callbacks. This method runs _todo_tasklet even before the batch is full.
     """
-    if not self.action():
+    if not self._queues:
       return None
+    ready = self._pop_ready_queue()
+    if ready is None:
+      return False
+    options, todo = ready
+    self.run_queue(options, todo, 'idle')
     return True
 
+  def _on_timer(self):
+    """Runs the queues whose coalescing delay has expired."""
+    self._timer_loop = None
+    while self._queues:
+      ready = self._pop_ready_queue()
+      if ready is None:
+        break
+      options, todo = ready
+      self.run_queue(options, todo, 'delay')
+
   def add(self, arg, options=None):
     """Adds an arg and gets back a future.
 
@@ -201,10 +332,13 @@ class AutoBatcher(object):
       if not self._queues:
         eventloop.add_idle(self._on_idle)
       todo = self._queues[options] = []
+      self._queue_times[options] = time.time()
     todo.append((fut, arg))
+    self._added += 1
     if len(todo) >= self._limit:
       del self._queues[options]
-      self.run_queue(options, todo)
+      del self._queue_times[options]
+      self.run_queue(options, todo, 'limit')
     return fut
 
   def add_once(self, arg, options=None):
@@ -221,21 +355,35 @@ class AutoBatcher(object):
     if not queues:
       return False
     options, todo = queues.popitem()  # TODO: Should this use FIFO ordering?
+    del self._queue_times[options]
     self.run_queue(options, todo)
     return True
 
-  def _finished_callback(self, batch_fut, todo):
-    """Passes exception along.
+  def _finished_callback(self, batch_fut, todo, started, added):
+    """Updates the averages and passes exception along.
 
     Args:
       batch_fut: the batch future returned by running todo_tasklet.
       todo: (fut, option) pair. fut is the future return by each add() call.
+      started: when run_queue() was called.
+      added: the value of self._added when run_queue() was called.
 
     If the batch fut was successful, it has already called fut.set_result()
     on other individual futs. This method only handles when the batch fut
     encountered an exception.
     """
     self._running.remove(batch_fut)
+    latency = time.time() - started
+    arrivals = self._added - added
+    if self._latency is None:
+      self._latency = latency
+      self._arrivals = arrivals
+    else:
+      self._latency += _EWMA_WEIGHT * (latency - self._latency)
+      self._arrivals += _EWMA_WEIGHT * (arrivals - self._arrivals)
+    if self._adaptive:
+      self._flush_limit = max(1, min(self._limit, int(round(self._arrivals))))
+      self._peak_flush_limit = max(self._peak_flush_limit, self._flush_limit)
     err = batch_fut.get_exception()
     if err is not None:
       tb = batch_fut.get_traceback()
@@ -250,6 +398,144 @@ class AutoBatcher(object):
         yield self._running  # A list of Futures
 
 
+class ContextCache(object):
+  """The in-process cache of a Context, mapping Keys to entities.
+
+  A value of None means the entity doesn't exist.  Without limits this
+  is just a dict.  With max_items and/or max_bytes, entries are evicted
+  once the cache holds more than max_items entries, or entities of more
+  than max_bytes (approximated by their encoded size when stored), by
+  one of two policies:
+
+  - 'lru' evicts the least recently used entry.
+  - 'clock' evicts in insertion order, but gives entries that were hit
+    since they were last considered a second chance; hits are cheaper
+    than with 'lru' since they don't reorder anything.
+  """
+
+  EVICTION_POLICIES = ('lru', 'clock')
+
+  def __init__(self, max_items=None, max_bytes=None, eviction='lru'):
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = {}  # Maps key to [value, size, referenced].
+    self._bytes = 0
+    self.set_limits(max_items, max_bytes, eviction)
+
+  def set_limits(self, max_items=None, max_bytes=None, eviction='lru'):
+    """Changes the limits and eviction policy, evicting if needed."""
+    if eviction not in self.EVICTION_POLICIES:
+      raise datastore_errors.BadArgumentError(
+        'eviction should be one of %s (%r)' %
+        (', '.join(self.EVICTION_POLICIES), eviction))
+    self.max_items = max_items
+    self.max_bytes = max_bytes
+    self.eviction = eviction
+    self._bounded = max_items is not None or max_bytes is not None
+    entries = self._entries
+    if self._bounded:
+      self._entries = collections.OrderedDict()
+    else:
+      self._entries = {}
+    self._bytes = 0
+    for key, entry in entries.iteritems():
+      entry[1] = self._size(entry[0])
+      self._bytes += entry[1]
+      self._entries[key] = entry
+    self._evict()
+
+  def get_limits(self):
+    """Returns the limits as a dict of set_limits() arguments."""
+    return {'max_items': self.max_items, 'max_bytes': self.max_bytes,
+            'eviction': self.eviction}
+
+  def stats(self):
+    """Returns a dict of hit, miss and eviction counters and the size."""
+    return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'items': len(self._entries),
+            'bytes': self._bytes}
+
+  def _size(self, value):
+    if self.max_bytes is None or value is None:
+      return 0
+    return value._to_pb(allow_partial=True).ByteSize()
+
+  def _evict(self):
+    if not self._bounded:
+      return
+    while self._entries and (
+        (self.max_items is not None and len(self._entries) > self.max_items) or
+        (self.max_bytes is not None and self._bytes > self.max_bytes)):
+      key, entry = self._entries.popitem(last=False)
+      if entry[2] and self.eviction == 'clock':
+        entry[2] = False
+        self._entries[key] = entry
+        continue
+      self._bytes -= entry[1]
+      self.evictions += 1
+
+  def lookup(self, key, count=True):
+    """Returns (found, value) for key, counting a hit or a miss."""
+    entry = self._entries.get(key)
+    if entry is None:
+      if count:
+        self.misses += 1
+      return False, None
+    if count:
+      self.hits += 1
+    if self._bounded:
+      if self.eviction == 'lru':
+        del self._entries[key]
+        self._entries[key] = entry
+      else:
+        entry[2] = True
+    return True, entry[0]
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def __getitem__(self, key):
+    return self._entries[key][0]
+
+  def __setitem__(self, key, value):
+    size = self._size(value)
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self._bytes -= entry[1]
+    self._entries[key] = [value, size, False]
+    self._bytes += size
+    self._evict()
+
+  def __delitem__(self, key):
+    entry = self._entries.pop(key)
+    self._bytes -= entry[1]
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __iter__(self):
+    return iter(self._entries)
+
+  def get(self, key, default=None):
+    entry = self._entries.get(key)
+    if entry is None:
+      return default
+    return entry[0]
+
+  def iteritems(self):
+    for key, entry in self._entries.iteritems():
+      yield key, entry[0]
+
+  def update(self, other):
+    for key, value in other.iteritems():
+      self[key] = value
+
+  def clear(self):
+    self._entries.clear()
+    self._bytes = 0
+
+
 class Context(object):
 
   def __init__(self, conn=None, auto_batcher_class=AutoBatcher, config=None,
@@ -272,22 +558,37 @@ class Context(object):
     max_delete = (datastore_rpc.Configuration.max_delete_keys(config,
                                                               conn.config) or
                   datastore_rpc.Connection.MAX_DELETE_KEYS)
+    # Only pass the batching options that are set, so that auto-batcher
+    # classes predating them keep working.
+    batcher_options = {}
+    if ContextOptions.adaptive_batching(config, conn.config):
+      batcher_options['adaptive'] = True
+    coalesce_delay = ContextOptions.batch_coalesce_delay(config, conn.config)
+    if coalesce_delay:
+      batcher_options['coalesce_delay'] = coalesce_delay
     # Create the get/put/delete auto-batchers.
-    self._get_batcher = auto_batcher_class(self._get_tasklet, max_get)
-    self._put_batcher = auto_batcher_class(self._put_tasklet, max_put)
-    self._delete_batcher = auto_batcher_class(self._delete_tasklet, max_delete)
+    self._get_batcher = auto_batcher_class(self._get_tasklet, max_get,
+                                           **batcher_options)
+    self._put_batcher = auto_batcher_class(self._put_tasklet, max_put,
+                                           **batcher_options)
+    self._delete_batcher = auto_batcher_class(self._delete_tasklet, max_delete,
+                                              **batcher_options)
     # We only have a single limit for memcache (default 1000).
     max_memcache = (ContextOptions.max_memcache_items(config, conn.config) or
                     datastore_rpc.Connection.MAX_GET_KEYS)
     # Create the memcache auto-batchers.
     self._memcache_get_batcher = auto_batcher_class(self._memcache_get_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_set_batcher = auto_batcher_class(self._memcache_set_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_del_batcher = auto_batcher_class(self._memcache_del_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     self._memcache_off_batcher = auto_batcher_class(self._memcache_off_tasklet,
-                                                    max_memcache)
+                                                    max_memcache,
+                                                    **batcher_options)
     # Create a list of batchers for flush().
     self._batchers = [self._get_batcher,
                       self._put_batcher,
@@ -297,7 +598,14 @@ class Context(object):
                       self._memcache_del_batcher,
                       self._memcache_off_batcher,
                       ]
-    self._cache = {}
+    if parent_context is None:
+      max_cache_items = ContextOptions.max_cache_items(config, conn.config)
+      max_cache_bytes = ContextOptions.max_cache_bytes(config, conn.config)
+    else:
+      # A transaction's cache is never bounded, since its keys are also
+      # the ones to clear from memcache once it commits.
+      max_cache_items = max_cache_bytes = None
+    self._cache = ContextCache(max_cache_items, max_cache_bytes)
     self._memcache = memcache.Client()
     self._on_commit_queue = []
 
@@ -424,6 +732,57 @@ class Context(object):
       func = lambda unused_key, flag=func: flag
     self._cache_policy = func
 
+  def get_cache_limits(self):
+    """Return the limits of the context cache.
+
+    Returns:
+      A dict with the max_items, max_bytes and eviction arguments last
+      passed to set_cache_limits().
+    """
+    return self._cache.get_limits()
+
+  def set_cache_limits(self, max_items=None, max_bytes=None, eviction='lru'):
+    """Bound the size of the context cache.
+
+    The initial limits come from the max_cache_items and max_cache_bytes
+    context options; by default the cache is unbounded.  Transactions
+    always use an unbounded cache.
+
+    Args:
+      max_items: The maximum number of entries, or None.
+      max_bytes: The maximum approximate size in bytes of the cached
+        entities (their encoded size when they were cached), or None.
+      eviction: 'lru' (least recently used) or 'clock' (a cheaper
+        approximation of LRU).
+    """
+    self._cache.set_limits(max_items, max_bytes, eviction)
+
+  def get_batcher_stats(self):
+    """Return the counters of each auto-batcher.
+
+    Returns:
+      A dict mapping 'get', 'put', 'delete', 'memcache_get', 'memcache_set',
+      'memcache_del' and 'memcache_off' to the dict returned by that
+      batcher's stats() method.
+    """
+    return {'get': self._get_batcher.stats(),
+            'put': self._put_batcher.stats(),
+            'delete': self._delete_batcher.stats(),
+            'memcache_get': self._memcache_get_batcher.stats(),
+            'memcache_set': self._memcache_set_batcher.stats(),
+            'memcache_del': self._memcache_del_batcher.stats(),
+            'memcache_off': self._memcache_off_batcher.stats(),
+            }
+
+  def get_cache_stats(self):
+    """Return statistics of the context cache.
+
+    Returns:
+      A dict with the number of hits, misses and evictions since the
+      context was created, and the current number of items and bytes.
+    """
+    return self._cache.stats()
+
   def _use_cache(self, key, options=None):
     """Return whether to use the context cache for this key.
 
@@ -649,17 +1008,19 @@ class Context(object):
     return ContextOptions.memcache_deadline(options, self._conn.config)
 
 
-  def _load_from_cache_if_available(self, key):
+  def _load_from_cache_if_available(self, key, count=True):
     """Returns a cached Model instance given the entity key if available.
 
     Args:
       key: Key instance.
+      count: Whether to count the lookup as a cache hit or miss.
 
     Returns:
       A Model instance if the key exists in the cache.
     """
-    if key in self._cache:
-      entity = self._cache[key]  # May be None, meaning "doesn't exist".
+    found, entity = self._cache.lookup(key, count)
+    if found:
+      # entity may be None, meaning "doesn't exist".
       if entity is None or entity._key == key:
         # If entity's key didn't change later, it is ok.
         # See issue 13.  http://goo.gl/jxjOP
@@ -708,7 +1069,7 @@ class Context(object):
                                        deadline=memcache_deadline)
       # A value may have appeared while yielding.
       if use_cache:
-        self._load_from_cache_if_available(key)
+        self._load_from_cache_if_available(key, count=False)
       if mvalue not in (_LOCKED, None):
         cls = model.Model._lookup_model(key.kind(),
                                         self._conn.adapter.default_model)
@@ -911,8 +1272,8 @@ class Context(object):
 
     # Check the cache.  If there is a valid cached entry, substitute
     # that for the result, even if the cache has an explicit None.
-    if key in self._cache:
-      cached_ent = self._cache[key]
+    found, cached_ent = self._cache.lookup(key)
+    if found:
       if (cached_ent is None or
           cached_ent.key == key and cached_ent.__class__ is ent.__class__):
         return cached_ent
@@ -11,6 +11,8 @@ The API here is inspired by Monocle.
 """
 
 import collections
+import heapq
+import itertools
 import logging
 import os
 import time
@@ -20,9 +22,9 @@ from .google_imports import datastore_rpc
 
 from . import utils
 
-__all__ = ['EventLoop',
+__all__ = ['EventLoop', 'EventLoopStats',
            'add_idle', 'queue_call', 'queue_rpc',
-           'get_event_loop',
+           'get_event_loop', 'set_instrumentation_hook',
            'run', 'run0', 'run1',
            ]
 
@@ -32,10 +34,35 @@ _IDLE = apiproxy_rpc.RPC.IDLE
 _RUNNING = apiproxy_rpc.RPC.RUNNING
 _FINISHING = apiproxy_rpc.RPC.FINISHING
 
+# Indexes into the per-iteration timing list kept while a hook is installed.
+_CALLBACK_TIME = 0
+_IDLE_TIME = 1
+_RPC_WAIT_TIME = 2
+
+
+class EventLoopStats(collections.namedtuple('EventLoopStats',
+                                            ['callback_time', 'idle_time',
+                                             'rpc_wait_time', 'delay',
+                                             'current', 'idlers', 'queue',
+                                             'rpcs'])):
+  """What one iteration of EventLoop.run0() did.
+
+  Fields:
+    callback_time: seconds spent in immediate, timed and RPC callbacks.
+    idle_time: seconds spent in an idle callback.
+    rpc_wait_time: seconds spent in MultiRpc.wait_any().
+    delay: the value returned by run0(): 0 if something happened, the
+      time until the next timed event, or None if all queues are empty.
+    current, idlers, queue, rpcs: the lengths of those queues after
+      the iteration.
+  """
+
 
 class EventLoop(object):
   """An event loop."""
 
+  instrumentation_hook = None
+
   def __init__(self):
     """Constructor.
 
@@ -46,16 +73,21 @@ class EventLoop(object):
         run only when no other RPCs need to be fired first.
         For example, AutoBatcher uses idler to fire a batch RPC even before
         the batch is full.
-      queue: a sorted list of (absolute time in sec, callback, args, kwds),
-        sorted by time. These callbacks run only after the said time.
+      queue: a heap of (absolute time in sec, sequence number, callback,
+        args, kwds). These callbacks run only after the said time; the
+        sequence number keeps events with the same time in FIFO order.
       rpcs: a map from rpc to (callback, args, kwds). Callback is called
         when the rpc finishes.
+      instrumentation_hook: None, or a function called with an
+        EventLoopStats after each iteration of run0().
     """
     self.current = collections.deque()
     self.idlers = collections.deque()
     self.inactive = 0  # How many idlers in a row were no-ops
     self.queue = []
     self.rpcs = {}
+    self._sequence = itertools.count()
+    self._timings = None  # Per-iteration timings while a hook is installed
 
   def clear(self):
     """Remove all pending events without running any."""
@@ -81,27 +113,40 @@ class EventLoop(object):
       _logging_debug('Cleared')
 
   def insort_event_right(self, event, lo=0, hi=None):
-    """Insert event in queue, and keep it sorted assuming queue is sorted.
+    """Insert event in queue, keeping the queue a heap.
 
-    If event is already in queue, insert it to the right of the rightmost
-    event (to keep FIFO order).
-
-    Optional args lo (default 0) and hi (default len(a)) bound the
-    slice of a to be searched.
+    If events with the same time are already in queue, event runs after
+    all of them (to keep FIFO order).
 
     Args:
       event: a (time in sec since unix epoch, callback, args, kwds) tuple.
+      lo, hi: ignored; accepted for compatibility with the old sorted
+        list implementation.
     """
-
     if lo < 0:
-        raise ValueError('lo must be non-negative')
-    if hi is None:
-        hi = len(self.queue)
-    while lo < hi:
-        mid = (lo + hi) // 2
-        if event[0] < self.queue[mid][0]: hi = mid
-        else: lo = mid + 1
-    self.queue.insert(lo, event)
+      raise ValueError('lo must be non-negative')
+    when, callback, args, kwds = event
+    heapq.heappush(self.queue,
+                   (when, next(self._sequence), callback, args, kwds))
+
+  def set_instrumentation_hook(self, hook):
+    """Install a function to be called after each iteration of run0().
+
+    The hook is called with an EventLoopStats describing the iteration,
+    even if a callback raised. Pass None to remove the hook.
+    """
+    self.instrumentation_hook = hook
+
+  def _call(self, slot, callback, args, kwds):
+    """Call callback, adding its run time to slot if a hook is installed."""
+    timings = self._timings
+    if timings is None:
+      return callback(*args, **kwds)
+    start = time.time()
+    try:
+      return callback(*args, **kwds)
+    finally:
+      timings[slot] += time.time() - start
 
   def queue_call(self, delay, callback, *args, **kwds):
     """Schedule a function call at a specific time in the future."""
@@ -171,7 +216,7 @@ class EventLoop(object):
     idler = self.idlers.popleft()
     callback, args, kwds = idler
     _logging_debug('idler: %s', callback.__name__)
-    res = callback(*args, **kwds)
+    res = self._call(_IDLE_TIME, callback, args, kwds)
     # See add_idle() for the meaning of the callback return value.
     if res is not None:
       if res:
@@ -190,11 +235,29 @@ class EventLoop(object):
       A time to sleep if something happened (may be 0);
       None if all queues are empty.
     """
+    hook = self.instrumentation_hook
+    if hook is None:
+      return self._run0()
+    outer_timings = self._timings  # Set if run0() is called by a callback
+    timings = self._timings = [0.0, 0.0, 0.0]
+    delay = None
+    try:
+      delay = self._run0()
+      return delay
+    finally:
+      self._timings = outer_timings
+      hook(EventLoopStats(timings[_CALLBACK_TIME], timings[_IDLE_TIME],
+                          timings[_RPC_WAIT_TIME], delay,
+                          len(self.current), len(self.idlers),
+                          len(self.queue), len(self.rpcs)))
+
+  def _run0(self):
+    """Helper for run0() that does the actual work."""
     if self.current:
       self.inactive = 0
       callback, args, kwds = self.current.popleft()
       _logging_debug('nowevent: %s', callback.__name__)
-      callback(*args, **kwds)
+      self._call(_CALLBACK_TIME, callback, args, kwds)
       return 0
     if self.run_idle():
       return 0
@@ -203,14 +266,15 @@ class EventLoop(object):
       delay = self.queue[0][0] - time.time()
       if delay <= 0:
         self.inactive = 0
-        _, callback, args, kwds = self.queue.pop(0)
+        _, _, callback, args, kwds = heapq.heappop(self.queue)
         _logging_debug('event: %s', callback.__name__)
-        callback(*args, **kwds)
+        self._call(_CALLBACK_TIME, callback, args, kwds)
         # TODO: What if it raises an exception?
         return 0
     if self.rpcs:
       self.inactive = 0
-      rpc = datastore_rpc.MultiRpc.wait_any(self.rpcs)
+      rpc = self._call(_RPC_WAIT_TIME, datastore_rpc.MultiRpc.wait_any,
+                       (self.rpcs,), {})
       if rpc is not None:
         _logging_debug('rpc: %s.%s', rpc.service, rpc.method)
         # Yes, wait_any() may return None even for a non-empty argument.
@@ -221,7 +285,7 @@ class EventLoop(object):
         callback, args, kwds = self.rpcs[rpc]
         del self.rpcs[rpc]
         if callback is not None:
-          callback(*args, **kwds)
+          self._call(_CALLBACK_TIME, callback, args, kwds)
           # TODO: Again, what about exceptions?
       return 0
     return delay
@@ -291,6 +355,11 @@ def add_idle(callback, *args, **kwds):
   ev.add_idle(callback, *args, **kwds)
 
 
+def set_instrumentation_hook(hook):
+  ev = get_event_loop()
+  ev.set_instrumentation_hook(hook)
+
+
 def run():
   ev = get_event_loop()
   ev.run()
@@ -48,6 +48,8 @@ __email__ = "See the author's website"
 
 import re
 import htmlentitydefs
+from collections import deque
+from itertools import islice
 from nltk.util import ngrams
 
 ######################################################################
@@ -130,11 +132,58 @@ word_re = re.compile(r"""(%s)""" % "|".join(regex_strings), re.VERBOSE | re.I |
 # The emoticon string gets its own regex so that we can preserve case for them as needed:
 emoticon_re = re.compile(regex_strings[1], re.VERBOSE | re.I | re.UNICODE)
 
+# The same regex with only the emoticons in a group, so that a single
+# finditer pass tells them apart by match.lastindex instead of
+# re-searching every token with emoticon_re:
+tagged_word_re = re.compile("|".join(("(%s)" if r is emoticon_string else "%s") % r for r in regex_strings), re.VERBOSE | re.I | re.UNICODE)
+EMOTICON_GROUP = 1
+
+# Any token that contains an emoticon (emoticons, but also e.g.
+# "<http://t.co/P>") contains one of its eyes, so strings without any
+# can be downcased wholesale:
+emoticon_eyes_re = re.compile(r"[:;=8]")
+
 # These are for regularizing HTML entities to Unicode:
 html_entity_digit_re = re.compile(r"&#\d+;")
 html_entity_alpha_re = re.compile(r"&\w+;")
+html_entity_re = re.compile(r"&#\d+;|&\w+;")
 amp = "&amp;"
 
+# Decoded entities, at most HTML_ENTITY_CACHE_SIZE of them. Hits are plain
+# dict lookups; once the table is full the oldest entity is evicted:
+html_entity_cache = {}
+html_entity_cache_order = deque()
+HTML_ENTITY_CACHE_SIZE = 512
+
+def html_entity_value(ent):
+    """
+    Returns the unicode character for the HTML entity ent (e.g. "&#39;"
+    or "&aacute;"), " and " for "&amp;", and ent itself if it can't be
+    decoded.
+    """
+    if ent == amp:
+        return u" and "
+    try:
+        if ent[1] == "#":
+            return unichr(int(ent[2:-1]))
+        return unichr(htmlentitydefs.name2codepoint[ent[1:-1]])
+    except (KeyError, ValueError, OverflowError):
+        return ent
+
+def decode_html_entity(match):
+    """re.sub callback that decodes an entity through html_entity_cache."""
+    ent = match.group()
+    try:
+        return html_entity_cache[ent]
+    except KeyError:
+        pass
+    value = html_entity_value(ent)
+    if len(html_entity_cache_order) >= HTML_ENTITY_CACHE_SIZE:
+        html_entity_cache.pop(html_entity_cache_order.popleft(), None)
+    html_entity_cache[ent] = value
+    html_entity_cache_order.append(ent)
+    return value
+
 ######################################################################
 
 class Tokenizer:
@@ -146,6 +195,31 @@ class Tokenizer:
         Argument: s -- any string or unicode object
         Value: a tokenize list of strings; conatenating this list returns the original string if preserve_case=False
         """        
+        words = list(self.iter_tokens(s))
+        if n>1:
+            return ngrams(words, n)
+        else:
+            return words
+
+    def tokenize_many(self, strings, n=1):
+        """
+        Argument: strings -- an iterable of strings or unicode objects
+        Value: a generator yielding, for each string, an iterator over its
+        tokens (or over its n-grams, as tuples, if n>1). Nothing is
+        materialized beyond the string being tokenized.
+        """
+        for s in strings:
+            if n>1:
+                yield self.iter_ngrams(s, n)
+            else:
+                yield self.iter_tokens(s)
+
+    def iter_tokens(self, s):
+        """
+        Argument: s -- any string or unicode object
+        Value: an iterator over the same tokens that tokenize(s) returns,
+        found in a single scan of s
+        """
         # Try to ensure unicode:
         try:
             s = unicode(s)
@@ -154,15 +228,39 @@ class Tokenizer:
             s = unicode(s)
         # Fix HTML character entitites:
         s = self.__html2unicode(s)
-        # Tokenize:
-        words = word_re.findall(s)
-        # Possible alter the case, but avoid changing emoticons like :D into :d:
-        if not self.preserve_case:            
-            words = map((lambda x : x if emoticon_re.search(x) else x.lower()), words)
-        if n>1:
-            return ngrams(words, n)
-        else:
-            return words
+        if self.preserve_case:
+            return iter(word_re.findall(s))
+        # Possible alter the case, but avoid changing emoticons like :D
+        # into :d. Downcasing never changes the length of a unicode string
+        # (and the regexes ignore case), so tokens can be found in the
+        # downcased string and emoticons copied back from the original:
+        lowered = s.lower()
+        if not emoticon_eyes_re.search(s):
+            return iter(word_re.findall(lowered))
+        return self.__restore_emoticons(s, lowered)
+
+    def __restore_emoticons(self, s, lowered):
+        for match in tagged_word_re.finditer(lowered):
+            if match.lastindex == EMOTICON_GROUP:
+                yield s[match.start():match.end()]
+                continue
+            word = match.group()
+            if emoticon_eyes_re.search(word) and emoticon_re.search(word):
+                yield s[match.start():match.end()]
+            else:
+                yield word
+
+    def iter_ngrams(self, s, n):
+        """
+        Argument: s -- any string or unicode object
+        Value: a generator over the n-grams (as tuples) of the tokens of s,
+        keeping only the current n tokens in memory
+        """
+        tokens = self.iter_tokens(s)
+        window = deque(islice(tokens, n - 1), maxlen=n)
+        for token in tokens:
+            window.append(token)
+            yield tuple(window)
 
     # not used
     def tokenize_random_tweet(self):
@@ -189,27 +287,9 @@ class Tokenizer:
         Internal metod that seeks to replace all the HTML entities in
         s with their corresponding unicode characters.
         """
-        # First the digits:
-        ents = set(html_entity_digit_re.findall(s))
-        if len(ents) > 0:
-            for ent in ents:
-                entnum = ent[2:-1]
-                try:
-                    entnum = int(entnum)
-                    s = s.replace(ent, unichr(entnum))	
-                except:
-                    pass
-        # Now the alpha versions:
-        ents = set(html_entity_alpha_re.findall(s))
-        ents = filter((lambda x : x != amp), ents)
-        for ent in ents:
-            entname = ent[1:-1]
-            try:            
-                s = s.replace(ent, unichr(htmlentitydefs.name2codepoint[entname]))
-            except:
-                pass                    
-            s = s.replace(amp, " and ")
-        return s
+        if "&" not in s:
+            return s
+        return html_entity_re.sub(decode_html_entity, s)
 
 ###############################################################################
 
@@ -0,0 +1,169 @@
+#Headless ingestion of many users at once, without Kivy.
+#ingest_users(tokens) fetches each token's profile, outbox, posts and likes
+#over a pool of worker threads and writes one corpus file per user. Given a
+#CorpusStore, only what changed since the last run is fetched.
+import json
+import os
+import random
+import threading
+import time
+from Queue import Queue
+
+import facebook
+from corpus import CorpusBuilder
+from corpus_store import CorpusStore
+
+#GraphAPIError codes for application, user and method level throttling
+THROTTLING_CODES = (4, 17, 613)
+
+
+class RateLimiter(object):
+    """Spaces out the calls made with one access token.
+
+    Calls are made at most once every min_interval seconds. When Graph
+    answers with a throttling error the call is retried up to max_retries
+    times, waiting base_delay * 2**attempt seconds (with jitter, capped at
+    max_delay) before each retry.
+    """
+
+    def __init__(self, min_interval=0.0, base_delay=1.0, max_delay=300.0,
+                 max_retries=5):
+        self.min_interval = min_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay *= random.uniform(0.5, 1.0)
+        with self.lock:
+            self.next_call = max(self.next_call, time.time() + delay)
+
+    def call(self, function, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.wait()
+            try:
+                return function(*args, **kwargs)
+            except facebook.GraphAPIError as e:
+                if e.code not in THROTTLING_CODES or attempt >= self.max_retries:
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+
+
+class ThrottledGraphAPI(facebook.GraphAPI):
+    """A GraphAPI whose every request goes through a RateLimiter, including
+    batches and each page of iter_connections."""
+
+    def __init__(self, access_token=None, limiter=None, **kwargs):
+        facebook.GraphAPI.__init__(self, access_token, **kwargs)
+        self.limiter = limiter or RateLimiter()
+
+    def request(self, *args, **kwargs):
+        return self.limiter.call(facebook.GraphAPI.request, self,
+                                 *args, **kwargs)
+
+
+def fetch_user(graph, page_size=None):
+    """Returns a CorpusBuilder for the user graph's access token belongs to."""
+    profile = graph.get_object('me')
+    corpus = CorpusBuilder(profile['id'], profile.get('name', ''))
+    # Outbox pages nest whole comment threads, so they are decoded one
+    # message at a time rather than a page at a time.
+    corpus.add_messages(graph.iter_connections('me', 'outbox',
+                                               page_size=page_size,
+                                               stream=True))
+    corpus.add_posts(graph.iter_connections('me', 'posts',
+                                            page_size=page_size))
+    corpus.add_likes(graph.iter_connections('me', 'likes',
+                                            page_size=page_size))
+    return corpus
+
+
+def write_corpus(corpus, out_dir):
+    """Writes a CorpusBuilder to out_dir/<user id>.json and returns the path.
+    The file is written under a temporary name first, so a partially
+    written corpus is never mistaken for a finished one."""
+    path = os.path.join(out_dir, corpus.user_id + '.json')
+    with open(path + '.tmp', 'wb') as outfile:
+        json.dump(corpus.to_dict(), outfile)
+    os.rename(path + '.tmp', path)
+    return path
+
+
+def ingest_users(tokens, workers=4, out_dir='corpora', page_size=None,
+                 min_interval=0.0, max_retries=5, timeout=None, store=None):
+    """Fetches the corpus of every access token in tokens on a pool of
+    worker threads, writing each one to out_dir as soon as it arrives.
+    With a CorpusStore, each user is synced into the store instead of
+    being fetched in full, and the corpus is read back from it.
+
+    Returns a dict mapping each token to the path of its corpus file, or
+    to the exception that stopped it from being fetched.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    tasks = Queue()
+    results = {}
+
+    def work():
+        while True:
+            token = tasks.get()
+            if token is None:
+                return
+            limiter = RateLimiter(min_interval=min_interval,
+                                  max_retries=max_retries)
+            graph = ThrottledGraphAPI(token, limiter=limiter, timeout=timeout)
+            try:
+                if store is not None:
+                    corpus = store.corpus(store.sync(graph,
+                                                     page_size=page_size))
+                else:
+                    corpus = fetch_user(graph, page_size)
+                results[token] = write_corpus(corpus, out_dir)
+            except Exception as e:
+                results[token] = e
+
+    threads = [threading.Thread(target=work) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for token in tokens:
+        tasks.put(token)
+    for thread in threads:
+        tasks.put(None)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Fetch the corpora of many users.')
+    parser.add_argument('tokens', help='file with one access token per line')
+    parser.add_argument('out_dir', help='directory to write corpora to')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--page-size', type=int, default=None)
+    parser.add_argument('--min-interval', type=float, default=0.0)
+    parser.add_argument('--store', default=None,
+                        help='corpus store to sync incrementally into')
+    args = parser.parse_args()
+    with open(args.tokens) as infile:
+        tokens = [line.strip() for line in infile if line.strip()]
+    results = ingest_users(tokens, workers=args.workers, out_dir=args.out_dir,
+                           page_size=args.page_size,
+                           min_interval=args.min_interval,
+                           store=args.store and CorpusStore(args.store))
+    failed = [r for r in results.values() if isinstance(r, Exception)]
+    print "Wrote %d corpora, %d failed" % (len(results) - len(failed), len(failed))
@@ -11,6 +11,7 @@ from kivy.properties import StringProperty, NumericProperty, BooleanProperty, Ob
 import facebook
 from auth import *
 from stats import *
+from corpus_store import CorpusStore
 
 from kivy.garden.graph import Graph
 
@@ -26,6 +27,8 @@ class Alpha(FloatLayout):
     SLEEP_REGULARITY= NumericProperty() #list of string times
     LIKES = ListProperty() #list of string categories
 
+    store = None #users' Graph items, kept between runs (see getInfo)
+
     def waiter(self):
         self.Patient_message = "Thanks for logging in! We'll take it from here."
 
@@ -43,34 +46,17 @@ class Alpha(FloatLayout):
 
     def getInfo(self, user, key):
         graph = facebook.GraphAPI(key)
-        profile = graph.get_object(user)
-        MESSAGES_TEMP = graph.get_connections(profile['id'], 'outbox')
-        POSTS_TEMP = graph.get_connections(profile['id'], 'posts')
-        LIKES_TEMP = graph.get_connections(profile['id'], 'likes')
-        self.ME = profile['first_name'] + " " + profile['last_name']
-        exec("MESSAGES_TEMP = {0}".format(MESSAGES_TEMP)) #execute into python dictionary
-        message_corpus=""
-        post_corpus=""
-        post_time_corpus = []
-        likes_corpus = []
-
-        for like in LIKES_TEMP['data']:
-            likes_corpus.append(like['category'])
-
-        for post in POSTS_TEMP['data']:
-            post_time_corpus.append(post['updated_time'])
-            post_corpus += post['story']
-
-        for thing in MESSAGES_TEMP['data']:
-            for i in thing['comments']['data']:
-                if 'from' in i.keys() and 'message' in i.keys():
-                    if i['from']['name'] == self.ME:
-                        message_corpus += i['message']
-
-        self.MESSAGES = message_corpus
-        self.POSTS = post_corpus
-        self.SLEEP_REGULARITY = self.sleepRegularity(post_time_corpus)
-        self.LIKES = likes_corpus
+        if self.store is None:
+            self.store = CorpusStore('corpora.sqlite')
+        #one batch for the profile and the first pages, then only what is new
+        #since the last run is downloaded (see corpus_store.py)
+        corpus = self.store.corpus(self.store.sync(graph, user))
+        self.ME = corpus.name #first_name + " " + last_name (see corpus_store.py)
+
+        self.MESSAGES = corpus.message_text()
+        self.POSTS = corpus.post_text()
+        self.SLEEP_REGULARITY = self.sleepRegularity(corpus.post_times)
+        self.LIKES = corpus.likes
 
 class Interface(App):
     def build(self):
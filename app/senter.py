@@ -1,4 +1,4 @@
-import pickle
+from sentiment_lexicon import write_lexicon
 
 s = open('sentiments.csv', 'r') 
 d = {}
@@ -6,8 +6,4 @@ for row in s:
     if len(row.split(',')[0].split()) == 1:
         d[row.split(',')[0]] = float(row.split(',')[1][:-1])
 
-with open('sentiments.pickle', 'wb') as outfile:
-    pickle.dump(d,outfile)
-
-        
-
+write_lexicon('sentiments.lex', d)
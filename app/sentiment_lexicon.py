@@ -0,0 +1,115 @@
+#Read-only word -> sentiment score lexicon, stored as a sorted array.
+#
+#File layout (little endian):
+#   header  -- magic "SENTLEX1", number of words n, key width w (uint32s)
+#   keys    -- n sorted utf-8 words, each NUL-padded to w bytes
+#   scores  -- n float32 scores, in the same order as the keys
+#
+#The file is opened with mmap and wrapped in numpy arrays without copying,
+#so every process that opens it shares the same read-only pages, and many
+#words can be looked up at once with numpy.searchsorted.
+import mmap
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+MAGIC = b"SENTLEX1"
+HEADER = struct.Struct("<8sII")
+
+
+def _encode(word):
+    if isinstance(word, bytes):
+        return word
+    return word.encode("utf-8")
+
+
+def write_lexicon(filename, sentiments):
+    """Writes a dict of {word : score} as a lexicon file."""
+    items = sorted((_encode(word), score) for word, score in sentiments.items())
+    width = max([len(word) for word, score in items] or [1])
+    scores = array("f", [score for word, score in items])
+    if sys.byteorder == "big":
+        scores.byteswap()
+    with open(filename, "wb") as outfile:
+        outfile.write(HEADER.pack(MAGIC, len(items), width))
+        for word, score in items:
+            outfile.write(word.ljust(width, b"\0"))
+        scores.tofile(outfile)
+
+
+class SentimentLexicon(object):
+    """A lexicon file, mapped read-only into memory.
+
+    Supports `word in lexicon`, `lexicon[word]` and `lexicon.get(word)` for
+    single words, and lookup(words) for many words at once.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as infile:
+            self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, width = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a sentiment lexicon" % filename)
+        self.width = width
+        self.keys = np.frombuffer(self._map, dtype="S%d" % width, count=n,
+                                  offset=HEADER.size)
+        self.scores = np.frombuffer(self._map, dtype="<f4", count=n,
+                                    offset=HEADER.size + n * width)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, word):
+        return self._index(_encode(word)) is not None
+
+    def __getitem__(self, word):
+        i = self._index(_encode(word))
+        if i is None:
+            raise KeyError(word)
+        return float(self.scores[i])
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def _index(self, key):
+        if not key or len(key) > self.width:
+            return None
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def lookup(self, words):
+        """Returns a float array with the score of each of words, and NaN
+        for the words that are not in the lexicon."""
+        keys = [_encode(word) for word in words]
+        result = np.empty(len(keys))
+        result.fill(np.nan)
+        if not keys or not len(self.keys):
+            return result
+        # Longer words can't be in the lexicon, and must not be truncated
+        # to the key width by numpy.
+        fits = np.array([0 < len(key) <= self.width for key in keys])
+        needles = np.array([key if 0 < len(key) <= self.width else b""
+                            for key in keys], dtype=self.keys.dtype)
+        i = np.searchsorted(self.keys, needles)
+        i[i == len(self.keys)] = 0
+        found = fits & (self.keys[i] == needles)
+        result[found] = self.scores[i[found]]
+        return result
+
+
+_lexicons = {}
+
+def open_lexicon(filename):
+    """Returns the SentimentLexicon for filename, opening it on first use."""
+    try:
+        return _lexicons[filename]
+    except KeyError:
+        lexicon = _lexicons[filename] = SentimentLexicon(filename)
+        return lexicon
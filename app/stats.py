@@ -1,53 +1,155 @@
 #Does some processing, gives metrics
-import pickle
+from collections import deque
 from behavioral_analysis import *
+from sentiment_lexicon import open_lexicon
 
-with open('sentiments.pickle', 'rb') as infile:
-    sentiments = pickle.load(infile)
+#mmapped, so worker processes share one read-only copy (see senter.py)
+sentiments = open_lexicon('sentiments.lex')
 
-sentiment_words = set(sentiments.keys())
+def parseTimes(time_list):
+#Graph timestamps ('2014-08-01T02:13:55+0000') -> numpy datetime64 array, parsed once.
+#The offset is dropped, so hours are read as written (Graph writes +0000).
+    return np.array([time[:19] for time in time_list], dtype='datetime64[s]')
 
-def getSleepRegularity(time_list):
-#Returns a normalized notion of sleep regularity based on between 0 and 1. 
-#Most values are very close to 1, unless we have reason to believe otherwise.
-    temp = []
-    late_posts = 0
-    for time in time_list:
-        t_refined = time.split('+')[0].split('T')[1]
-        temp.append(  [int(nib) for nib in t_refined.split(':')]  ) # [hr, min, sec] representation
-    for time in temp:
-        t = time[0] #hours
-        if t == 2 or t == 3 or t == 4: #if you post at 2,3, or 4 A.M.
-            late_posts += 1
-    late_ratio = float(late_posts)/ len(temp)
+def hoursOf(times):
+#hour of day (0-23) of each time in a datetime64 array
+    return (times - times.astype('datetime64[D]')).astype('timedelta64[h]').astype(int)
+
+LATE_HOURS = slice(2, 5) #if you post at 2,3, or 4 A.M.
+
+def sleepRegularityFromCounts(hour_counts):
+#Regularity from a 24-bin histogram of posting hours
+    total = hour_counts.sum()
+    if total == 0:
+        return 1.0 #no reason to believe otherwise
+    late_ratio = float(hour_counts[LATE_HOURS].sum())/ total
     if  late_ratio < 0.5: #if you post late less than half the time
         sleep_regularity = 1 - late_ratio #this is very logical
     else:
-        sleep_reularity = 1 #then you might just be a late person
+        sleep_regularity = 1 #then you might just be a late person
 
     return sleep_regularity
 
+def getSleepRegularity(time_list):
+#Returns a normalized notion of sleep regularity based on between 0 and 1. 
+#Most values are very close to 1, unless we have reason to believe otherwise.
+    hour_counts = np.bincount(hoursOf(parseTimes(time_list)), minlength=24)
+    return sleepRegularityFromCounts(hour_counts)
+
 def getVariability(messages):
-    ins = 0
-    sents = []
-    for word in messages:
-        if word in sentiment_words:
-            sents.append(sentiments[word])
-    prev = 0
-    curr = 1
-    av = .01
+    sents = sentiments.lookup(messages)
+    sents = sents[~np.isnan(sents)] #only words with a sentiment
     p = len(sents)
-    for val in range(p-1):
-        av += sents[curr] - sents[prev]
-        prev += 1
-        curr += 1
     if p != 0:
-        av = av/p
+        av = (.01 + np.diff(sents).sum())/p #sum of changes between consecutive words
     else:
         av = 0
     return av
 
 
+class IncrementalMetrics(object):
+    """
+    Sleep regularity and sentiment variability, kept up to date as posts and
+    messages arrive instead of being recomputed from the whole history.
+
+    Keeps a histogram of posting hours and a running sum of the sentiment
+    deltas between consecutive words, so sleepRegularity() and
+    variability() are O(1). With window_days (e.g. 7, 30 or 90) only what
+    happened within that many days of the newest post/message is counted;
+    items should then arrive in chronological order (each call's items are
+    sorted, and items older than the window are dropped).
+
+    Parse a backfill once with parseTimes() and feed the same array to
+    several windows:
+
+        times = parseTimes(corpus.post_times)
+        windows = dict((days, IncrementalMetrics(days)) for days in (7, 30, 90))
+        for metrics in windows.values():
+            metrics.addPosts(times)
+    """
+
+    def __init__(self, window_days=None):
+        if window_days is not None:
+            window_days = np.timedelta64(window_days, 'D')
+        self.window = window_days
+        self.latest = None
+        self.hour_counts = np.zeros(24, dtype=int)
+        self.post_times = deque() #(time, hour) of the posts in the window
+        self.sents = deque() #(time, score) of the sentiment words in the window
+        self.sent_count = 0
+        self.last_score = None
+        self.delta_sum = 0.0
+
+    def addPosts(self, times):
+    #times: Graph timestamps, or a datetime64 array from parseTimes()
+        times = np.asarray(times)
+        if times.dtype.kind != 'M':
+            times = parseTimes(times)
+        times = np.sort(times.astype('datetime64[s]'))
+        if not len(times):
+            return
+        self._advance(times[-1])
+        hours = hoursOf(times)
+        keep = self._inWindow(times)
+        self.hour_counts += np.bincount(hours[keep], minlength=24)
+        if self.window is not None:
+            self.post_times.extend(zip(times[keep], hours[keep]))
+        self._expire()
+
+    def addMessage(self, words, time=None):
+    #words of one message, in order; time is needed when windowed
+        if self.window is not None:
+            if time is None:
+                raise ValueError("messages need a time when window_days is set")
+            time = np.datetime64(time[:19], 's') if isinstance(time, basestring) else time
+            self._advance(time)
+            self._expire()
+            if not self._inWindow(time):
+                return
+        scores = sentiments.lookup(words)
+        scores = scores[~np.isnan(scores)]
+        if not len(scores):
+            return
+        if self.sent_count:
+            self.delta_sum += scores[0] - self.last_score
+        self.delta_sum += scores[-1] - scores[0] #sum of the deltas within the message
+        self.sent_count += len(scores)
+        self.last_score = scores[-1]
+        if self.window is not None:
+            self.sents.extend((time, score) for score in scores)
+
+    def sleepRegularity(self):
+        return sleepRegularityFromCounts(self.hour_counts)
+
+    def variability(self):
+        p = self.sent_count
+        if p != 0:
+            return (.01 + self.delta_sum)/p
+        return 0
+
+    def _advance(self, time):
+        if self.latest is None or time > self.latest:
+            self.latest = time
+
+    def _inWindow(self, times):
+        if self.window is None:
+            return np.ones(np.shape(times), dtype=bool)
+        return times >= self.latest - self.window
+
+    def _expire(self):
+        if self.window is None:
+            return
+        cutoff = self.latest - self.window
+        while self.post_times and self.post_times[0][0] < cutoff:
+            time, hour = self.post_times.popleft()
+            self.hour_counts[hour] -= 1
+        while self.sents and self.sents[0][0] < cutoff:
+            time, score = self.sents.popleft()
+            self.sent_count -= 1
+            if self.sents:
+                self.delta_sum -= self.sents[0][1] - score
+
+
 
 def risk_metric(msg):
     """
@@ -73,22 +175,10 @@ def risk_metric(msg):
     for trait in five:
         normed[trait] = five[trait]/total
     
-    # currently arbitrary :\ 
-    risk_weights = {"disagreeable":1, 
-    "open": 1, 
-    "extraversion":1, 
-    "unconscientious":0.5, 
-    "stability":0.5,
-    "neurotic":-0.5, 
-    "agreeable":-1, 
-    "conscientious":-0.5, 
-    "introversion":-1, 
-    "closed":-1}
-
     risk = 0.0
 
     for trait in normed:
-        risk += normed[trait] * risk_weights[trait]
+        risk += normed[trait] * RISK_WEIGHTS[trait]
 
     return risk
 
@@ -96,14 +186,9 @@ def risk_metric(msg):
 
 def getLikeIndex(likes):
 #could be negative, or not
-    l_sent = 0
-    howmany = 0
-    for like in likes:
-        if like in sentiment_words:
-            l_sent += sentimens[word]
-            howmany += 1
-    if howmany != 0:
-        l_sent = l_sent/howmany  
+    l_sent = sentiments.lookup(likes)
+    l_sent = l_sent[~np.isnan(l_sent)]
+    if len(l_sent) != 0:
+        return l_sent.mean()
     else:
-        l_sent = 0
-    return l_sent
+        return 0
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Graph API client load benchmark.
+
+Starts a local fake Graph API (test/fakegraph.py) and drives GraphAPI,
+pagination, batching, caching and the Alpha ingestion/scoring pipeline
+against it. For every scenario it reports requests per second (as seen
+by the server), p50/p99 client request latency and the peak RSS of the
+process that ran it.
+
+Usage: python benchmarks/graph_load.py [scenario ...] [--users N]
+           [--threads N] [--latency SECONDS] [--throttle-rate FRACTION]
+
+Every scenario runs in a fresh child process, so peak RSS is per
+scenario. Latencies are measured around GraphAPI.request, i.e. per page
+for paginated scenarios and per batch call for batches; for streamed
+pages they stop once the response headers are in. With a throttle rate,
+refused requests are retried through the ingest RateLimiter. The
+"pipeline" scenario (and throttling) need the app modules' Python 2
+and data files.
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+APP = os.path.join(ROOT, "app")
+sys.path.insert(0, APP)
+sys.path.insert(0, os.path.join(ROOT, "test"))
+
+import facebook
+import facebook.cache
+from fakegraph import FakeGraph
+
+
+def timed(base):
+    """Returns a subclass of a GraphAPI class that records the duration
+    of every request in its latencies list."""
+    class Timed(base):
+        latencies = []
+
+        def request(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return base.request(self, *args, **kwargs)
+            finally:
+                self.latencies.append(time.time() - start)
+    return Timed
+
+
+def graph_api(args):
+    """Returns the GraphAPI class to drive. With throttling, requests go
+    through the ingest RateLimiter, with short backoffs."""
+    if not args.throttle_rate:
+        return facebook.GraphAPI
+    import ingest
+
+    class Retrying(ingest.ThrottledGraphAPI):
+        def __init__(self, access_token=None, **kwargs):
+            kwargs.setdefault("limiter", ingest.RateLimiter(
+                base_delay=0.01, max_delay=0.1, max_retries=10))
+            ingest.ThrottledGraphAPI.__init__(self, access_token, **kwargs)
+    return Retrying
+
+
+def in_threads(count, function, tasks):
+    """Calls function on every task from count threads."""
+    tasks = list(tasks)
+    lock = threading.Lock()
+    errors = []
+
+    def work():
+        while True:
+            with lock:
+                if not tasks:
+                    return
+                task = tasks.pop()
+            try:
+                function(task)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+# Scenarios. Each is called with (GraphAPI class, tokens, args) and
+# returns the number of items it read.
+
+def objects(API, tokens, args):
+    """get_object("me") for every user, repeatedly, one session per thread."""
+    graphs = threading.local()
+
+    def fetch(token):
+        if not hasattr(graphs, "graph"):
+            graphs.graph = API(token)
+        graphs.graph.access_token = token
+        graphs.graph.get_object("me")
+    in_threads(args.threads, fetch, tokens * args.repeat)
+    return len(tokens) * args.repeat
+
+
+def cached(API, tokens, args):
+    """objects, through a GraphCache whose entries are always stale, so
+    every request after the first is an ETag revalidation."""
+    cache = facebook.cache.GraphCache(ttl=0)
+    graph = API(cache=cache)
+
+    def fetch(token):
+        API(token, session=graph.session, cache=cache).get_object("me")
+    in_threads(args.threads, fetch, tokens * args.repeat)
+    return len(tokens) * args.repeat
+
+
+def batch(API, tokens, args):
+    """Every user's profile and first page of every connection, batched."""
+    def fetch(token):
+        graph = API(token)
+        with graph.batch() as requests:
+            results = [requests.get_object("me")]
+            for connection in ("posts", "outbox", "likes"):
+                results.append(requests.get_connections("me", connection))
+        for result in results:
+            result.result()
+    in_threads(args.threads, fetch, tokens)
+    return len(tokens) * 4
+
+
+def paginate(API, tokens, args, prefetch=0, stream=False):
+    """Every item of every connection of every user, page by page."""
+    counts = []
+
+    def fetch(token):
+        graph = API(token)
+        for connection in ("posts", "outbox", "likes"):
+            counts.append(sum(1 for item in graph.iter_connections(
+                "me", connection, page_size=args.page_size,
+                prefetch=prefetch, stream=stream)))
+    in_threads(args.threads, fetch, tokens)
+    return sum(counts)
+
+
+def prefetch(API, tokens, args):
+    """paginate, fetching two pages ahead."""
+    return paginate(API, tokens, args, prefetch=2)
+
+
+def stream(API, tokens, args):
+    """paginate, decoding every page incrementally."""
+    return paginate(API, tokens, args, stream=True)
+
+
+def pipeline(API, tokens, args):
+    """ingest.fetch_user and the Alpha scores of every user."""
+    # The scoring modules load their data files relative to app/.
+    os.chdir(APP)
+    import ingest
+    import stats
+
+    def score(token):
+        corpus = ingest.fetch_user(API(token), page_size=args.page_size)
+        stats.big_five(corpus.message_text())
+        stats.getSleepRegularity(corpus.post_times)
+        stats.getVariability(corpus.message_text().split())
+        stats.getLikeIndex(corpus.likes)
+    in_threads(args.threads, score, tokens)
+    return len(tokens)
+
+
+SCENARIOS = [objects, cached, batch, paginate, prefetch, stream, pipeline]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(scenario, url, tokens, args, results):
+    """Runs a scenario in this (child) process and puts its measurements
+    on the results queue."""
+    facebook.FACEBOOK_GRAPH_URL = url
+    try:
+        API = timed(graph_api(args))
+        start = time.time()
+        items = scenario(API, tokens, args)
+        elapsed = time.time() - start
+    except Exception as e:
+        results.put({"error": "%s: %s" % (type(e).__name__, e)})
+        return
+    # ru_maxrss is in kilobytes on Linux (and bytes on OS X).
+    results.put({"elapsed": elapsed, "items": items,
+                 "latencies": API.latencies,
+                 "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0])
+    parser.add_argument("scenarios", nargs="*",
+                        help="scenarios to run (default: all of %s)"
+                        % ", ".join(s.__name__ for s in SCENARIOS))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--likes", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="requests per user in objects and cached")
+    parser.add_argument("--page-size", type=int, default=25)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the server waits before answering")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="fraction of requests refused with code 17")
+    args = parser.parse_args()
+
+    names = dict((s.__name__, s) for s in SCENARIOS)
+    scenarios = [names[name] for name in args.scenarios] or SCENARIOS
+    server = FakeGraph(users=args.users, posts=args.posts,
+                       messages=args.messages, likes=args.likes,
+                       latency=args.latency, throttle_rate=args.throttle_rate)
+    with server:
+        print("%-10s %8s %8s %10s %9s %9s %10s" % (
+            "scenario", "seconds", "items", "req/s", "p50 ms", "p99 ms",
+            "peak RSS"))
+        for scenario in scenarios:
+            before = server.stats()["requests"]
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(
+                target=run,
+                args=(scenario, server.url, server.tokens, args, results))
+            child.start()
+            result = results.get()
+            child.join()
+            requests = server.stats()["requests"] - before
+            if "error" in result:
+                print("%-10s failed: %s" % (scenario.__name__,
+                                            result["error"]))
+                continue
+            latencies = result["latencies"]
+            print("%-10s %8.2f %8d %10.0f %9.2f %9.2f %7.1f MB" % (
+                scenario.__name__, result["elapsed"], result["items"],
+                requests / result["elapsed"],
+                percentile(latencies, 0.50) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                result["rss"] / 1024.0))
+        stats = server.stats()
+        print("server: %(requests)d requests, %(batch_operations)d batch "
+              "operations, %(throttled)d throttled, %(not_modified)d "
+              "not modified" % stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Tokenizer throughput benchmark.
+
+Compares the per-token emoticon search that Tokenizer.tokenize used to do
+(word_re.findall, then emoticon_re.search on every token) with the
+single-pass scanner behind Tokenizer.tokenize_many, and checks that both
+produce the same tokens. HTML entity decoding is timed separately against
+the per-entity replace loops it used to be done with.
+
+Usage: python benchmarks/tokenizer.py [corpus.txt] [--repeat N]
+
+The corpus is read one tweet per line. Without one, a synthetic corpus
+of tweet-like messages is generated.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import htmlentitydefs
+
+from happyfuntokenizing import Tokenizer, word_re, emoticon_re, \
+    html_entity_digit_re, html_entity_alpha_re, amp
+
+SAMPLES = (
+    u"RT @ #happyfuncoding: this is a typical Twitter tweet :-)",
+    u"HTML entities &amp; other Web oddities can be an &aacute;cute <em class='grumpy'>pain</em> >:(",
+    u"It's perhaps noteworthy that phone numbers like +1 (800) 123-4567, (800) 123-4567, and 123-4567 are treated as words despite their whitespace.",
+    u"OMG can't believe it's Friday already!!! See you at 8:30 ;) #weekend",
+    u"Check this out http://t.co/AbC123 ... seriously LOL :D :P",
+    u"@Someone I Don't Think So &#39;really&#39; =/",
+    u"Mac &amp; cheese &amp; a movie tonight, can&#39;t wait &lt;3",
+    )
+
+
+def synthetic_corpus(size, seed=0):
+    rng = random.Random(seed)
+    words = u" ".join(SAMPLES).split()
+    return [u" ".join(rng.choice(words) for i in range(rng.randint(5, 30)))
+            for j in range(size)]
+
+
+def legacy_html2unicode(s):
+    """The per-entity replace loops that Tokenizer used to decode HTML entities."""
+    ents = set(html_entity_digit_re.findall(s))
+    for ent in ents:
+        try:
+            s = s.replace(ent, unichr(int(ent[2:-1])))
+        except:
+            pass
+    ents = set(html_entity_alpha_re.findall(s))
+    ents = filter((lambda x : x != amp), ents)
+    for ent in ents:
+        try:
+            s = s.replace(ent, unichr(htmlentitydefs.name2codepoint[ent[1:-1]]))
+        except:
+            pass
+        s = s.replace(amp, " and ")
+    return s
+
+
+def legacy_tokenize(tokenizer, s):
+    """The lowercasing loop that Tokenizer.tokenize used before tokenize_many."""
+    s = tokenizer._Tokenizer__html2unicode(unicode(s))
+    words = word_re.findall(s)
+    return map((lambda x : x if emoticon_re.search(x) else x.lower()), words)
+
+
+def run(name, function, corpus, repeat, unit="tokens"):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        tokens = function(corpus)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print "%-16s %8.3fs  %10.0f docs/s  %10.0f %s/s" % (
+        name, best, len(corpus) / best, tokens / best, unit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("corpus", nargs="?")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--size", type=int, default=20000,
+                        help="number of synthetic tweets (without a corpus)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.decode("utf-8", "replace").strip() for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.size)
+    tok = Tokenizer(preserve_case=False)
+
+    for s in corpus:
+        if list(tok.iter_tokens(s)) != legacy_tokenize(tok, s):
+            raise AssertionError("Tokenizers disagree on %r" % s)
+
+    print "%d documents" % len(corpus)
+    html2unicode = tok._Tokenizer__html2unicode
+    run("legacy html", lambda c: sum(len(legacy_html2unicode(s)) for s in c), corpus, args.repeat, "chars")
+    run("html2unicode", lambda c: sum(len(html2unicode(s)) for s in c), corpus, args.repeat, "chars")
+    run("legacy", lambda c: sum(len(legacy_tokenize(tok, s)) for s in c), corpus, args.repeat)
+    run("tokenize", lambda c: sum(len(tok.tokenize(s)) for s in c), corpus, args.repeat)
+    run("tokenize_many", lambda c: sum(sum(1 for t in toks) for toks in tok.tokenize_many(c)), corpus, args.repeat)
+    run("bigrams", lambda c: sum(sum(1 for g in grams) for grams in tok.tokenize_many(c, n=2)), corpus, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ Originally created by Mitchell Stewart.
 <https://gist.github.com/mylsb/10294040>
 """
 import facebook
-import requests
 
 
 def some_action(post):
@@ -23,18 +22,11 @@ user = 'BillGates'
 
 graph = facebook.GraphAPI(access_token)
 profile = graph.get_object(user)
-posts = graph.get_connections(profile['id'], 'posts')
 
-# Wrap this block in a while loop so we can keep paginating requests until
-# finished.
-while True:
-    try:
-        # Perform some action on each post in the collection we receive from
-        # Facebook.
-        [some_action(post=post) for post in posts['data']]
-        # Attempt to make a request to the next page of data, if it exists.
-        posts = requests.get(posts['paging']['next']).json()
-    except KeyError:
-        # When there are no more pages (['paging']['next']), break from the
-        # loop and end the script.
-        break
+# iter_connections follows the paging cursors for us, fetching the next page
+# in the background while we work through the current one, until there are
+# no more pages.
+for post in graph.iter_connections(profile['id'], 'posts', prefetch=1):
+    # Perform some action on each post in the collection we receive from
+    # Facebook.
+    some_action(post=post)
@@ -56,6 +56,7 @@ __all__ = ['Batch',
 
 import base64
 import collections
+import heapq
 import pickle
 
 from google.appengine.datastore import entity_pb
@@ -1147,6 +1148,11 @@ class _ReverseOrder(_BaseComponent):
         'an object of the same type.')
     return -cmp(self._obj, other._obj)
 
+  def __lt__(self, other):
+
+
+    return other._obj < self._obj
+
 
 class PropertyOrder(Order):
   """An immutable class that represents a sort order for a single property."""
@@ -1220,6 +1226,22 @@ class PropertyOrder(Order):
     else:
       return _ReverseOrder(max(lhs_values))
 
+  def _sort_key(self, lhs_value_map):
+    """Like _key, but descending orders are not reversed.
+
+    Sorting by this key with reverse=(direction == DESCENDING) compares the
+    plain values rather than _ReverseOrder wrappers.
+    """
+    lhs_values = lhs_value_map[self.__order.property()]
+    if not lhs_values:
+      raise datastore_errors.BadArgumentError(
+          'Missing value for property (%s)' % self.__order.property())
+
+    if self.__order.direction() == self.ASCENDING:
+      return min(lhs_values)
+    else:
+      return max(lhs_values)
+
   def _cmp(self, lhs_value_map, rhs_value_map):
     lhs_values = lhs_value_map[self.__order.property()]
     rhs_values = rhs_value_map[self.__order.property()]
@@ -2139,7 +2161,41 @@ class Query(_BaseQuery):
     return pb
 
 
-def apply_query(query, entities):
+def _sort_value_maps(order, value_maps, limit=None):
+  """Sorts value maps by the given order.
+
+  When only the first limit value maps are needed, they are selected with a
+  heap instead of sorting all of them. Otherwise orders on properties are
+  applied as one stable sort per order, last order first, each with a key
+  precomputed for every value map, rather than with a comparison function.
+
+  Args:
+    order: the Order to sort by.
+    value_maps: a list of value maps, as created by _make_key_value_map. It
+      may be sorted in place.
+    limit: if not None, the number of value maps that are needed.
+
+  Returns:
+    A sorted list of value maps, truncated to limit.
+  """
+  if isinstance(order, CompositeOrder):
+    orders = order.orders
+  else:
+    orders = (order,)
+  if not all(isinstance(component, PropertyOrder) for component in orders):
+    value_maps.sort(order._cmp)
+    return value_maps[:limit]
+
+  if limit is not None and limit < len(value_maps):
+    return heapq.nsmallest(limit, value_maps, key=order._key)
+  for component in reversed(orders):
+    value_maps.sort(key=component._sort_key,
+                    reverse=component.direction == PropertyOrder.DESCENDING)
+  return value_maps
+
+
+@datastore_rpc._positional(2)
+def apply_query(query, entities, limit=None, start=None):
   """Performs the given query on a set of in-memory entities.
 
   This function can perform queries impossible in the datastore (e.g a query
@@ -2155,6 +2211,10 @@ def apply_query(query, entities):
   Args:
     query: a datastore_query.Query to apply
     entities: a list of entity_pb.EntityProto on which to apply the query.
+    limit: if not None, only the first limit results are returned.
+    start: if not None, an (entity_pb.EntityProto, inclusive) position in an
+      ordered query, such as a decoded query cursor. Entities that sort
+      before it, or at it if not inclusive, are dropped before sorting.
 
   Returns:
     A list of entity_pb.EntityProto contain the results of the query.
@@ -2174,14 +2234,46 @@ def apply_query(query, entities):
 
 
 
+    if start is not None:
+      raise datastore_errors.BadArgumentError(
+          'start requires an ordered query')
     if query._filter_predicate:
-      return filter(query._filter_predicate, filtered_entities)
-    return filtered_entities
+      filtered_entities = filter(query._filter_predicate, filtered_entities)
+    return filtered_entities[:limit]
+
+
 
 
 
+  def make_value_maps(names):
+    for entity in filtered_entities:
+      value_map = _make_key_value_map(entity, names)
+      value_map['__entity__'] = entity
+      yield value_map
+
+  value_maps = _apply_query_to_value_maps(query, make_value_maps,
+                                          limit=limit, start=start)
+  return [value_map['__entity__'] for value_map in value_maps]
+
+
+@datastore_rpc._positional(2)
+def _apply_query_to_value_maps(query, make_value_maps, limit=None, start=None):
+  """Filters and sorts value maps by an ordered query.
 
+  This is apply_query for results that are not entity_pb.EntityProtos, such as
+  the index rows of projection queries.
 
+  Args:
+    query: a datastore_query.Query with an order.
+    make_value_maps: a function that takes a set of property names and returns
+      an iterable of value maps over them, as created by _make_key_value_map,
+      each holding the result it stands for under '__entity__'.
+    limit: as for apply_query.
+    start: as for apply_query.
+
+  Returns:
+    A list of the value maps of the results, in order.
+  """
   names = query._order._get_prop_names()
   if query._filter_predicate:
     names |= query._filter_predicate._get_prop_names()
@@ -2189,20 +2281,31 @@ def apply_query(query, entities):
 
   exists_filter = _PropertyExistsFilter(names)
 
+  if start is not None:
+    start_entity, start_inclusive = start
+    names.add(datastore_types.KEY_SPECIAL_PROPERTY)
+    start_value_map = _make_key_value_map(start_entity, names)
+    if query._filter_predicate:
+      query._filter_predicate._prune(start_value_map)
+
   value_maps = []
-  for entity in filtered_entities:
-    value_map = _make_key_value_map(entity, names)
+  for value_map in make_value_maps(names):
 
 
 
     if exists_filter._apply(value_map) and (
         not query._filter_predicate or
         query._filter_predicate._prune(value_map)):
-      value_map['__entity__'] = entity
+      if start is not None:
+        position = query._order._cmp(value_map, start_value_map)
+        if not position and start_entity.has_key():
+          position = cmp(value_map[datastore_types.KEY_SPECIAL_PROPERTY],
+                         start_value_map[datastore_types.KEY_SPECIAL_PROPERTY])
+        if position < 0 or (not position and not start_inclusive):
+          continue
       value_maps.append(value_map)
 
-  value_maps.sort(query._order._cmp)
-  return [value_map['__entity__'] for value_map in value_maps]
+  return _sort_value_maps(query._order, value_maps, limit)
 
 
 class _AugmentedQuery(_BaseQuery):
@@ -71,6 +71,9 @@ datastore_pb.Query.__hash__ = lambda self: hash(self.Encode())
 _MAX_TIMEOUT = 5.0
 
 
+_DEFAULT_READER_POOL_SIZE = 4
+
+
 
 
 _OPERATOR_MAP = {
@@ -203,6 +206,19 @@ class SQLiteConnectionWrapper(sqlite3.Connection):
     return super(SQLiteConnectionWrapper, self).cursor(SQLiteCursorWrapper)
 
 
+class _CommitBatch(object):
+  """The writes of the writers that wait for one commit in WAL mode.
+
+  Attributes:
+    done: bool, whether the commit has been attempted.
+    error: the exception the commit raised, or None if it succeeded.
+  """
+
+  def __init__(self):
+    self.done = False
+    self.error = None
+
+
 def ReferencePropertyToReference(refprop):
   ref = entity_pb.Reference()
   ref.set_app(refprop.app())
@@ -329,7 +345,7 @@ class KindPseudoKind(object):
       is invalid.
     """
     kind_range = datastore_stub_util.ParseKindQuery(query, filters, orders)
-    conn = self._stub._GetConnection()
+    conn = self._stub._GetConnection(read_only=True)
     cursor = None
     try:
       prefix = self._stub._GetTablePrefix(query)
@@ -393,7 +409,7 @@ class PropertyPseudoKind(object):
     property_range = datastore_stub_util.ParsePropertyQuery(query, filters,
                                                             orders)
     keys_only = query.keys_only()
-    conn = self._stub._GetConnection()
+    conn = self._stub._GetConnection(read_only=True)
     cursor = None
     try:
       prefix = self._stub._GetTablePrefix(query)
@@ -548,7 +564,9 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
                consistency_policy=None,
                root_path=None,
                use_atexit=True,
-               auto_id_policy=datastore_stub_util.SEQUENTIAL):
+               auto_id_policy=datastore_stub_util.SEQUENTIAL,
+               use_wal=False,
+               reader_pool_size=_DEFAULT_READER_POOL_SIZE):
     """Constructor.
 
     Initializes the SQLite database if necessary.
@@ -569,6 +587,13 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       root_path: string, the root path of the app.
       use_atexit: bool, indicates if the stub should save itself atexit.
       auto_id_policy: enum, datastore_stub_util.SEQUENTIAL or .SCATTERED
+      use_wal: bool, default False. If True and datastore_file is set, the
+          database is put in write-ahead log mode. Gets and queries then run
+          on a pool of read-only connections, concurrently with each other
+          and with writes, and writes go through a single writer connection
+          whose commits are shared by writers that queue up behind each other.
+      reader_pool_size: int, the maximum number of read-only connections
+          opened when use_wal is True.
     """
     datastore_stub_util.BaseDatastore.__init__(self, require_indexes,
                                                consistency_policy,
@@ -592,23 +617,23 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
         }
     self.__id_lock = threading.Lock()
 
-    if self.__verbose:
-      sql_conn = SQLiteConnectionWrapper
-    else:
-      sql_conn = sqlite3.Connection
+    self.__connection = self.__Connect()
 
-    self.__connection = sqlite3.connect(
-        self.__datastore_file or ':memory:',
-        timeout=_MAX_TIMEOUT,
-        check_same_thread=False,
-        factory=sql_conn)
 
+    self.__connection_lock = threading.RLock()
 
 
-    self.__connection.text_factory = lambda x: unicode(x, 'utf-8', 'ignore')
 
+    self.__use_wal = bool(use_wal and self.__datastore_file)
+    self.__connection_depth = 0
+    self.__writers_waiting = 0
+    self.__commit_batch = _CommitBatch()
+    self.__commit_cond = threading.Condition(threading.Lock())
 
-    self.__connection_lock = threading.RLock()
+    self.__reader_pool_size = max(1, reader_pool_size)
+    self.__readers = set()
+    self.__idle_readers = []
+    self.__reader_cond = threading.Condition(threading.Lock())
 
 
     self.__namespaces = set()
@@ -628,11 +653,31 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
                                              self.READ_ERROR_MSG %
                                                  (self.__datastore_file, e))
 
+  def __Connect(self):
+    """Opens a new connection to the SQLite DB."""
+    if self.__verbose:
+      sql_conn = SQLiteConnectionWrapper
+    else:
+      sql_conn = sqlite3.Connection
+
+    conn = sqlite3.connect(
+        self.__datastore_file or ':memory:',
+        timeout=_MAX_TIMEOUT,
+        check_same_thread=False,
+        factory=sql_conn)
+
+
+
+    conn.text_factory = lambda x: unicode(x, 'utf-8', 'ignore')
+    return conn
+
   def __Init(self):
 
 
 
     self.__connection.execute('PRAGMA synchronous = OFF')
+    if self.__use_wal:
+      self.__connection.execute('PRAGMA journal_mode = WAL')
 
 
     self.__connection.executescript(_CORE_SCHEMA)
@@ -686,8 +731,13 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     pass
 
   def Close(self):
-    """Closes the SQLite connection and releases the files."""
+    """Closes the SQLite connections and releases the files."""
     conn = self._GetConnection()
+    with self.__reader_cond:
+      for reader in self.__readers:
+        reader.close()
+      self.__readers.clear()
+      self.__idle_readers = []
     conn.close()
 
   @staticmethod
@@ -789,25 +839,96 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       orders = 'ORDER BY ' + orders
     return orders
 
-  def _GetConnection(self):
+  def _GetConnection(self, read_only=False):
     """Retrieves a connection to the SQLite DB.
 
+    Args:
+      read_only: bool, whether the connection is only used to read. In WAL
+          mode, read-only connections come from a pool and are not
+          serialized with writes.
+
     Returns:
       An SQLite connection object.
     """
+    if read_only and self.__use_wal:
+      return self.__GetReader()
+    if self.__use_wal:
+      with self.__commit_cond:
+        self.__writers_waiting += 1
     self.__connection_lock.acquire()
+    if self.__use_wal:
+      with self.__commit_cond:
+        self.__writers_waiting -= 1
+    self.__connection_depth += 1
     return self.__connection
 
   def _ReleaseConnection(self, conn):
     """Releases a connection for use by other operations.
 
-    If a transaction is supplied, no action is taken.
+    In WAL mode, a writer that other writers are queued up behind leaves its
+    changes for the last of them to commit, and waits for that commit. If the
+    commit fails, its changes are rolled back and every writer of the batch
+    raises the error.
 
     Args:
       conn: An SQLite connection object.
     """
-    conn.commit()
+    if conn is not self.__connection:
+      self.__ReleaseReader(conn)
+      return
+    self.__connection_depth -= 1
+    if not self.__use_wal or self.__connection_depth:
+      conn.commit()
+      self.__connection_lock.release()
+      return
+
+    with self.__commit_cond:
+      batch = self.__commit_batch
+      defer = self.__writers_waiting > 0
+    if not defer:
+      error = None
+      try:
+        conn.commit()
+      except BaseException, error:
+        try:
+          conn.rollback()
+        except sqlite3.Error:
+          pass
+        raise
+      finally:
+        with self.__commit_cond:
+          batch.error = error
+          batch.done = True
+          self.__commit_batch = _CommitBatch()
+          self.__commit_cond.notify_all()
+        self.__connection_lock.release()
+      return
+
     self.__connection_lock.release()
+    with self.__commit_cond:
+      while not batch.done:
+        self.__commit_cond.wait()
+    if batch.error is not None:
+      raise batch.error
+
+  def __GetReader(self):
+    """Takes a read-only connection from the pool, opening one if needed."""
+    with self.__reader_cond:
+      while not self.__idle_readers:
+        if len(self.__readers) < self.__reader_pool_size:
+          conn = self.__Connect()
+          conn.execute('PRAGMA query_only = ON')
+          self.__readers.add(conn)
+          return conn
+        self.__reader_cond.wait()
+      return self.__idle_readers.pop()
+
+  def __ReleaseReader(self, conn):
+    """Returns a read-only connection to the pool."""
+    with self.__reader_cond:
+      if conn in self.__readers:
+        self.__idle_readers.append(conn)
+        self.__reader_cond.notify()
 
   def __ConfigureNamespace(self, conn, prefix, app_id, name_space):
     """Ensures the relevant tables and indexes exist.
@@ -853,8 +974,13 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       data = (data.app(), data.name_space())
     prefix = ('%s!%s' % data).replace('"', '""')
     if data not in self.__namespaces:
-      self.__namespaces.add(data)
-      self.__ConfigureNamespace(self.__connection, prefix, *data)
+      conn = self._GetConnection()
+      try:
+        if data not in self.__namespaces:
+          self.__ConfigureNamespace(conn, prefix, *data)
+          self.__namespaces.add(data)
+      finally:
+        self._ReleaseConnection(conn)
     return prefix
 
   def __DeleteRows(self, conn, paths, table):
@@ -1251,13 +1377,12 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       self._ReleaseConnection(conn)
 
   def _Get(self, key):
-    conn = self._GetConnection()
+    conn = self._GetConnection(read_only=True)
     try:
       prefix = self._GetTablePrefix(key)
-      c = conn.execute(
+      row = conn.execute(
           'SELECT entity FROM "%s!Entities" WHERE __path__ = ?' % (prefix,),
-          (self.__EncodeIndexPB(key.path()),))
-      row = c.fetchone()
+          (self.__EncodeIndexPB(key.path()),)).fetchone()
       if row:
         entity = entity_pb.EntityProto()
         entity.ParseFromString(row[0])
@@ -1289,7 +1414,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
 
 
-    conn = self._GetConnection()
+    conn = self._GetConnection(read_only=True)
     try:
       db_cursor = conn.execute(sql_stmt, params)
       entities = (entity_pb.EntityProto(row[1]) for row in db_cursor.fetchall())
@@ -1335,7 +1460,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
       sql_stmt, params = result
 
-      conn = self._GetConnection()
+      conn = self._GetConnection(read_only=True)
       try:
         if query.property_name_list():
           db_cursor = _ProjectionPartialEntityGenerator(
@@ -1345,14 +1470,12 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
         dsquery = datastore_stub_util._MakeQuery(query, filters, orders,
                                                  filter_predicate)
 
-        filtered_entities = [r for r in db_cursor]
-
-
         if filter_predicate:
-          filtered_entities = filter(filter_predicate, filtered_entities)
+          db_cursor = itertools.ifilter(filter_predicate, db_cursor)
 
-        cursor = datastore_stub_util.ListCursor(
-            query, dsquery, orders, index_list, filtered_entities)
+        cursor = datastore_stub_util.IteratorCursor(
+            query, dsquery, orders, index_list, db_cursor)
+        cursor.Materialize()
       finally:
         self._ReleaseConnection(conn)
     return cursor
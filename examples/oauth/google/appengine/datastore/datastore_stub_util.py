@@ -1264,6 +1264,173 @@ class ListCursor(BaseCursor):
                                  first_result, self.__last_result)
 
 
+class IteratorCursor(BaseCursor):
+  """A query cursor that pulls its results from an iterator.
+
+  Unlike ListCursor, results are deduplicated, positioned at the start and end
+  cursors and cut off at the query's limit as they are fetched, so only the
+  batch being returned (and the result after it) is held by the cursor.
+
+  Public properties:
+    keys_only: whether the query is keys_only
+    start_cursor: the (cursor entity, inclusive) position the query starts
+      at, as returned by _DecodeCompiledCursor, or None.
+  """
+
+  def __init__(self, query, dsquery, orders, index_list, results=()):
+    """Constructor.
+
+    Args:
+      query: the query request proto
+      dsquery: a datastore_query.Query over query.
+      orders: the orders of query as returned by _GuessOrders.
+      index_list: the list of indexes used by the query.
+      results: an iterable of entity_pb.EntityProto, as for SetResults.
+    """
+    super(IteratorCursor, self).__init__(query, dsquery, orders, index_list)
+
+    if query.has_compiled_cursor() and query.compiled_cursor().has_position():
+      self.start_cursor = self._DecodeCompiledCursor(query.compiled_cursor())
+      self.__last_result = self.start_cursor[0]
+    else:
+      self.start_cursor = None
+      self.__last_result = None
+
+    self.__end_cursor = None
+    self.__empty = False
+    if query.has_end_compiled_cursor():
+      if query.end_compiled_cursor().has_position():
+        self.__end_cursor = self._DecodeCompiledCursor(
+            query.end_compiled_cursor())
+      else:
+        self.__empty = True
+
+    self.__limit = None
+    if query.has_limit():
+      limit = query.limit()
+      if query.offset():
+        limit += query.offset()
+      if limit >= 0:
+        self.__limit = limit
+
+    self.SetResults(results)
+
+  def SetResults(self, results):
+    """Sets the iterable the cursor pulls its results from.
+
+    Args:
+      results: an iterable of entity_pb.EntityProto, in query order. Unless
+        the query groups by properties, it may already leave out the results
+        before start_cursor.
+    """
+    if self.__empty:
+      results = ()
+    results = iter(results)
+    if self.group_by:
+      results = self.__Distinct(results)
+    if self.start_cursor:
+      results = itertools.dropwhile(self.__IsBeforeStart, results)
+    if self.__end_cursor:
+      results = itertools.takewhile(self.__IsBeforeEnd, results)
+    if self.__limit is not None:
+      results = itertools.islice(results, self.__limit)
+
+    self.__results = results
+    self.__next_result = None
+    self.__fetched = False
+
+  def __Distinct(self, results):
+    """Yields the first result of every group_by group."""
+    distincts = set()
+    for result in results:
+      key_value = _GetGroupByKey(result, self.group_by)
+      if key_value not in distincts:
+        distincts.add(key_value)
+        yield result
+
+  def __IsBeforeStart(self, entity):
+    return self._IsBeforeCursor(entity, self.start_cursor)
+
+  def __IsBeforeEnd(self, entity):
+    return self._IsBeforeCursor(entity, self.__end_cursor)
+
+  def __HasNext(self):
+    """True if there are results left, reading the next one if needed."""
+    if not self.__fetched:
+      self.__next_result = next(self.__results, None)
+      self.__fetched = True
+    return self.__next_result is not None
+
+  def __Next(self):
+    """Returns the next result, or None if there are none left."""
+    if not self.__HasNext():
+      return None
+    self.__fetched = False
+    self.__last_result = self.__next_result
+    return self.__next_result
+
+  def Materialize(self):
+    """Reads the remaining results into memory.
+
+    Call this before closing the source of the results, e.g. a database
+    cursor, while the query cursor still has results to return.
+    """
+    results = list(self.__results)
+    if self.__fetched and self.__next_result is not None:
+      results.insert(0, self.__next_result)
+    self.__results = iter(results)
+    self.__next_result = None
+    self.__fetched = False
+
+  def PopulateQueryResult(self, result, count, offset,
+                          compile=False, first_result=False):
+    """Populates a QueryResult with this cursor and the given number of results.
+
+    Args:
+      result: datastore_pb.QueryResult
+      count: integer of how many results to return
+      offset: integer of how many results to skip
+      compile: boolean, whether we are compiling this query
+      first_result: whether the query result is the first for this query
+    """
+    Check(offset >= 0, 'Offset must be >= 0')
+
+    skipped = 0
+    while skipped < min(offset, _MAX_QUERY_OFFSET) and self.__HasNext():
+      self.__Next()
+      skipped += 1
+    if skipped:
+      result.set_skipped_results(skipped)
+
+    if compile and skipped:
+      self._EncodeCompiledCursor(
+          self.__last_result,
+          result.mutable_skipped_results_compiled_cursor())
+    if (skipped == offset or not self.__HasNext()) and count:
+
+      if count > _MAXIMUM_RESULTS:
+        count = _MAXIMUM_RESULTS
+      results = []
+      while len(results) < count and self.__HasNext():
+        results.append(self.__Next())
+
+
+
+
+
+      result.result_list().extend(
+          LoadEntity(entity, self.keys_only, self.property_names)
+          for entity in results)
+      if compile:
+        for entity in results:
+          self._EncodeCompiledCursor(entity,
+                                     result.add_result_compiled_cursor())
+
+    result.set_more_results(self.__HasNext())
+    self._PopulateResultMetadata(result, compile,
+                                 first_result, self.__last_result)
+
+
 def _SynchronizeTxn(function):
   """A decorator that locks a transaction during the function call."""
 
@@ -4147,30 +4314,20 @@ def _MakeQuery(query_pb, filters, orders, filter_predicate):
   else:
     return query
 
-def _CreateIndexEntities(entity, postfix_props):
-  """Creates entities for index values that would appear in prodcution.
-
-  This function finds all multi-valued properties listed in split_props, and
-  creates a new entity for each unique combination of values. The resulting
-  entities will only have a single value for each property listed in
-  split_props.
-
-  It reserves the right to include index data that would not be
-  seen in production, e.g. by returning the original entity when no splitting
-  is needed. LoadEntity will remove any excess fields.
-
-  This simulates the results seen by an index scan in the datastore.
+def _GetIndexSplits(entity, postfix_props):
+  """Finds the properties an entity's index rows are split on.
 
   Args:
     entity: The entity_pb.EntityProto to split.
-    split_props: A set of property names to split on.
+    postfix_props: A set of property names to split on.
 
   Returns:
-    A list of the split entity_pb.EntityProtos.
+    A list of (name, values) tuples, one for every property in postfix_props
+    that has more than one value, where values are the distinct
+    entity_pb.PropertyValues of the property.
   """
   to_split = {}
-  split_required = False
-  base_props = []
+  split_required = set()
   for prop in entity.property_list():
     if prop.name() in postfix_props:
       values = to_split.get(prop.name())
@@ -4179,54 +4336,110 @@ def _CreateIndexEntities(entity, postfix_props):
         to_split[prop.name()] = values
       else:
 
-        split_required = True
+        split_required.add(prop.name())
       if prop.value() not in values:
         values.append(prop.value())
-    else:
-      base_props.append(prop)
+  return [(name, to_split[name]) for name in sorted(split_required)]
 
-  if not split_required:
 
-    return [entity]
+def _CreateIndexEntity(entity, split, property_names=None):
+  """Creates the entity for a single index row of an entity.
 
+  Args:
+    entity: The entity_pb.EntityProto the row belongs to.
+    split: A list of (name, value) tuples, the entity_pb.PropertyValue the row
+      has for every property it is split on.
+    property_names: If not None, the only other properties to copy from entity.
+
+  Returns:
+    An entity_pb.EntityProto.
+  """
+  if not split and property_names is None:
+    return entity
+
+  split_names = set(name for name, _ in split)
   clone = entity_pb.EntityProto()
-  clone.CopyFrom(entity)
-  clone.clear_property()
-  clone.property_list().extend(base_props)
-  results = [clone]
+  clone.mutable_key().CopyFrom(entity.key())
+  clone.mutable_entity_group().CopyFrom(entity.entity_group())
+  for prop in entity.property_list():
+    if prop.name() not in split_names and (property_names is None or
+                                           prop.name() in property_names):
+      clone.add_property().CopyFrom(prop)
+  for name, value in split:
+    prop = clone.add_property()
+    prop.set_name(name)
+    prop.set_multiple(False)
+    prop.set_meaning(entity_pb.Property.INDEX_VALUE)
+    prop.mutable_value().CopyFrom(value)
+  return clone
 
-  for name, splits in to_split.iteritems():
-    if len(splits) == 1:
 
-      for result in results:
-        prop = result.add_property()
-        prop.set_name(name)
-        prop.set_multiple(False)
-        prop.set_meaning(entity_pb.Property.INDEX_VALUE)
-        prop.mutable_value().CopyFrom(splits[0])
+def _IndexRowValueMaps(entities, postfix_props, names):
+  """Yields value maps for the index rows of entities.
+
+  This simulates the rows seen by an index scan in the datastore. An entity
+  has one row for every combination of the distinct values of its
+  multi-valued properties in postfix_props, and a single row if it has none.
+  Each row is a value map over names that holds just that row's value for
+  every split property, and whose '__entity__' is an (entity, split) tuple
+  as taken by _CreateIndexEntity. Combinations of values are generated one
+  at a time, so rows can be filtered before any entity is created for them.
+
+  Only the split properties are marked as INDEX_VALUE in the row entities;
+  the other properties are copied unchanged, and LoadEntity marks every
+  projected property as INDEX_VALUE anyway.
+
+  Args:
+    entities: An iterable of entity_pb.EntityProto.
+    postfix_props: A set of property names to split on.
+    names: The property names to create value maps over.
+  """
+  for entity in entities:
+    value_map = datastore_query._make_key_value_map(entity, names)
+    to_split = _GetIndexSplits(entity, postfix_props)
+    if not to_split:
+      value_map['__entity__'] = (entity, [])
+      yield value_map
       continue
 
-    new_results = []
-    for result in results:
-      for split in splits:
-        clone = entity_pb.EntityProto()
-        clone.CopyFrom(result)
-        prop = clone.add_property()
-        prop.set_name(name)
-        prop.set_multiple(False)
-        prop.set_meaning(entity_pb.Property.INDEX_VALUE)
-        prop.mutable_value().CopyFrom(split)
-        new_results.append(clone)
-    results = new_results
-  return results
+    split_names = [name for name, _ in to_split]
+    split_values = [[(value, datastore_types.PropertyValueToKeyValue(value))
+                     for value in values]
+                    for _, values in to_split]
+    for combination in itertools.product(*split_values):
+      row_value_map = value_map.copy()
+      for name, (_, key_value) in zip(split_names, combination):
+        if name in row_value_map:
+          row_value_map[name] = [key_value]
+      row_value_map['__entity__'] = (
+          entity, [(name, value) for name, (value, _)
+                   in zip(split_names, combination)])
+      yield row_value_map
+
+
+def _ApplyQueryToIndexRows(dsquery, results, postfix_props, property_names,
+                           limit=None, start=None):
+  """Performs an index-only query on the index rows of a set of entities.
 
+  Args:
+    dsquery: A datastore_query.Query with an order.
+    results: A list of entity_pb.EntityProto.
+    postfix_props: A set of property names to split rows on.
+    property_names: The names of the properties the row entities need.
+    limit: As for datastore_query.apply_query.
+    start: As for datastore_query.apply_query.
 
-def _CreateIndexOnlyQueryResults(results, postfix_props):
-  """Creates a result set similar to that returned by an index only query."""
-  new_results = []
-  for result in results:
-    new_results.extend(_CreateIndexEntities(result, postfix_props))
-  return new_results
+  Returns:
+    A list of entity_pb.EntityProto, one for every index row in the results.
+  """
+  results = filter(dsquery._key_filter, results)
+  value_maps = datastore_query._apply_query_to_value_maps(
+      dsquery,
+      lambda names: _IndexRowValueMaps(results, postfix_props, names),
+      limit=limit, start=start)
+  return [_CreateIndexEntity(entity, split, property_names)
+          for entity, split in
+          (value_map['__entity__'] for value_map in value_maps)]
 
 
 def _ExecuteQuery(results, query, filters, orders, index_list,
@@ -4244,17 +4457,36 @@ def _ExecuteQuery(results, query, filters, orders, index_list,
           specific filters without changing the entire stub.
 
   Returns:
-    A ListCursor over the results of applying query to results.
+    An IteratorCursor over the results of applying query to results.
   """
   orders = _GuessOrders(filters, orders)
   dsquery = _MakeQuery(query, filters, orders, filter_predicate)
 
-  if query.property_name_size():
-    results = _CreateIndexOnlyQueryResults(
-       results, set(order.property() for order in orders))
+  cursor = IteratorCursor(query, dsquery, orders, index_list)
+
+
 
-  return ListCursor(query, dsquery, orders, index_list,
-                    datastore_query.apply_query(dsquery, results))
+  limit = None
+  start = None
+  if not query.group_by_property_name_size():
+    if query.has_limit() and query.limit() >= 0:
+      limit = query.offset() + query.limit()
+    start = cursor.start_cursor
+
+  if query.property_name_size():
+    property_names = set(query.property_name_list())
+    property_names.update(query.group_by_property_name_list())
+    property_names.update(dsquery._order._get_prop_names())
+    if dsquery._filter_predicate:
+      property_names.update(dsquery._filter_predicate._get_prop_names())
+    results = _ApplyQueryToIndexRows(
+        dsquery, results, set(order.property() for order in orders),
+        property_names, limit=limit, start=start)
+  else:
+    results = datastore_query.apply_query(dsquery, results, limit=limit,
+                                          start=start)
+  cursor.SetResults(results)
+  return cursor
 
 
 def _UpdateCost(cost, entity_writes, index_writes):
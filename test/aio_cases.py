@@ -0,0 +1,34 @@
+"""Coroutines for test_aio, kept apart so that test_aio imports (and skips)
+under Python 2."""
+
+import asyncio
+
+
+async def gather_objects(graph, id_lists):
+    async with graph:
+        return await asyncio.gather(
+            *[graph.get_objects(ids) for ids in id_lists])
+
+
+async def collect(graph, *args, **kwargs):
+    async with graph:
+        return [item async for item in graph.iter_connections(*args,
+                                                               **kwargs)]
+
+
+async def take(graph, count, *args, **kwargs):
+    """The first count items, leaving the rest of the iterator unread."""
+    async with graph:
+        items = []
+        posts = graph.iter_connections(*args, **kwargs)
+        async for item in posts:
+            items.append(item)
+            if len(items) == count:
+                break
+        await posts.aclose()
+        return items
+
+
+async def get_object(graph, id):
+    async with graph:
+        return await graph.get_object(id)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A local stand-in for the Graph API, for tests and benchmarks.
+
+FakeGraph serves a fixed set of synthetic users over HTTP:
+
+    with FakeGraph(users=10, latency=0.005, throttle_rate=0.01) as server:
+        facebook.FACEBOOK_GRAPH_URL = server.url
+        graph = facebook.GraphAPI(server.tokens[0])
+        posts = list(graph.iter_connections("me", "posts", page_size=25))
+
+Each user (access token "token-<n>") has a profile and posts, outbox
+and likes connections, paginated with cursors and filtered by since and
+until like the real ones. GET responses carry an ETag and answer a
+matching If-None-Match with 304 Not Modified. POSTs to the root run
+batch requests. Every request can be delayed by latency seconds, and a
+throttle_rate fraction of requests fail with Graph's "User request limit
+reached" error (code 17).
+
+"""
+
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+    from urllib import urlencode
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse, urlencode
+
+
+CONNECTIONS = ("posts", "outbox", "likes")
+
+DEFAULT_LIMIT = 25
+
+# Timestamps of the synthetic items count back from here (May 2014).
+EPOCH = 1400000000
+
+WORDS = (
+    "happy", "sad", "love", "hate", "party", "work", "tired", "friends",
+    "great", "awful", "tonight", "weekend", "exam", "beach", "lol", "sorry",
+    "excited", "bored", "miss", "you", "the", "a", "and", "to", "is", "so",
+    "really", "can't", "wait", "again", "why", "good", "bad", "fun", "home")
+
+CATEGORIES = (
+    "Musician/band", "Movie", "Tv show", "Book", "Sports team", "Athlete",
+    "Restaurant/cafe", "Community", "Company", "Local business")
+
+
+def graph_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(timestamp))
+
+
+def throttling_error():
+    return {"error": {"message": "(#17) User request limit reached",
+                      "type": "OAuthException", "code": 17}}
+
+
+def oauth_error(message):
+    return {"error": {"message": message, "type": "OAuthException",
+                      "code": 190}}
+
+
+class FakeUser(object):
+    """The profile and connections of one synthetic user.
+
+    Connections are lists of items, newest first as Graph returns them.
+
+    """
+    def __init__(self, index, posts, messages, likes, thread_length, seed):
+        rng = random.Random(seed * 1000003 + index)
+        self.id = str(100000 + index)
+        self.name = "User%d Fake" % index
+        self.profile = {"id": self.id, "name": self.name,
+                        "first_name": "User%d" % index, "last_name": "Fake"}
+        self.connections = {
+            "posts": self._items(rng, posts, self._post),
+            "outbox": self._items(rng, messages, lambda rng, i, t:
+                                  self._thread(rng, i, t, thread_length)),
+            "likes": self._items(rng, likes, self._like)}
+
+    def _items(self, rng, count, make):
+        timestamp = EPOCH
+        items = []
+        for i in range(count):
+            timestamp -= rng.randint(60, 86400)
+            items.append(make(rng, i, timestamp))
+        return items
+
+    def _text(self, rng):
+        return " ".join(rng.choice(WORDS) for i in range(rng.randint(3, 25)))
+
+    def _post(self, rng, i, timestamp):
+        return {"id": "%s_%d" % (self.id, i), "message": self._text(rng),
+                "created_time": graph_time(timestamp),
+                "updated_time": graph_time(timestamp),
+                "_time": timestamp}
+
+    def _thread(self, rng, i, timestamp, length):
+        friend = {"id": str(900000 + i), "name": "Friend%d" % i}
+        me = {"id": self.id, "name": self.name}
+        comments = [{"id": "c%s_%d_%d" % (self.id, i, j),
+                     "from": me if j % 2 == 0 else friend,
+                     "message": self._text(rng),
+                     "created_time": graph_time(timestamp - 60 * j)}
+                    for j in range(length)]
+        return {"id": "t%s_%d" % (self.id, i),
+                "to": {"data": [me, friend]},
+                "updated_time": graph_time(timestamp),
+                "comments": {"data": comments},
+                "_time": timestamp}
+
+    def _like(self, rng, i, timestamp):
+        return {"id": str(500000 + i), "name": "Page%d" % i,
+                "category": rng.choice(CATEGORIES),
+                "created_time": graph_time(timestamp),
+                "_time": timestamp}
+
+
+class FakeGraph(object):
+    """Serves synthetic users on 127.0.0.1 from a background thread."""
+    def __init__(self, users=10, posts=100, messages=20, likes=50,
+                 thread_length=5, latency=0.0, throttle_rate=0.0, seed=0,
+                 port=0):
+        self.users = dict(("token-%d" % i,
+                           FakeUser(i, posts, messages, likes, thread_length,
+                                    seed))
+                          for i in range(users))
+        self.tokens = sorted(self.users, key=lambda t: int(t.split("-")[1]))
+        self.by_id = dict((user.id, user) for user in self.users.values())
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ["requests", "batch_operations", "throttled", "not_modified"], 0)
+        self.server = _Server(("127.0.0.1", port), _Handler)
+        self.server.graph = self
+        self.thread = None
+
+    @property
+    def url(self):
+        """The base URL to use as facebook.FACEBOOK_GRAPH_URL."""
+        return "http://127.0.0.1:%d/" % self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def throttled(self):
+        """Decides whether the current request is refused."""
+        if not self.throttle_rate:
+            return False
+        with self.lock:
+            throttled = self.random.random() < self.throttle_rate
+        if throttled:
+            self.count("throttled")
+        return throttled
+
+    def get(self, path, args):
+        """Returns the status and JSON-able body of a GET of path."""
+        user = self.users.get(args.pop("access_token", None))
+        if user is None:
+            return 400, oauth_error("Invalid OAuth access token.")
+        parts = [part for part in path.split("/") if part]
+        if not parts and "ids" in args:
+            objects = {}
+            for id in args["ids"].split(","):
+                if id not in self.by_id and id != "me":
+                    return 404, {"error": {
+                        "message": "(#803) Some of the aliases you requested"
+                        " do not exist: " + id,
+                        "type": "OAuthException", "code": 803}}
+                objects[id] = self._user(user, id).profile
+            return 200, objects
+        if len(parts) not in (1, 2) or \
+                (parts[0] not in self.by_id and parts[0] != "me"):
+            return 404, {"error": {
+                "message": "Unsupported get request.",
+                "type": "GraphMethodException", "code": 100}}
+        owner = self._user(user, parts[0])
+        if len(parts) == 1:
+            return 200, owner.profile
+        if parts[1] not in CONNECTIONS:
+            return 400, {"error": {
+                "message": "(#100) Unknown path components: /" + parts[1],
+                "type": "OAuthException", "code": 2500}}
+        return 200, self._page(path, owner.connections[parts[1]], args)
+
+    def _user(self, user, id):
+        return user if id == "me" else self.by_id[id]
+
+    def _page(self, path, items, args):
+        if "since" in args:
+            since = int(args["since"])
+            items = [item for item in items if item["_time"] >= since]
+        if "until" in args:
+            until = int(args["until"])
+            items = [item for item in items if item["_time"] <= until]
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+        offset = int(args.get("after", 0))
+        data = [dict((key, value) for key, value in item.items()
+                     if key != "_time")
+                for item in items[offset:offset + limit]]
+        page = {"data": data}
+        if data:
+            page["paging"] = {"cursors": {"before": str(offset),
+                                          "after": str(offset + len(data))}}
+            if offset + len(data) < len(items):
+                next_args = dict(args, after=offset + len(data))
+                page["paging"]["next"] = "%s%s?%s" % (
+                    self.url, path.lstrip("/"), urlencode(next_args))
+        return page
+
+    def batch(self, token, operations):
+        """Returns the responses to a list of batch operations."""
+        self.count("batch_operations", len(operations))
+        responses = []
+        for operation in operations:
+            url = urlparse(operation["relative_url"])
+            args = dict((key, values[0])
+                        for key, values in parse_qs(url.query).items())
+            args.setdefault("access_token", token)
+            status, body = self.get(url.path, args)
+            responses.append({"code": status, "headers": [],
+                              "body": json.dumps(body)})
+        return responses
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients may hang up mid-response, e.g. when a prefetch is closed.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, keep-alive
+    # clients wait out a delayed ACK on every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        graph = self._begin()
+        if graph is None:
+            return
+        url = urlparse(self.path)
+        args = dict((key, values[0])
+                    for key, values in parse_qs(url.query).items())
+        status, body = graph.get(self._strip_version(url.path), args)
+        data = json.dumps(body).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            graph.count("not_modified")
+            self._send(304, b"", {"ETag": etag})
+        elif status == 200:
+            self._send(status, data, {"ETag": etag})
+        else:
+            self._send(status, data)
+
+    def do_POST(self):
+        # The body is read first, so that a refused request does not leave
+        # it behind on a kept-alive connection.
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        graph = self._begin()
+        if graph is None:
+            return
+        if self._strip_version(urlparse(self.path).path) != "/" or \
+                "batch" not in form:
+            self._send_json(400, {"error": {
+                "message": "Only batch requests are supported.",
+                "type": "GraphMethodException", "code": 100}})
+            return
+        token = form.get("access_token", [None])[0]
+        self._send_json(200, graph.batch(token, json.loads(form["batch"][0])))
+
+    def do_DELETE(self):
+        graph = self._begin()
+        if graph is not None:
+            self._send_json(200, True)
+
+    def _begin(self):
+        """Counts, delays and possibly throttles a request. Returns the
+        FakeGraph, or None if the request was answered already."""
+        graph = self.server.graph
+        graph.count("requests")
+        if graph.latency:
+            time.sleep(graph.latency)
+        if graph.throttled():
+            self._send_json(400, throttling_error())
+            return None
+        return graph
+
+    def _strip_version(self, path):
+        parts = path.split("/", 2)
+        if len(parts) > 1 and parts[1][:1] == "v" and \
+                parts[1][1:].replace(".", "").isdigit():
+            return "/" + (parts[2] if len(parts) > 2 else "")
+        return path
+
+    def _send_json(self, status, body):
+        self._send(status, json.dumps(body).encode("utf-8"))
+
+    def _send(self, status, data, headers=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type",
+                             "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a fake Graph API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeGraph(users=args.users, latency=args.latency,
+                       throttle_rate=args.throttle_rate, port=args.port)
+    print("Serving %s with tokens token-0 .. token-%d"
+          % (server.url, args.users - 1))
+    server.server.serve_forever()
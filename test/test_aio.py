@@ -0,0 +1,115 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+
+import facebook
+
+# facebook.aio needs Python 3.6 or later and aiohttp.
+try:
+    import asyncio
+    from facebook.aio import AsyncGraphAPI
+    try:
+        from . import aio_cases
+    except (ImportError, ValueError):
+        import aio_cases
+except (ImportError, SyntaxError):
+    AsyncGraphAPI = None
+
+try:
+    from .fakegraph import FakeGraph
+except (ImportError, ValueError):
+    from fakegraph import FakeGraph
+
+
+@unittest.skipIf(AsyncGraphAPI is None, "needs Python 3 and aiohttp")
+class TestAsyncGraphAPI(unittest.TestCase):
+    """Test the asyncio client against the fake Graph API."""
+    def setUp(self):
+        self.server = FakeGraph(users=3, posts=60, messages=7, likes=0)
+        self.server.start()
+        self.graph_url = facebook.FACEBOOK_GRAPH_URL
+        facebook.FACEBOOK_GRAPH_URL = self.server.url
+        self.user = self.server.users[self.server.tokens[0]]
+        # The client is made outside of any event loop.
+        self.graph = AsyncGraphAPI(self.server.tokens[0], max_concurrency=4)
+
+    def tearDown(self):
+        facebook.FACEBOOK_GRAPH_URL = self.graph_url
+        self.server.stop()
+
+    def track_concurrency(self, delay=0.02):
+        """Makes every request take delay seconds, counting how many are
+        served at once. Returns a list whose last item is the peak."""
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+        get = self.server.get
+
+        def tracked(path, args):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            try:
+                time.sleep(delay)
+                return get(path, args)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+        self.server.get = tracked
+        return peak
+
+    def test_get_objects(self):
+        peak = self.track_concurrency()
+        ids = [self.server.users[token].id for token in self.server.tokens]
+        id_lists = [ids[i % 3:] for i in range(16)]
+        # Twice, to use the client in a second event loop.
+        for run in range(2):
+            results = asyncio.run(aio_cases.gather_objects(self.graph,
+                                                           id_lists))
+            for id_list, objects in zip(id_lists, results):
+                self.assertEqual(sorted(objects), sorted(id_list))
+                for id in id_list:
+                    self.assertEqual(objects[id]["id"], id)
+        self.assertEqual(self.server.stats()["requests"], 32)
+        self.assertTrue(1 < peak[0] <= 4, peak[0])
+
+    def test_iter_connections(self):
+        expected = [post["id"] for post in self.user.connections["posts"]]
+        for prefetch in (0, 1, 3):
+            posts = asyncio.run(aio_cases.collect(
+                self.graph, "me", "posts", page_size=25, prefetch=prefetch))
+            self.assertEqual([post["id"] for post in posts], expected)
+        self.assertEqual(self.server.stats()["requests"], 3 * 3)
+
+    def test_prefetch_close(self):
+        self.track_concurrency()
+        posts = asyncio.run(aio_cases.take(self.graph, 3, "me", "posts",
+                                           page_size=5, prefetch=1))
+        self.assertEqual(len(posts), 3)
+        # The prefetch task stopped a page or two ahead.
+        self.assertTrue(self.server.stats()["requests"] <= 3)
+
+    def test_error(self):
+        try:
+            asyncio.run(aio_cases.get_object(self.graph, "0"))
+        except facebook.GraphAPIError as e:
+            self.assertEqual(e.code, 100)
+        else:
+            self.fail("GraphAPIError not raised")
+        self.server.throttle_rate = 1.0
+        try:
+            asyncio.run(aio_cases.collect(self.graph, "me", "posts",
+                                          prefetch=2))
+        except facebook.GraphAPIError as e:
+            self.assertEqual(e.code, 17)
+        else:
+            self.fail("GraphAPIError not raised")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP)
+
+import behavioral_analysis
+from behavioral_analysis import TraitLexicon, score_corpus_batch
+
+# stats opens sentiments.lex relative to the working directory.
+cwd = os.getcwd()
+os.chdir(APP)
+try:
+    import stats
+finally:
+    os.chdir(cwd)
+
+BIG_FIVE_PATH = os.path.join(APP, "big_five") + os.sep
+
+MESSAGES = [
+    "I love writing poems and stories, my art is my life!!",
+    "ugh... hate this boring party, going home to read alone",
+    "Worried and stressed :( can't sleep, so anxious about the exam",
+    "Team meeting at 9am, organized the schedule and finished my work",
+    "lol the party was awesome, dancing all night with friends",
+]
+
+
+class TestTraitLexicon(unittest.TestCase):
+    """Test if the lexicon scores like count_trait_words on each list."""
+    def setUp(self):
+        self.lexicon = TraitLexicon.from_lists(BIG_FIVE_PATH)
+
+    def assertScoresEqual(self, scores, expected):
+        self.assertEqual(sorted(scores), sorted(expected))
+        for trait in expected:
+            self.assertAlmostEqual(scores[trait], expected[trait])
+
+    def test_score(self):
+        word_lists = [
+            behavioral_analysis.read_list(BIG_FIVE_PATH + filename)
+            for filename in behavioral_analysis.TRAIT_FILES]
+        for msg in MESSAGES:
+            word_freqs = behavioral_analysis.count_words(msg)
+            expected = dict(
+                (trait, behavioral_analysis.count_trait_words(word_freqs,
+                                                              words))
+                for trait, words in zip(behavioral_analysis.TRAITS,
+                                        word_lists))
+            self.assertScoresEqual(self.lexicon.score(word_freqs), expected)
+            self.assertScoresEqual(
+                behavioral_analysis.big_five(msg, self.lexicon), expected)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "traits.pickle")
+            self.lexicon.save(filename)
+            loaded = TraitLexicon.load(filename)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.traits, self.lexicon.traits)
+        self.assertEqual(loaded.index, self.lexicon.index)
+
+    def test_get_lexicon(self):
+        lexicon = behavioral_analysis.get_lexicon(BIG_FIVE_PATH)
+        self.assertTrue(behavioral_analysis.get_lexicon(BIG_FIVE_PATH)
+                        is lexicon)
+        self.assertEqual(lexicon.index, self.lexicon.index)
+
+
+class TestScoreCorpusBatch(unittest.TestCase):
+    """Test if batch scores match big_five and risk_metric per message."""
+    def setUp(self):
+        self.lexicon = TraitLexicon.from_lists(BIG_FIVE_PATH)
+        # risk_metric scores with the default lexicon, which is found
+        # relative to the working directory.
+        self.cwd = os.getcwd()
+        os.chdir(APP)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def assertRowsMatch(self, scores, messages):
+        for i, msg in enumerate(messages):
+            row = scores.iloc[i]
+            five = behavioral_analysis.big_five(msg, self.lexicon)
+            for trait in behavioral_analysis.TRAITS:
+                self.assertAlmostEqual(row[trait], five[trait])
+            self.assertAlmostEqual(row["risk"], stats.risk_metric(msg))
+
+    def test_list(self):
+        scores = score_corpus_batch(MESSAGES, self.lexicon)
+        self.assertEqual(list(scores.columns),
+                         list(behavioral_analysis.TRAITS) + ["risk"])
+        self.assertEqual(list(scores.index), list(range(len(MESSAGES))))
+        self.assertRowsMatch(scores, MESSAGES)
+
+    def test_keyed(self):
+        messages = dict(("user%d" % i, msg) for i, msg in enumerate(MESSAGES))
+        for keyed in (messages, stats.pd.Series(messages)):
+            scores = score_corpus_batch(keyed, self.lexicon)
+            self.assertEqual(list(scores.index), list(keyed.keys()))
+            self.assertRowsMatch(scores, [keyed[key] for key in keyed.keys()])
+
+    def test_no_words(self):
+        scores = score_corpus_batch(["", "qwerty zzz"] + MESSAGES[:1],
+                                    self.lexicon)
+        self.assertTrue(scores.iloc[0].isnull().all())
+        # Words, but none of them trait words.
+        self.assertEqual(list(scores.iloc[1][:-1]),
+                         [0.0] * len(behavioral_analysis.TRAITS))
+        self.assertTrue(stats.np.isnan(scores.iloc[1]["risk"]))
+        self.assertRowsMatch(scores.iloc[2:], MESSAGES[:1])
+        self.assertRaises(ZeroDivisionError, stats.risk_metric, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
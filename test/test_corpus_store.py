@@ -0,0 +1,123 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+
+import facebook
+from corpus_store import CorpusStore, full_name
+
+try:
+    from .fakegraph import FakeGraph, graph_time
+except (ImportError, ValueError):
+    from fakegraph import FakeGraph, graph_time
+
+
+class TestCorpusStore(unittest.TestCase):
+    """Test if syncing against the fake Graph API stores every item once."""
+    def setUp(self):
+        self.server = FakeGraph(users=2, posts=30, messages=5, likes=10)
+        self.server.start()
+        self.graph_url = facebook.FACEBOOK_GRAPH_URL
+        facebook.FACEBOOK_GRAPH_URL = self.server.url
+        self.directory = tempfile.mkdtemp()
+        self.store = CorpusStore(os.path.join(self.directory, "test.sqlite"))
+        self.user = self.server.users[self.server.tokens[0]]
+        self.graph = facebook.GraphAPI(self.server.tokens[0])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+        facebook.FACEBOOK_GRAPH_URL = self.graph_url
+        self.server.stop()
+
+    def ids(self, connection):
+        return sorted(item["id"]
+                      for item in self.user.connections[connection])
+
+    def stored_ids(self, connection):
+        return sorted(item["id"]
+                      for item in self.store.items(self.user.id, connection))
+
+    def add_post(self, created, updated=None):
+        posts = self.user.connections["posts"]
+        post = {"id": "%s_%d" % (self.user.id, len(posts)),
+                "message": "new post", "created_time": graph_time(created),
+                "updated_time": graph_time(updated or created),
+                "_time": created}
+        posts.insert(0, post)
+        posts.sort(key=lambda post: -post["_time"])
+        return post
+
+    def test_sync(self):
+        self.assertEqual(self.store.sync(self.graph, page_size=7),
+                         self.user.id)
+        for connection in ("outbox", "posts", "likes"):
+            self.assertEqual(self.stored_ids(connection),
+                             self.ids(connection))
+        # One batch for the profile and the first pages, then the rest of
+        # the 5 pages of posts and 2 pages of likes.
+        stats = self.server.stats()
+        self.assertEqual((stats["requests"], stats["batch_operations"]),
+                         (6, 4))
+
+        corpus = self.store.corpus(self.user.id)
+        self.assertEqual(corpus.name, "User0 Fake")
+        self.assertEqual(len(corpus.posts), 30)
+        self.assertEqual(len(corpus.likes), 10)
+        self.assertEqual(len(corpus.messages), 5 * 3)
+        self.assertEqual(list(self.store.corpora()), [self.user.id])
+
+    def test_incremental_sync(self):
+        self.store.sync(self.graph, page_size=7)
+        newest = self.user.connections["posts"][0]["_time"]
+        post = self.add_post(newest + 60)
+        self.store.sync(self.graph, page_size=7)
+        self.assertTrue(post["id"] in self.stored_ids("posts"))
+        self.assertEqual(self.stored_ids("posts"), self.ids("posts"))
+        # Only the new items (and the ones at the old marks) are fetched,
+        # so the first pages hold all of them.
+        self.assertEqual(self.server.stats()["requests"], 6 + 1)
+
+    def test_mark_uses_created_time(self):
+        posts = self.user.connections["posts"]
+        newest = posts[0]["_time"]
+        # The oldest post is edited after the newest one was created...
+        posts[-1]["updated_time"] = graph_time(newest + 3600)
+        self.store.sync(self.graph)
+        self.assertEqual(self.store.since(self.user.id, "posts"), newest)
+        # ...so a post created before the edit is still found next time.
+        post = self.add_post(newest + 60)
+        self.store.sync(self.graph)
+        self.assertTrue(post["id"] in self.stored_ids("posts"))
+
+    def test_users(self):
+        other = self.server.users[self.server.tokens[1]]
+        graph = facebook.GraphAPI(self.server.tokens[1])
+        self.store.sync(self.graph, page_size=7)
+        self.assertEqual(self.store.sync(graph, page_size=7), other.id)
+        self.assertEqual(self.store.users(), [self.user.id, other.id])
+        requests = self.server.stats()["requests"]
+
+        # Each token's "me" keeps its own marks, so a re-sync is one batch.
+        self.store.sync(self.graph, page_size=7)
+        self.assertEqual(self.server.stats()["requests"], requests + 1)
+
+        # An id the store has not seen yet is fetched without marks; those
+        # first pages are dropped and fetched again from the user's marks.
+        post = self.add_post(self.user.connections["posts"][0]["_time"] + 60)
+        self.store.sync(graph, user=self.user.id, page_size=7)
+        self.assertEqual(self.server.stats()["requests"], requests + 1 + 4)
+        self.assertTrue(post["id"] in self.stored_ids("posts"))
+        self.assertEqual(self.stored_ids("posts"), self.ids("posts"))
+
+    def test_full_name(self):
+        self.assertEqual(full_name(self.user.profile), "User0 Fake")
+        self.assertEqual(full_name({"name": "Name Only"}), "Name Only")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,711 @@
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+os.environ.setdefault("APPLICATION_ID", "test")
+
+# The SDK under app/google only runs on Python 2.
+try:
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.api import datastore
+    from google.appengine.api import datastore_file_stub
+    from google.appengine.datastore import datastore_pb
+    from google.appengine.datastore import datastore_query
+    from google.appengine.datastore import datastore_sqlite_stub
+    from google.appengine.datastore import datastore_stub_util
+except (ImportError, SyntaxError):
+    datastore = None
+
+
+class DatastoreStubTestCase(unittest.TestCase):
+    """Registers datastore stubs over files in a temporary directory."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "datastore")
+
+    def tearDown(self):
+        apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        shutil.rmtree(self.directory)
+
+    def register(self, stub):
+        apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        apiproxy_stub_map.apiproxy.RegisterStub("datastore_v3", stub)
+        return stub
+
+    def file_stub(self, filename=True, **kwds):
+        if filename is True:
+            filename = self.filename
+        return self.register(datastore_file_stub.DatastoreFileStub(
+            "test", filename, use_atexit=False,
+            consistency_policy=
+            datastore_stub_util.MasterSlaveConsistencyPolicy(), **kwds))
+
+    def sqlite_stub(self, **kwds):
+        return self.register(datastore_sqlite_stub.DatastoreSqliteStub(
+            "test", self.filename, use_atexit=False,
+            consistency_policy=
+            datastore_stub_util.MasterSlaveConsistencyPolicy(), **kwds))
+
+    def names(self, kind="K"):
+        return sorted(entity.key().name()
+                      for entity in datastore.Query(kind).Get(1000))
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestJournal(DatastoreStubTestCase):
+    """Test if the journal replays to what was written, torn or compacted."""
+    def setUp(self):
+        DatastoreStubTestCase.setUp(self)
+        self.journal = self.filename + ".journal"
+        self.min_compaction_size = \
+            datastore_file_stub._JOURNAL_MIN_COMPACTION_SIZE
+
+    def tearDown(self):
+        datastore_file_stub._JOURNAL_MIN_COMPACTION_SIZE = \
+            self.min_compaction_size
+        DatastoreStubTestCase.tearDown(self)
+
+    def compacted(self, stub):
+        thread = stub._DatastoreFileStub__compaction_thread
+        if thread:
+            thread.join()
+        return stub
+
+    def populate(self):
+        keys = datastore.Put([datastore.Entity("K", name="e%02d" % i)
+                              for i in range(30)])
+        for key in keys[:5]:
+            entity = datastore.Get(key)
+            entity["v"] = 1
+            datastore.Put(entity)
+        datastore.Delete(keys[5:10])
+        return ["e%02d" % i for i in range(30) if not 5 <= i < 10]
+
+    def test_replay(self):
+        self.file_stub(use_journal=True)
+        names = self.populate()
+        self.assertFalse(os.path.exists(self.filename))
+        size = os.path.getsize(self.journal)
+
+        self.file_stub(use_journal=True)
+        self.assertEqual(self.names(), names)
+        self.assertEqual(
+            [entity.key().name()
+             for entity in datastore.Query("K", {"v =": 1}).Get(100)],
+            ["e00", "e01", "e02", "e03", "e04"])
+        key = datastore.Put(datastore.Entity("K"))
+        self.assertTrue(key.id() > 0)
+        self.assertTrue(os.path.getsize(self.journal) > size)
+
+    def test_torn_commit(self):
+        self.file_stub(use_journal=True)
+        names = self.populate()
+        size = os.path.getsize(self.journal)
+        journal = open(self.journal, "ab")
+        journal.write(datastore_file_stub._JOURNAL_RECORD.pack(
+            datastore_file_stub._JOURNAL_PUT, 16) + "abc")
+        journal.close()
+
+        self.file_stub(use_journal=True)
+        self.assertEqual(self.names(), names)
+        self.assertEqual(os.path.getsize(self.journal), size)
+
+    def test_compaction(self):
+        datastore_file_stub._JOURNAL_MIN_COMPACTION_SIZE = 100
+        stub = self.file_stub(use_journal=True, journal_compaction_ratio=0.5)
+        names = self.populate()
+        self.compacted(stub)
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(self.journal + ".compacting"))
+        self.assertTrue(os.path.getsize(self.journal) <
+                        os.path.getsize(self.filename))
+
+        self.file_stub(use_journal=True)
+        self.assertEqual(self.names(), names)
+
+    def test_leftover_compacting_file(self):
+        self.file_stub(use_journal=True)
+        names = self.populate()
+        os.rename(self.journal, self.journal + ".compacting")
+        self.file_stub(use_journal=True)
+        datastore.Put(datastore.Entity("K", name="new"))
+        self.assertTrue(os.path.exists(self.journal))
+
+        # Replaying both (e.g. after a crash mid-compaction) is idempotent.
+        for i in range(2):
+            self.file_stub(use_journal=True)
+            self.assertEqual(self.names(), sorted(names + ["new"]))
+
+    def test_clear(self):
+        stub = self.file_stub(use_journal=True)
+        self.populate()
+        stub.Clear()
+        datastore.Put(datastore.Entity("K", name="only"))
+        self.compacted(stub)
+
+        self.file_stub(use_journal=True)
+        self.assertEqual(self.names(), ["only"])
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestPropertyIndexes(DatastoreStubTestCase):
+    """Test if indexed queries return what a scan of every entity does."""
+    def setUp(self):
+        DatastoreStubTestCase.setUp(self)
+        self.rng = random.Random(0)
+        self.stub = self.file_stub(None)
+
+    def value(self):
+        rng = self.rng
+        choice = rng.randint(0, 6)
+        if choice == 0:
+            return rng.randint(-5, 5)
+        if choice == 1:
+            return rng.choice([u"a", u"ab", u"b", u"", u"\x00z"])
+        if choice == 2:
+            return rng.random() * 10 - 5
+        if choice == 3:
+            return rng.choice([True, False])
+        if choice == 4:
+            return [rng.randint(-5, 5)
+                    for i in range(rng.randint(0, 3))] or None
+        if choice == 5:
+            return None
+        return datastore.Key.from_path("X", rng.randint(1, 3))
+
+    def queries(self, count):
+        rng = self.rng
+        for i in range(count):
+            filters = {}
+            for j in range(rng.randint(0, 2)):
+                name = rng.choice("xy")
+                op = rng.choice(["=", "<", "<=", ">", ">="])
+                if op != "=" and any(
+                        other.split()[1] != "=" and other.split()[0] != name
+                        for other in filters):
+                    op = "="
+                filters["%s %s" % (name, op)] = rng.choice(
+                    [rng.randint(-5, 5), u"ab", 1.5, True,
+                     datastore.Key.from_path("X", 2)])
+            query = datastore.Query("K", filters)
+            inequalities = [f.split()[0] for f in filters
+                            if f.split()[1] != "="]
+            if inequalities:
+                query.Order(rng.choice([inequalities[0],
+                                        (inequalities[0],
+                                         datastore.Query.DESCENDING)]))
+            elif rng.random() < 0.5:
+                query.Order(rng.choice(["x", ("x", datastore.Query.DESCENDING),
+                                        "y", ("z", datastore.Query.DESCENDING)]))
+            yield query
+
+    def run_queries(self, queries):
+        results = []
+        for query in queries:
+            try:
+                results.append([entity.key().name()
+                                for entity in query.Get(1000)])
+            except Exception, e:
+                results.append(type(e).__name__)
+        return results
+
+    def unindexed(self, queries):
+        self.stub._DatastoreFileStub__IndexedQueryResults = \
+            lambda *args: None
+        try:
+            return self.run_queries(queries)
+        finally:
+            del self.stub._DatastoreFileStub__IndexedQueryResults
+
+    def test_random_queries(self):
+        entities = []
+        for i in range(150):
+            entity = datastore.Entity("K", name="e%03d" % i)
+            for name in "xyz":
+                value = self.value()
+                if value is not None or self.rng.random() < 0.5:
+                    entity[name] = value
+            entities.append(entity)
+        datastore.Put(entities)
+
+        # Build some indexes, then change what they index.
+        datastore.Query("K", {"x =": 1}).Get(10)
+        datastore.Query("K", {"y >": 1}).Get(10)
+        for i in range(150):
+            entity = entities[self.rng.randrange(len(entities))]
+            if self.rng.random() < 0.3:
+                datastore.Delete(entity.key())
+            else:
+                entity["x"] = self.value()
+                entity["y"] = self.value()
+                datastore.Put(entity)
+
+        queries = list(self.queries(60))
+        indexed = self.run_queries(queries)
+        self.assertEqual(indexed, self.unindexed(queries))
+        self.assertTrue(sum(1 for names in indexed if names) > 30)
+
+    def test_index_follows_writes(self):
+        entities = [datastore.Entity("K", name="e%d" % i) for i in range(10)]
+        for i, entity in enumerate(entities):
+            entity["a"] = i % 3
+        datastore.Put(entities)
+        query = datastore.Query("K", {"a =": 1})
+        self.assertEqual([e.key().name() for e in query.Get(10)],
+                         ["e1", "e4", "e7"])
+        entities[0]["a"] = 1
+        datastore.Put(entities[0])
+        datastore.Delete(entities[4].key())
+        entities[7]["a"] = [2, 1]
+        datastore.Put(entities[7])
+        query = datastore.Query("K", {"a >=": 1})
+        query.Order(("a", datastore.Query.DESCENDING))
+        self.assertEqual([e.key().name() for e in query.Get(10)],
+                         ["e2", "e5", "e7", "e8", "e0", "e1"])
+        self.assertEqual(self.run_queries([query]),
+                         self.unindexed([query]))
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestApplyQuery(DatastoreStubTestCase):
+    """Test if key sorts and top-K selection order like the cmp sort."""
+    def setUp(self):
+        DatastoreStubTestCase.setUp(self)
+        self.rng = random.Random(2)
+
+    def value(self):
+        rng = self.rng
+        choice = rng.randint(0, 5)
+        if choice == 0:
+            return rng.randint(-5, 5)
+        if choice == 1:
+            return rng.choice([u"a", u"ab", u"b", u"", u"\x00z"])
+        if choice == 2:
+            return rng.random() * 10 - 5
+        if choice == 3:
+            return rng.choice([True, False])
+        if choice == 4:
+            return [rng.randint(-5, 5) for i in range(rng.randint(1, 3))]
+        return None
+
+    def entities(self, count):
+        entities = []
+        for i in range(count):
+            entity = datastore.Entity(
+                "K", name="e%d" % self.rng.randint(0, 10 ** 6))
+            for name in "xyz":
+                entity[name] = self.value()
+            entities.append(entity)
+        return entities
+
+    def cmp_sort(self, query, entities):
+        """How apply_query sorted before it used key sorts."""
+        value_maps = []
+        for entity in entities:
+            value_map = datastore_query._make_key_value_map(
+                entity, query._order._get_prop_names())
+            value_map["__entity__"] = entity
+            value_maps.append(value_map)
+        value_maps.sort(query._order._cmp)
+        return [value_map["__entity__"] for value_map in value_maps]
+
+    def test_orders(self):
+        entities = [entity._ToPb() for entity in self.entities(200)]
+        for trial in range(100):
+            orders = [datastore_query.PropertyOrder(
+                name, self.rng.choice([datastore_query.PropertyOrder.ASCENDING,
+                                       datastore_query.PropertyOrder.DESCENDING]))
+                for name in self.rng.sample("xyz", self.rng.randint(1, 3))]
+            if self.rng.random() < 0.5:
+                orders.append(datastore_query.PropertyOrder(
+                    "__key__", datastore_query.PropertyOrder.DESCENDING))
+            if len(orders) == 1:
+                order = orders[0]
+            else:
+                order = datastore_query.CompositeOrder(orders)
+            query = datastore_query.Query(app="test", kind="K", order=order)
+            expected = [entity.key() for entity in
+                        self.cmp_sort(query, entities)]
+            for limit in (None, 0, 1, 5, 50, 1000):
+                self.assertEqual(
+                    [entity.key() for entity in datastore_query.apply_query(
+                        query, entities, limit=limit)],
+                    expected[:limit])
+
+    def test_unordered(self):
+        entities = [entity._ToPb() for entity in self.entities(20)]
+        query = datastore_query.Query(app="test", kind="K")
+        self.assertEqual(datastore_query.apply_query(query, entities, limit=3),
+                         entities[:3])
+        self.assertEqual(datastore_query.apply_query(query, entities),
+                         entities)
+
+    def test_stub_limits(self):
+        self.file_stub(None)
+        datastore.Put(self.entities(200))
+        query = datastore.Query("K", {"x >": -3})
+        query.Order(("x", datastore.Query.DESCENDING), "y")
+        names = [entity.key().name() for entity in query.Get(1000)]
+        self.assertTrue(len(names) > 20)
+        for limit, offset in ((1, 0), (10, 0), (10, 5), (7, len(names) - 3)):
+            self.assertEqual([entity.key().name()
+                              for entity in query.Get(limit, offset)],
+                             names[offset:offset + limit])
+
+
+class CountingConnection(object):
+    """Wraps a sqlite3 connection to count its commits, or make them fail."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.commits = 0
+        self.fail = False
+
+    def commit(self):
+        if self.fail:
+            raise sqlite3.OperationalError("disk I/O error")
+        self.commits += 1
+        self.connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestWalCommits(DatastoreStubTestCase):
+    """Test if writers that share a WAL commit all see how it went."""
+    def setUp(self):
+        DatastoreStubTestCase.setUp(self)
+        self.stub = self.sqlite_stub(use_wal=True)
+        datastore.Put(datastore.Entity("K", name="first"))
+        self.connection = CountingConnection(
+            self.stub._DatastoreSqliteStub__connection)
+        self.stub._DatastoreSqliteStub__connection = self.connection
+
+    def tearDown(self):
+        self.stub.Close()
+        DatastoreStubTestCase.tearDown(self)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 10
+        while not condition():
+            self.assertTrue(time.time() < deadline, "timed out")
+            time.sleep(0.001)
+
+    def write_batch(self, names):
+        """Puts each name from its own thread while the connection is held,
+        so that all of them queue up for one commit. Returns the exception
+        each writer (and the holder of the connection) saw."""
+        errors = {}
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            connection = self.stub._GetConnection()
+            held.set()
+            release.wait()
+            try:
+                self.stub._ReleaseConnection(connection)
+            except Exception, e:
+                errors[None] = e
+
+        def put(name):
+            try:
+                datastore.Put(datastore.Entity("K", name=name))
+            except Exception, e:
+                errors[name] = e
+
+        threads = [threading.Thread(target=hold)]
+        threads[0].start()
+        held.wait()
+        for name in names:
+            threads.append(threading.Thread(target=put, args=(name,)))
+            threads[-1].start()
+        self.wait_for(
+            lambda: self.stub._DatastoreSqliteStub__writers_waiting ==
+            len(names))
+        release.set()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        return errors
+
+    def test_group_commit(self):
+        names = ["w%d" % i for i in range(4)]
+        self.assertEqual(self.write_batch(names), {})
+        self.assertEqual(self.connection.commits, 1)
+        self.assertEqual(self.names(), sorted(names + ["first"]))
+
+    def test_concurrent_writers(self):
+        def put(n):
+            for i in range(25):
+                datastore.Put(datastore.Entity("K", name="%d-%d" % (n, i)))
+                datastore.Get(datastore.Key.from_path("K", "%d-%d" % (n, i)))
+        threads = [threading.Thread(target=put, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(self.connection.commits <= 100)
+
+        self.stub.Close()
+        self.stub = self.sqlite_stub(use_wal=True)
+        self.assertEqual(len(self.names()), 101)
+
+    def test_commit_failure(self):
+        self.connection.fail = True
+        names = ["w%d" % i for i in range(4)]
+        errors = self.write_batch(names)
+        self.assertEqual(sorted(errors), [None] + names)
+        for error in errors.values():
+            self.assertTrue("disk I/O error" in str(error), repr(error))
+
+        # The batch was rolled back. The puts are still in the datastore's
+        # transaction log, which applies them again with the next write, as
+        # after any failed apply.
+        self.assertEqual(self.names(), ["first"])
+        self.connection.fail = False
+        datastore.Put(datastore.Entity("K", name="after"))
+        self.stub.Close()
+        self.stub = self.sqlite_stub(use_wal=True)
+        self.assertEqual(self.names(), sorted(names + ["after", "first"]))
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestIteratorCursor(DatastoreStubTestCase):
+    """Test if paging through queries returns the results of one query."""
+    QUERIES = (
+        ({}, {}, ()),
+        ({"a =": 2}, {}, ()),
+        ({}, {}, (("a", datastore.Query.DESCENDING),)),
+        ({"a >": 1}, {}, ("a",)),
+        ({}, {}, (("c", datastore.Query.DESCENDING), "a")),
+        ({}, {"projection": ["a", "c"]}, ("a", "c")),
+        ({}, {"projection": ["a", "c"], "distinct": True}, ("a", "c")),
+        ({}, {"keys_only": True}, (("c", datastore.Query.DESCENDING),)),
+    ) if datastore else ()
+
+    def put_entities(self):
+        rng = random.Random(5)
+        entities = []
+        for i in range(60):
+            entity = datastore.Entity("K", name="e%03d" % i)
+            entity["a"] = rng.randint(0, 5)
+            entity["b"] = [rng.randint(0, 9)
+                           for j in range(rng.randint(1, 3))]
+            entity["c"] = rng.choice([u"x", u"y", u"z"])
+            entities.append(entity)
+        datastore.Put(entities)
+
+    def query(self, filters, options, orders, **kwds):
+        kwds.update(options)
+        query = datastore.Query("K", filters, **kwds)
+        if orders:
+            query.Order(*orders)
+        return query
+
+    def keys(self, results):
+        return [result if isinstance(result, datastore.Key) else result.key()
+                for result in results]
+
+    def page(self, filters, options, orders, size, count):
+        """Pages through a query, reading at most the pages count results
+        should take."""
+        keys = []
+        cursor = None
+        for i in range(count // size + 1):
+            query = self.query(filters, options, orders, cursor=cursor)
+            page = query.Get(size)
+            keys.extend(self.keys(page))
+            if len(page) < size:
+                break
+            cursor = query.GetCursor()
+        return keys
+
+    def check_paging(self):
+        self.put_entities()
+        results = []
+        for filters, options, orders in self.QUERIES:
+            query = self.query(filters, options, orders)
+            full = self.keys(query.Run())
+            self.assertTrue(full)
+            self.assertEqual(query.Count(), len(full))
+            for size in (3, 1000):
+                self.assertEqual(
+                    self.page(filters, options, orders, size, len(full)),
+                    full)
+            for offset, limit in ((0, 5), (10, 20), (len(full) - 3, 50),
+                                  (5, 0)):
+                self.assertEqual(
+                    self.keys(self.query(filters, options, orders).Run(
+                        offset=offset, limit=limit)),
+                    full[offset:offset + limit])
+
+            cursors = []
+            for count in (10, 30):
+                query = self.query(filters, options, orders)
+                query.Get(count)
+                cursors.append(query.GetCursor())
+            query = self.query(filters, options, orders, cursor=cursors[0],
+                               end_cursor=cursors[1])
+            self.assertEqual(self.keys(query.Run()), full[10:30])
+            results.append(full)
+        return results
+
+    def test_file_stub(self):
+        self.file_stub(None)
+        self.check_paging()
+
+    def test_sqlite_stubs(self):
+        self.file_stub(None)
+        expected = self.check_paging()
+        for use_wal in (False, True):
+            stub = self.sqlite_stub(use_wal=use_wal)
+            try:
+                results = self.check_paging()
+            finally:
+                stub.Close()
+                os.remove(self.filename)
+            # Projections of equal values come back in an unspecified order.
+            self.assertEqual([sorted(keys) for keys in results],
+                             [sorted(keys) for keys in expected])
+            self.assertEqual(results[:5], expected[:5])
+
+    def test_lazy(self):
+        pulled = []
+
+        def results():
+            for i in range(100):
+                pulled.append(i)
+                entity = datastore.Entity("K", name="e%03d" % i)
+                yield entity._ToPb()
+
+        query = datastore_pb.Query()
+        query.set_app("test")
+        query.set_kind("K")
+        query.set_limit(5)
+        orders = datastore_stub_util._GuessOrders([], [])
+        cursor = datastore_stub_util.IteratorCursor(
+            query, datastore_stub_util._MakeQuery(query, [], orders, None),
+            orders, [], results())
+        result = datastore_pb.QueryResult()
+        cursor.PopulateQueryResult(result, 3, 0)
+        self.assertEqual([entity.key().path().element(0).name()
+                          for entity in result.result_list()],
+                         ["e000", "e001", "e002"])
+        self.assertTrue(result.more_results())
+        self.assertEqual(len(pulled), 4)
+
+        result = datastore_pb.QueryResult()
+        cursor.PopulateQueryResult(result, 10, 0)
+        self.assertEqual(result.result_size(), 2)
+        self.assertFalse(result.more_results())
+        self.assertEqual(len(pulled), 5)
+
+
+@unittest.skipIf(datastore is None, "needs the Python 2 App Engine SDK")
+class TestProjectionRows(DatastoreStubTestCase):
+    """Test if projections return one row per combination of list values."""
+    def setUp(self):
+        DatastoreStubTestCase.setUp(self)
+        rng = random.Random(7)
+        self.entities = []
+        for i in range(40):
+            entity = datastore.Entity("K", name="e%02d" % i)
+            entity["a"] = rng.randint(0, 3)
+            entity["b"] = [rng.randint(0, 9)
+                           for j in range(rng.randint(1, 3))]
+            entity["c"] = [rng.choice([u"x", u"y", u"z"])
+                           for j in range(rng.randint(1, 2))]
+            self.entities.append(entity)
+
+    def rows(self, names, row_filter=None):
+        """The (name, values...) index rows of the entities, unsorted."""
+        rows = []
+        for entity in self.entities:
+            values = []
+            for name in names:
+                value = entity[name]
+                if not isinstance(value, list):
+                    value = [value]
+                values.append(sorted(set(value)))
+            for row in itertools.product(*values):
+                if row_filter is None or row_filter(row):
+                    rows.append((entity.key().name(),) + row)
+        return rows
+
+    def run_query(self, names, orders, filters={}, distinct=False, **kwds):
+        query = datastore.Query("K", filters, projection=names,
+                                distinct=distinct)
+        query.Order(*orders)
+        return [(entity.key().name(),) +
+                tuple(entity[name] for name in names)
+                for entity in query.Run(**kwds)]
+
+    def check(self):
+        datastore.Put(self.entities)
+        desc = datastore.Query.DESCENDING
+
+        expected = sorted(self.rows(["a", "b"]),
+                          key=lambda row: (row[1], row[2], row[0]))
+        self.assertEqual(self.run_query(["a", "b"], ["a", "b"]), expected)
+        self.assertEqual(self.run_query(["a", "b"], ["a", "b"], offset=10,
+                                        limit=15), expected[10:25])
+        query = datastore.Query("K", projection=["a", "b"])
+        query.Order("a", "b")
+        query.Get(12)
+        query = datastore.Query("K", projection=["a", "b"],
+                                cursor=query.GetCursor())
+        query.Order("a", "b")
+        self.assertEqual([(entity.key().name(), entity["a"], entity["b"])
+                          for entity in query.Get(1000)], expected[12:])
+
+        expected = sorted(sorted(self.rows(["b", "c"]),
+                                 key=lambda row: (row[2], row[0])),
+                          key=lambda row: row[1], reverse=True)
+        self.assertEqual(self.run_query(["b", "c"], [("b", desc), "c"]),
+                         expected)
+
+        expected = sorted(self.rows(["b"], lambda row: row[0] >= 5),
+                          key=lambda row: (row[1], row[0]))
+        self.assertEqual(self.run_query(["b"], ["b"], {"b >=": 5}), expected)
+
+        self.assertEqual(
+            [row[1:] for row in self.run_query(["b"], ["b"], distinct=True)],
+            sorted(set(row[1:] for row in self.rows(["b"]))))
+
+    def test_file_stub(self):
+        self.file_stub(None)
+        self.check()
+
+    def test_sqlite_stub(self):
+        stub = self.sqlite_stub()
+        try:
+            self.check()
+        finally:
+            stub.Close()
+
+    def test_many_rows(self):
+        self.file_stub(None)
+        entity = datastore.Entity("K", name="big")
+        for name in "xyz":
+            entity[name] = range(20)
+        datastore.Put(entity)
+        query = datastore.Query("K", projection=["x", "y", "z"])
+        query.Order(("x", datastore.Query.DESCENDING), "y", "z")
+        self.assertEqual([(row["x"], row["y"], row["z"])
+                          for row in query.Get(3, offset=1)],
+                         [(19, 0, 1), (19, 0, 2), (19, 0, 3)])
+        self.assertEqual(query.Count(10000), 20 ** 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
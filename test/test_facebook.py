@@ -13,10 +13,25 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import base64
 import facebook
+import facebook.cache
+import hashlib
+import hmac
+import json
 import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 
+try:
+    from .fakegraph import FakeGraph
+except (ImportError, ValueError):
+    from fakegraph import FakeGraph
+
 
 class FacebookTestCase(unittest.TestCase):
     """Sets up application ID and secret from environment."""
@@ -70,5 +85,375 @@ class TestAPIVersion(FacebookTestCase):
         self.assertRaises(facebook.GraphAPIError,
                           facebook.GraphAPI, version="1.23")
 
+class TestBatch(FacebookTestCase):
+    """Test if batched requests return one result per request."""
+    def test_batch(self):
+        token = facebook.get_app_access_token(self.app_id, self.secret)
+        graph = facebook.GraphAPI(token)
+        with graph.batch() as batch:
+            results = [batch.get_object(self.app_id) for i in range(51)]
+        for result in results:
+            self.assertEqual(result.result()["id"], self.app_id)
+
+    def test_batch_error(self):
+        token = facebook.get_app_access_token(self.app_id, self.secret)
+        graph = facebook.GraphAPI(token)
+        with graph.batch() as batch:
+            app = batch.get_object(self.app_id)
+            missing = batch.get_object("thisobjectdoesnotexist0")
+        self.assertEqual(app.result()["id"], self.app_id)
+        self.assertRaises(facebook.GraphAPIError, missing.result)
+
+class TestGraphAPIError(unittest.TestCase):
+    """Test if error codes are only ever Graph's numeric codes."""
+    def test_graph_error(self):
+        error = facebook.GraphAPIError(
+            {"error": {"type": "OAuthException", "code": 190,
+                       "message": "Expired"}})
+        self.assertEqual(error.code, 190)
+        self.assertEqual(error.message, "Expired")
+
+    def test_rest_error(self):
+        error = facebook.GraphAPIError({"error_code": 17,
+                                        "error_msg": "Too many calls"})
+        self.assertEqual(error.code, 17)
+
+    def test_no_numeric_code(self):
+        error = facebook.GraphAPIError({"error": "invalid_request",
+                                        "error_description": "Bad"})
+        self.assertEqual(error.code, None)
+        error = facebook.GraphAPIError({"error_code": "OAuthException"})
+        self.assertEqual(error.code, None)
+        self.assertEqual(error.type, "OAuthException")
+
+
+class TestStreamedResponse(unittest.TestCase):
+    """Test if streamed responses decode the same whatever the chunking."""
+    body = (b'{"data": [{"id": "1", "message": "caf\xc3\xa9"}, 22, 333],'
+            b' "paging": {"next": null}}')
+
+    def chunks(self, size):
+        return [self.body[i:i + size] for i in range(0, len(self.body), size)]
+
+    def test_chunk_sizes(self):
+        for size in (1, 2, 5, len(self.body)):
+            response = facebook.StreamedResponse(self.chunks(size))
+            self.assertEqual(list(response),
+                             [{"id": "1", "message": u"caf\xe9"}, 22, 333])
+            self.assertEqual(response.members, {"paging": {"next": None}})
+
+    def test_error(self):
+        response = facebook.StreamedResponse(
+            [b'{"error": {"message": "Bad"}}'],
+            error_class=facebook.GraphAPIError)
+        self.assertRaises(facebook.GraphAPIError, list, response)
+
+    def test_truncated(self):
+        response = facebook.StreamedResponse(self.chunks(7)[:-2])
+        self.assertRaises(ValueError, list, response)
+
+
+class TestCookieCache(unittest.TestCase):
+    """Test if get_user_from_cookie remembers users for the right time."""
+    def setUp(self):
+        self.cache = facebook.cache.ExpiringCache()
+        self.parses = []
+        self.exchanges = []
+        self.expires = "5000"
+        self.parse_signed_request = facebook.parse_signed_request
+        self.get_access_token_from_code = facebook.get_access_token_from_code
+
+        def parse_signed_request(signed_request, app_secret):
+            self.parses.append(signed_request)
+            return self.parse_signed_request(signed_request, app_secret)
+
+        def get_access_token_from_code(code, redirect_uri, app_id,
+                                       app_secret):
+            self.exchanges.append(code)
+            return {"access_token": "token-" + code,
+                    "expires": self.expires}
+        facebook.parse_signed_request = parse_signed_request
+        facebook.get_access_token_from_code = get_access_token_from_code
+
+    def tearDown(self):
+        facebook.parse_signed_request = self.parse_signed_request
+        facebook.get_access_token_from_code = self.get_access_token_from_code
+
+    def cookie(self, app_secret, code="abc", user_id="100000"):
+        payload = base64.urlsafe_b64encode(json.dumps(
+            {"algorithm": "HMAC-SHA256", "code": code,
+             "user_id": user_id}).encode("ascii")).rstrip(b"=")
+        sig = base64.urlsafe_b64encode(hmac.new(
+            app_secret.encode("ascii"), msg=payload,
+            digestmod=hashlib.sha256).digest()).rstrip(b"=")
+        return (sig + b"." + payload).decode("ascii")
+
+    def expiry(self, app_id, cookie):
+        return self.cache.entries.get(app_id + ":" + cookie)[1]
+
+    def test_repeated_cookie(self):
+        cookies = {"fbsr_1": self.cookie("secret")}
+        user = facebook.get_user_from_cookie(cookies, "1", "secret",
+                                             cache=self.cache)
+        self.assertEqual(user, {"uid": "100000", "access_token": "token-abc",
+                                "expires": "5000"})
+        user["uid"] = "changed"
+        self.assertEqual(facebook.get_user_from_cookie(
+            cookies, "1", "secret", cache=self.cache)["uid"], "100000")
+        self.assertEqual((len(self.parses), len(self.exchanges)), (1, 1))
+
+    def test_ttl(self):
+        cookies = {"fbsr_1": self.cookie("secret", code="long"),
+                   "fbsr_2": self.cookie("secret", code="short")}
+        start = time.time()
+        facebook.get_user_from_cookie(cookies, "1", "secret",
+                                      cache=self.cache)
+        self.expires = "60"
+        facebook.get_user_from_cookie(cookies, "2", "secret",
+                                      cache=self.cache)
+        for app_id, ttl in (("1", facebook.COOKIE_CACHE_TTL), ("2", 60)):
+            expiry = self.expiry(app_id, cookies["fbsr_" + app_id])
+            self.assertTrue(start + ttl <= expiry <= time.time() + ttl)
+
+        # An expired entry is dropped and the cookie checked again.
+        self.cache.set("1:" + cookies["fbsr_1"], {"uid": "stale"}, -1)
+        self.assertEqual(facebook.get_user_from_cookie(
+            cookies, "1", "secret", cache=self.cache)["uid"], "100000")
+        self.assertEqual(len(self.exchanges), 3)
+
+    def test_apps_do_not_share(self):
+        cookie = self.cookie("secret1")
+        cookies = {"fbsr_1": cookie, "fbsr_2": cookie}
+        self.assertEqual(facebook.get_user_from_cookie(
+            cookies, "1", "secret1", cache=self.cache)["uid"], "100000")
+        # The other app checks the signature with its own secret.
+        self.assertEqual(facebook.get_user_from_cookie(
+            cookies, "2", "secret2", cache=self.cache), None)
+        self.assertEqual(len(self.parses), 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_no_cache(self):
+        cookies = {"fbsr_1": self.cookie("secret")}
+        for i in range(2):
+            self.assertEqual(facebook.get_user_from_cookie(
+                cookies, "1", "secret", cache=None)["uid"], "100000")
+        self.assertEqual((len(self.parses), len(self.exchanges)), (2, 2))
+
+    def test_default_cache(self):
+        facebook.cookie_cache.clear()
+        cookies = {"fbsr_1": self.cookie("secret")}
+        try:
+            for i in range(2):
+                facebook.get_user_from_cookie(cookies, "1", "secret")
+        finally:
+            facebook.cookie_cache.clear()
+        self.assertEqual(len(self.exchanges), 1)
+
+
+class FakeGraphTestCase(unittest.TestCase):
+    """Points the client at a local fake Graph API."""
+    def setUp(self):
+        self.server = FakeGraph(users=3, posts=60, messages=7, likes=0)
+        self.server.start()
+        self.graph_url = facebook.FACEBOOK_GRAPH_URL
+        facebook.FACEBOOK_GRAPH_URL = self.server.url
+        self.graph = facebook.GraphAPI(self.server.tokens[0])
+
+    def tearDown(self):
+        facebook.FACEBOOK_GRAPH_URL = self.graph_url
+        self.server.stop()
+
+
+class TestFakeGraph(FakeGraphTestCase):
+    """Test the client against the fake Graph API, without credentials."""
+    def test_pagination(self):
+        posts = list(self.graph.iter_connections("me", "posts",
+                                                 page_size=25))
+        self.assertEqual(len(posts), 60)
+        self.assertEqual(len(set(post["id"] for post in posts)), 60)
+        self.assertEqual(self.server.stats()["requests"], 3)
+        self.assertEqual(
+            list(self.graph.iter_connections("me", "outbox", page_size=3,
+                                             stream=True)),
+            list(self.graph.iter_connections("me", "outbox", page_size=3)))
+        self.assertEqual(
+            [], list(self.graph.iter_connections("me", "likes")))
+
+    def prefetch_threads(self, timeout=2.0):
+        """The prefetch threads still running after at most timeout."""
+        deadline = time.time() + timeout
+        while True:
+            threads = [thread for thread in threading.enumerate()
+                       if thread.name == "graph-prefetch"]
+            if not threads or time.time() > deadline:
+                return threads
+            time.sleep(0.01)
+
+    def test_prefetch(self):
+        plain = list(self.graph.iter_connections("me", "posts",
+                                                 page_size=25))
+        for prefetch in (1, 2, 5):
+            posts = list(self.graph.iter_connections(
+                "me", "posts", page_size=25, prefetch=prefetch))
+            self.assertEqual(posts, plain)
+        self.assertEqual(self.server.stats()["requests"], 4 * 3)
+        self.assertEqual(self.prefetch_threads(), [])
+
+    def test_prefetch_error(self):
+        posts = self.graph.iter_connections("me", "posts", page_size=10,
+                                            prefetch=1)
+        items = [next(posts)]
+        # At most 3 of the 6 pages are fetched before the rest fail.
+        self.server.throttle_rate = 1.0
+        try:
+            for post in posts:
+                items.append(post)
+        except facebook.GraphAPIError as e:
+            self.assertEqual(e.code, 17)
+        else:
+            self.fail("GraphAPIError not raised")
+        self.assertTrue(10 <= len(items) <= 30)
+        self.assertEqual(len(items) % 10, 0)
+        self.assertEqual(self.prefetch_threads(), [])
+
+    def test_prefetch_close(self):
+        posts = self.graph.iter_connections("me", "posts", page_size=5,
+                                            prefetch=1)
+        for i, post in enumerate(posts):
+            if i == 2:
+                break
+        posts.close()
+        self.assertEqual(self.prefetch_threads(), [])
+        # The thread stopped a page or two ahead of the consumer.
+        self.assertTrue(self.server.stats()["requests"] <= 3)
+
+    def test_batch(self):
+        with self.graph.batch() as batch:
+            me = batch.get_object("me")
+            others = [batch.get_object(self.server.users[token].id)
+                      for token in self.server.tokens[1:]]
+            missing = batch.get_object("0")
+        self.assertEqual(me.result()["id"], "100000")
+        self.assertEqual([other.result()["id"] for other in others],
+                         ["100001", "100002"])
+        self.assertRaises(facebook.GraphAPIError, missing.result)
+        self.assertEqual(self.server.stats()["requests"], 1)
+
+    def test_short_batch(self):
+        request = self.graph.request
+        self.graph.request = lambda *args, **kwargs: \
+            request(*args, **kwargs)[:1]
+        with self.graph.batch() as batch:
+            me = batch.get_object("me")
+            lost = [batch.get_object(self.server.users[token].id)
+                    for token in self.server.tokens[1:]]
+        self.assertEqual(me.result()["id"], "100000")
+        for result in lost:
+            self.assertTrue(result.done())
+            self.assertRaises(facebook.GraphAPIError, result.result)
+        self.assertEqual(self.server.stats()["requests"], 1)
+
+    def test_revalidation(self):
+        cache = facebook.cache.GraphCache(ttl=0)
+        graph = facebook.GraphAPI(self.server.tokens[0], cache=cache)
+        self.assertEqual(graph.get_object("me"), graph.get_object("me"))
+        self.assertEqual(self.server.stats()["not_modified"], 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"],
+                          stats["revalidations"]), (0, 1, 1))
+
+        # A changed object fails revalidation, which is a miss.
+        self.server.users[self.server.tokens[0]].profile["name"] = "Changed"
+        self.assertEqual(graph.get_object("me")["name"], "Changed")
+        self.assertEqual(graph.get_object("me")["name"], "Changed")
+        self.assertEqual(self.server.stats()["not_modified"], 2)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"],
+                          stats["revalidations"]), (0, 2, 2))
+
+    def test_fresh_hits(self):
+        cache = facebook.cache.GraphCache(ttl=60)
+        graph = facebook.GraphAPI(self.server.tokens[0], cache=cache)
+        self.assertEqual(graph.get_object("me"), graph.get_object("me"))
+        self.assertEqual(self.server.stats()["requests"], 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"],
+                          stats["revalidations"]), (1, 1, 0))
+
+    def test_throttling(self):
+        self.server.throttle_rate = 1.0
+        try:
+            self.graph.get_object("me")
+        except facebook.GraphAPIError as e:
+            self.assertEqual(e.code, 17)
+        else:
+            self.fail("GraphAPIError not raised")
+
+
+class TestSqliteCache(unittest.TestCase):
+    """Test if the on-disk cache tier stays within max_entries."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entry(self, body):
+        return facebook.cache.CacheEntry(body, None, time.time() + 60)
+
+    def test_lru_eviction(self):
+        disk = facebook.cache.SqliteCache(self.filename, max_entries=3)
+        for key in "abc":
+            disk.set(key, self.entry(key))
+        self.assertEqual(disk.get("a").body, "a")
+        disk.set("b", self.entry("B"))
+        disk.set("d", self.entry("d"))
+        self.assertEqual(disk.get("c"), None)
+        self.assertEqual([disk.get(key).body for key in "abd"],
+                         ["a", "B", "d"])
+        self.assertEqual((len(disk), disk.evictions), (3, 1))
+        disk.delete("a")
+        disk.delete("a")
+        self.assertEqual(len(disk), 2)
+
+        reopened = facebook.cache.SqliteCache(self.filename, max_entries=2)
+        self.assertEqual(len(reopened), 2)
+        reopened.set("e", self.entry("e"))
+        self.assertEqual(reopened.get("b"), None)
+        self.assertEqual(reopened.get("d").body, "d")
+        reopened.clear()
+        self.assertEqual(len(reopened), 0)
+
+    def test_old_file(self):
+        connection = sqlite3.connect(self.filename)
+        connection.execute(
+            "CREATE TABLE graph_cache ("
+            "key TEXT PRIMARY KEY, body TEXT, etag TEXT, expires REAL)")
+        connection.execute("INSERT INTO graph_cache VALUES (?, ?, ?, ?)",
+                           ("a", "{}", '"etag"', 0.0))
+        connection.commit()
+        connection.close()
+        disk = facebook.cache.SqliteCache(self.filename, max_entries=1)
+        self.assertEqual(disk.get("a"),
+                         facebook.cache.CacheEntry("{}", '"etag"', 0.0))
+        disk.set("b", self.entry("b"))
+        self.assertEqual(disk.get("a"), None)
+        self.assertEqual(len(disk), 1)
+
+    def test_graph_cache(self):
+        cache = facebook.cache.GraphCache(max_entries=1, ttl=60,
+                                          filename=self.filename,
+                                          max_disk_entries=2)
+        for path in ("a", "b", "c"):
+            cache.set(path, cache.key(path, {}), "{}")
+        self.assertEqual(cache.get(cache.key("a", {})), None)
+        self.assertEqual(cache.get(cache.key("b", {})).body, "{}")
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"],
+                          stats["disk_entries"], stats["disk_evictions"]),
+                         (1, 3, 2, 1))
+
+
 if __name__ == '__main__':
     unittest.main()
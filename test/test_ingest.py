@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+
+import facebook
+
+# ingest is written for Python 2 only.
+try:
+    import ingest
+except (ImportError, SyntaxError):
+    ingest = None
+
+try:
+    from .fakegraph import FakeGraph
+except (ImportError, ValueError):
+    from fakegraph import FakeGraph
+
+
+def graph_error(code):
+    return facebook.GraphAPIError({"error": {"message": "(#%d)" % code,
+                                             "type": "OAuthException",
+                                             "code": code}})
+
+
+@unittest.skipIf(ingest is None, "ingest needs Python 2")
+class TestRateLimiter(unittest.TestCase):
+    """Test if throttled calls are retried with backoff, and only those."""
+    def failing(self, codes):
+        """A function that raises the errors in codes, then returns "ok"."""
+        calls = []
+
+        def function():
+            calls.append(time.time())
+            if len(calls) <= len(codes):
+                raise graph_error(codes[len(calls) - 1])
+            return "ok"
+        return function, calls
+
+    def test_retry(self):
+        limiter = ingest.RateLimiter(base_delay=0.001, max_retries=3)
+        function, calls = self.failing([4, 17, 613])
+        self.assertEqual(limiter.call(function), "ok")
+        self.assertEqual(len(calls), 4)
+
+    def test_give_up(self):
+        limiter = ingest.RateLimiter(base_delay=0.001, max_retries=2)
+        function, calls = self.failing([17, 17, 17])
+        try:
+            limiter.call(function)
+        except facebook.GraphAPIError as e:
+            self.assertEqual(e.code, 17)
+        else:
+            self.fail("GraphAPIError not raised")
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors(self):
+        limiter = ingest.RateLimiter(base_delay=0.001)
+        function, calls = self.failing([190])
+        self.assertRaises(facebook.GraphAPIError, limiter.call, function)
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff(self):
+        limiter = ingest.RateLimiter(base_delay=1.0, max_delay=4.0)
+        for attempt in range(5):
+            expected = min(4.0, 2.0 ** attempt)
+            limiter.next_call = 0.0
+            start = time.time()
+            limiter.backoff(attempt)
+            delay = limiter.next_call - start
+            # Jitter takes off at most half of the delay.
+            self.assertTrue(expected * 0.5 <= delay <= expected + 0.1,
+                            (attempt, delay))
+
+    def test_min_interval(self):
+        limiter = ingest.RateLimiter(min_interval=0.05)
+        calls = []
+        for i in range(5):
+            limiter.call(lambda: calls.append(time.time()))
+        for before, after in zip(calls, calls[1:]):
+            self.assertTrue(after - before >= 0.045, after - before)
+
+
+@unittest.skipIf(ingest is None, "ingest needs Python 2")
+class TestIngest(unittest.TestCase):
+    """Test ingestion against the fake Graph API."""
+    def setUp(self):
+        self.server = FakeGraph(users=3, posts=30, messages=5, likes=10)
+        self.server.start()
+        self.graph_url = facebook.FACEBOOK_GRAPH_URL
+        facebook.FACEBOOK_GRAPH_URL = self.server.url
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        facebook.FACEBOOK_GRAPH_URL = self.graph_url
+        self.server.stop()
+
+    def test_throttled_graph(self):
+        self.server.throttle_rate = 0.3
+        limiter = ingest.RateLimiter(base_delay=0.001, max_retries=20)
+        graph = ingest.ThrottledGraphAPI(self.server.tokens[0],
+                                         limiter=limiter)
+        posts = list(graph.iter_connections("me", "posts", page_size=5))
+        self.assertEqual([post["id"] for post in posts],
+                         [post["id"] for post in
+                          self.server.users[self.server.tokens[0]]
+                          .connections["posts"]])
+        stats = self.server.stats()
+        self.assertTrue(stats["throttled"] > 0)
+        self.assertEqual(stats["requests"], 6 + stats["throttled"])
+
+    def test_throttled_graph_gives_up(self):
+        self.server.throttle_rate = 1.0
+        limiter = ingest.RateLimiter(base_delay=0.001, max_retries=3)
+        graph = ingest.ThrottledGraphAPI(self.server.tokens[0],
+                                         limiter=limiter)
+        self.assertRaises(facebook.GraphAPIError, graph.get_object, "me")
+        self.assertEqual(self.server.stats()["requests"], 4)
+
+    def test_ingest_users(self):
+        tokens = self.server.tokens + ["bad-token"]
+        results = ingest.ingest_users(tokens, workers=2,
+                                      out_dir=self.directory, page_size=7)
+        self.assertEqual(sorted(results), sorted(tokens))
+        error = results["bad-token"]
+        self.assertTrue(isinstance(error, facebook.GraphAPIError))
+        self.assertEqual(error.code, 190)
+        for token in self.server.tokens:
+            user = self.server.users[token]
+            self.assertEqual(results[token],
+                             os.path.join(self.directory, user.id + ".json"))
+            with open(results[token]) as infile:
+                corpus = json.load(infile)
+            self.assertEqual((corpus["id"], corpus["name"]),
+                             (user.id, user.name))
+            self.assertEqual(len(corpus["posts"]), 30)
+            self.assertEqual(len(corpus["likes"]), 10)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(self.server.users[token].id + ".json"
+                                for token in self.server.tokens))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,364 @@
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+os.environ.setdefault("APPLICATION_ID", "test")
+
+# The SDK under app/google only runs on Python 2.
+try:
+    from google.appengine.api import datastore_errors
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+    from google.appengine.ext.ndb import context
+    from google.appengine.ext.ndb import eventloop
+    from google.appengine.ext.ndb import tasklets
+except (ImportError, SyntaxError):
+    ndb = None
+
+
+class Item(object if ndb is None else ndb.Model):
+    if ndb is not None:
+        value = ndb.IntegerProperty()
+        text = ndb.StringProperty()
+
+
+class NdbTestCase(unittest.TestCase):
+    """Runs each test against fresh datastore and memcache stubs."""
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.set_context(ndb.make_default_context())
+        self.context = ndb.get_context()
+
+    def tearDown(self):
+        ndb.set_context(None)
+        self.testbed.deactivate()
+
+
+@unittest.skipIf(ndb is None, "needs the Python 2 App Engine SDK")
+class TestContextCache(NdbTestCase):
+    """Test if the context cache keeps within its limits."""
+    def put_items(self, count):
+        keys = ndb.put_multi([Item(id=i + 1, value=i, text="x" * (10 * i))
+                              for i in range(count)])
+        self.context.clear_cache()
+        return keys
+
+    def cached(self):
+        return [key.id() for key in self.context._cache]
+
+    def test_unbounded(self):
+        self.assertEqual(self.context.get_cache_limits(),
+                         {"max_items": None, "max_bytes": None,
+                          "eviction": "lru"})
+        keys = self.put_items(10)
+        for key in keys + keys:
+            key.get(use_memcache=False)
+        self.assertEqual(self.context.get_cache_stats(),
+                         {"hits": 10, "misses": 10, "evictions": 0,
+                          "items": 10, "bytes": 0})
+
+    def test_lru(self):
+        keys = self.put_items(10)
+        self.context.set_cache_limits(max_items=3)
+        for key in keys:
+            key.get(use_memcache=False)
+        self.assertEqual(self.cached(), [8, 9, 10])
+        keys[7].get()
+        keys[0].get(use_memcache=False)
+        self.assertEqual(self.cached(), [10, 8, 1])
+        stats = self.context.get_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"],
+                          stats["items"]), (1, 11, 8, 3))
+
+    def test_clock(self):
+        keys = self.put_items(4)
+        self.context.set_cache_limits(max_items=3, eviction="clock")
+        for key in keys[:3]:
+            key.get(use_memcache=False)
+        keys[0].get()
+        keys[3].get(use_memcache=False)
+        # The hit gave 1 a second chance, so 2 went instead.
+        self.assertEqual(sorted(self.cached()), [1, 3, 4])
+
+    def test_bytes(self):
+        keys = self.put_items(10)
+        sizes = [key.get()._to_pb(allow_partial=True).ByteSize()
+                 for key in keys]
+        self.context.clear_cache()
+        # Room for the largest item and the smallest, but not two large ones.
+        self.context.set_cache_limits(max_bytes=sizes[9] + sizes[0])
+        for key in keys:
+            key.get(use_memcache=False)
+        self.assertEqual(self.cached(), [10])
+        stats = self.context.get_cache_stats()
+        self.assertEqual((stats["bytes"], stats["evictions"]), (sizes[9], 9))
+        keys[0].get(use_memcache=False)
+        self.assertEqual(self.cached(), [10, 1])
+        self.assertEqual(self.context.get_cache_stats()["bytes"],
+                         sizes[9] + sizes[0])
+
+    def test_shrinking_limits(self):
+        keys = self.put_items(10)
+        for key in keys:
+            key.get(use_memcache=False)
+        self.context.set_cache_limits(max_items=4)
+        self.assertEqual(len(self.cached()), 4)
+        self.assertEqual(self.context.get_cache_stats()["evictions"], 6)
+        self.context.set_cache_limits()
+        for key in keys:
+            key.get(use_memcache=False)
+        self.assertEqual(len(self.cached()), 10)
+
+    def test_transaction(self):
+        keys = self.put_items(10)
+        self.context.set_cache_limits(max_items=2)
+
+        @ndb.transactional
+        def update():
+            item = keys[4].get()
+            item.value += 100
+            item.put()
+            self.assertEqual(ndb.get_context().get_cache_limits()["max_items"],
+                             None)
+        update()
+        self.assertEqual(keys[4].get().value, 104)
+        self.assertTrue(len(self.cached()) <= 2)
+
+    def test_options(self):
+        ctx = ndb.Context(config=ndb.ContextOptions(max_cache_items=5,
+                                                    max_cache_bytes=1000))
+        self.assertEqual(ctx.get_cache_limits(),
+                         {"max_items": 5, "max_bytes": 1000,
+                          "eviction": "lru"})
+        self.assertRaises(datastore_errors.BadArgumentError,
+                          self.context.set_cache_limits, eviction="fifo")
+        self.assertRaises(datastore_errors.BadArgumentError,
+                          ndb.ContextOptions, max_cache_items="5")
+
+    def test_cache_object(self):
+        cache = context.ContextCache(max_items=2)
+        cache["a"] = 1
+        cache["b"] = None
+        self.assertEqual(cache.lookup("b"), (True, None))
+        self.assertEqual(cache.lookup("c"), (False, None))
+        cache["c"] = 3
+        self.assertEqual(sorted(cache), ["b", "c"])
+        self.assertEqual(dict(cache.iteritems()), {"b": None, "c": 3})
+        del cache["b"]
+        self.assertEqual((len(cache), "b" in cache, cache.get("b", 0)),
+                         (1, False, 0))
+        self.assertEqual(cache.stats(),
+                         {"hits": 1, "misses": 1, "evictions": 1,
+                          "items": 1, "bytes": 0})
+
+
+@unittest.skipIf(ndb is None, "needs the Python 2 App Engine SDK")
+class TestEventLoop(NdbTestCase):
+    """Test if timed events run in order and the hook sees every iteration."""
+    def setUp(self):
+        NdbTestCase.setUp(self)
+        self.loop = eventloop.EventLoop()
+        self.stats = []
+
+    def test_fifo(self):
+        out = []
+        base = time.time() - 10
+        rng = random.Random(0)
+        for i in range(200):
+            when = base + rng.randint(0, 5)
+            self.loop.queue_call(when, out.append, (when, i))
+        self.loop.run()
+        # Events due at the same time run in the order they were queued.
+        self.assertEqual(len(out), 200)
+        self.assertEqual(out, sorted(out))
+
+        self.loop.queue_call(base, out.append, (base, "first"))
+        self.loop.insort_event_right((base, out.append, ((base, "second"),),
+                                      {}))
+        self.loop.run()
+        self.assertEqual(out[-2:], [(base, "first"), (base, "second")])
+
+    def test_hook(self):
+        self.loop.set_instrumentation_hook(self.stats.append)
+        self.loop.queue_call(None, time.sleep, 0.01)
+        self.loop.add_idle(lambda: None)
+        self.loop.queue_call(0.02, lambda: None)
+        while self.loop.run1():
+            pass
+        self.assertTrue(self.stats[0].callback_time >= 0.01)
+        self.assertEqual(self.stats[0].queue, 1)
+        self.assertTrue(any(stats.delay > 0 for stats in self.stats))
+        self.assertEqual(self.stats[-1].delay, None)
+        self.assertEqual((self.stats[-1].current, self.stats[-1].idlers,
+                          self.stats[-1].queue, self.stats[-1].rpcs),
+                         (0, 0, 0, 0))
+
+        self.loop.set_instrumentation_hook(None)
+        self.loop.queue_call(None, lambda: None)
+        count = len(self.stats)
+        self.loop.run()
+        self.assertEqual(len(self.stats), count)
+
+    def test_hook_on_error(self):
+        def fail():
+            raise ValueError
+        self.loop.set_instrumentation_hook(self.stats.append)
+        self.loop.queue_call(None, fail)
+        self.assertRaises(ValueError, self.loop.run0)
+        self.assertEqual(len(self.stats), 1)
+        self.assertEqual(self.stats[0].delay, None)
+
+    def test_rpc_wait_time(self):
+        eventloop.set_instrumentation_hook(self.stats.append)
+        try:
+            ndb.put_multi([Item(value=i) for i in range(20)])
+        finally:
+            eventloop.set_instrumentation_hook(None)
+        self.assertTrue(sum(stats.rpc_wait_time for stats in self.stats) > 0)
+        self.assertEqual(Item.query().count(), 20)
+
+    def test_sleeping_tasklets(self):
+        @ndb.tasklet
+        def sleeper(i):
+            yield tasklets.sleep(0.001 * (i % 7))
+            raise ndb.Return(i)
+        futures = [sleeper(i) for i in range(500)]
+        self.assertEqual([future.get_result() for future in futures],
+                         list(range(500)))
+
+
+# About a millisecond, but exact in binary, so that the fake clock adds up
+# without rounding.
+TICK = 1.0 / 1024
+
+
+class FakeClock(object):
+    """Stands in for the time module; sleep() just moves time() on."""
+    def __init__(self, now=2.0 ** 30):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@unittest.skipIf(ndb is None, "needs the Python 2 App Engine SDK")
+class TestAutoBatcher(NdbTestCase):
+    """Test if adaptive flushing and the coalescing delay merge batches.
+
+    The event loop and the batchers run on a fake clock, items arrive at
+    fixed times and every batch takes the same time, so the batches are
+    always the same.
+    """
+    def setUp(self):
+        NdbTestCase.setUp(self)
+        self.clock = FakeClock()
+        self.modules = [context, eventloop]
+        for module in self.modules:
+            module.time = self.clock
+
+    def tearDown(self):
+        for module in self.modules:
+            module.time = time
+        NdbTestCase.tearDown(self)
+
+    def run_batches(self, count=100, interval=TICK, latency=10 * TICK,
+                    **kwds):
+        """Adds an item every interval seconds to a batcher whose batches
+        take latency seconds. Returns the batch sizes and its stats."""
+        sizes = []
+
+        @tasklets.tasklet
+        def todo_tasklet(todo, options):
+            sizes.append(len(todo))
+            yield tasklets.sleep(latency)
+            for future, arg in todo:
+                future.set_result(arg)
+        batcher = context.AutoBatcher(todo_tasklet, 1000, **kwds)
+
+        @tasklets.tasklet
+        def client(i):
+            yield tasklets.sleep(i * interval)
+            result = yield batcher.add(i)
+            raise tasklets.Return(result)
+        futures = [client(i) for i in range(count)]
+        self.assertEqual([future.get_result() for future in futures],
+                         list(range(count)))
+        stats = batcher.stats()
+        self.assertEqual((sum(sizes), stats["items"], stats["batches"]),
+                         (count, count, len(sizes)))
+        return sizes, stats
+
+    def test_idle_flush(self):
+        sizes, stats = self.run_batches()
+        # Every item finds the loop idle and goes out on its own.
+        self.assertEqual(sizes, [1] * 100)
+        self.assertEqual(stats["flush_reasons"]["idle"], 100)
+        self.assertEqual((stats["flush_limit"], stats["peak_flush_limit"]),
+                         (1, 1))
+        self.assertEqual(stats["mean_latency"], 10 * TICK)
+
+    def test_adaptive(self):
+        sizes, stats = self.run_batches(adaptive=True)
+        # Until the first batch is back, there is no average to wait for;
+        # after that, the 10 items added during each batch go together.
+        self.assertEqual(sizes, [1] * 11 + [10] * 8 + [9])
+        self.assertEqual(stats["peak_flush_limit"], 10)
+        self.assertEqual(stats["flush_reasons"]["idle"], len(sizes))
+
+    def test_coalesce_delay(self):
+        sizes, stats = self.run_batches(coalesce_delay=5 * TICK)
+        # Each queue waits for the items of the next 5 ticks.
+        self.assertEqual(sizes, [6] * 16 + [4])
+        reasons = stats["flush_reasons"]
+        self.assertEqual(reasons["delay"] + reasons["idle"], len(sizes))
+        sizes, stats = self.run_batches(adaptive=True,
+                                        coalesce_delay=5 * TICK)
+        # Once the first batch is back, the flush limit holds the queues.
+        self.assertEqual(sizes, [6, 6] + [10] * 8 + [8])
+        self.assertEqual(stats["peak_flush_limit"], 10)
+
+    def test_context(self):
+        ndb.set_context(ndb.Context(config=ndb.ContextOptions(
+            adaptive_batching=True, batch_coalesce_delay=0.5)))
+        batcher = ndb.get_context()._get_batcher
+        self.assertEqual((batcher._adaptive, batcher._coalesce_delay),
+                         (True, 0.5))
+        keys = ndb.put_multi([Item(value=i) for i in range(10)])
+        futures = [key.get_async(use_cache=False, use_memcache=False)
+                   for key in keys]
+        self.assertEqual([future.get_result().value for future in futures],
+                         list(range(10)))
+        stats = ndb.get_context().get_batcher_stats()["get"]
+        self.assertEqual((stats["batches"], stats["items"]), (1, 10))
+
+    def test_options(self):
+        self.assertRaises(datastore_errors.BadArgumentError,
+                          ndb.ContextOptions, batch_coalesce_delay=-1)
+        self.assertRaises(datastore_errors.BadArgumentError,
+                          ndb.ContextOptions, adaptive_batching=1)
+
+    def test_old_subclass(self):
+        class OldBatcher(context.AutoBatcher):
+            def __init__(self, todo_tasklet, limit):
+                context.AutoBatcher.__init__(self, todo_tasklet, limit)
+        ndb.set_context(ndb.Context(auto_batcher_class=OldBatcher))
+        keys = ndb.put_multi([Item(value=i) for i in range(5)])
+        self.assertEqual([item.value for item in
+                          ndb.get_multi(keys, use_cache=False)],
+                         list(range(5)))
+        self.assertEqual(ndb.get_context().get_batcher_stats()["get"]
+                         ["batches"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
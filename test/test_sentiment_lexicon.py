@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP)
+
+import numpy as np
+
+from sentiment_lexicon import SentimentLexicon, open_lexicon, write_lexicon
+
+
+def read_csv(filename):
+    """The {word : score} dict that senter.py writes sentiments.lex from."""
+    sentiments = {}
+    with open(filename) as infile:
+        for row in infile:
+            word, score = row.rstrip("\n").split(",")
+            if len(word.split()) == 1:
+                sentiments[word] = float(score)
+    return sentiments
+
+
+class TestSentimentsFile(unittest.TestCase):
+    """Test if sentiments.lex holds what sentiments.csv does."""
+    @classmethod
+    def setUpClass(cls):
+        cls.sentiments = read_csv(os.path.join(APP, "sentiments.csv"))
+        cls.lexicon = SentimentLexicon(os.path.join(APP, "sentiments.lex"))
+
+    def test_lookups(self):
+        self.assertEqual(len(self.lexicon), len(self.sentiments))
+        for word, score in self.sentiments.items():
+            self.assertTrue(word in self.lexicon)
+            self.assertEqual(self.lexicon[word], np.float32(score))
+            self.assertEqual(self.lexicon.get(word), np.float32(score))
+
+    def test_vectorized_lookup(self):
+        words = sorted(self.sentiments)
+        scores = np.array([self.sentiments[word] for word in words],
+                          dtype=np.float32)
+        np.testing.assert_array_equal(self.lexicon.lookup(words), scores)
+
+    def test_missing_words(self):
+        missing = ["", "notaword", "zzzzzz", "x" * (self.lexicon.width + 1),
+                   max(self.sentiments) + "s", u"caf\xe9"]
+        for word in missing:
+            self.assertFalse(word in self.sentiments)
+            self.assertFalse(word in self.lexicon)
+            self.assertRaises(KeyError, self.lexicon.__getitem__, word)
+            self.assertEqual(self.lexicon.get(word, 0), 0)
+        self.assertTrue(np.isnan(self.lexicon.lookup(missing)).all())
+        self.assertEqual(len(self.lexicon.lookup([])), 0)
+
+
+class TestWriteLexicon(unittest.TestCase):
+    """Test if written lexicons read back, whatever their words."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, sentiments):
+        filename = os.path.join(self.directory, "test.lex")
+        write_lexicon(filename, sentiments)
+        return SentimentLexicon(filename)
+
+    def test_round_trip(self):
+        sentiments = {u"caf\xe9": 0.5, "a": -1.0, "ab": 0.25, "b": 0.0,
+                      "longest": 1.0}
+        lexicon = self.write(sentiments)
+        for word, score in sentiments.items():
+            self.assertEqual(lexicon[word], score)
+        self.assertEqual(lexicon[u"caf\xe9".encode("utf-8")], 0.5)
+        np.testing.assert_array_equal(
+            lexicon.lookup(["b", "c", "a", "longestword", u"caf\xe9"]),
+            [0.0, np.nan, -1.0, np.nan, 0.5])
+
+    def test_empty(self):
+        lexicon = self.write({})
+        self.assertEqual(len(lexicon), 0)
+        self.assertFalse("a" in lexicon)
+        self.assertTrue(np.isnan(lexicon.lookup(["a"])).all())
+
+    def test_not_a_lexicon(self):
+        filename = os.path.join(self.directory, "test.csv")
+        with open(filename, "wb") as outfile:
+            outfile.write(b"word,0.5\n" * 10)
+        self.assertRaises(ValueError, SentimentLexicon, filename)
+
+    def test_open_lexicon(self):
+        self.write({"a": 1.0})
+        filename = os.path.join(self.directory, "test.lex")
+        self.assertTrue(open_lexicon(filename) is open_lexicon(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import datetime
+import os
+import random
+import sys
+import unittest
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP)
+
+# stats opens sentiments.lex relative to the working directory.
+cwd = os.getcwd()
+os.chdir(APP)
+try:
+    import stats
+finally:
+    os.chdir(cwd)
+
+from stats import IncrementalMetrics, getSleepRegularity, getVariability, \
+    parseTimes
+
+START = datetime.datetime(2014, 8, 1)
+
+
+def timeline(count, days, seed):
+    """count chronological Graph timestamps spread over days."""
+    rng = random.Random(seed)
+    seconds = sorted(rng.randint(0, days * 86400) for i in range(count))
+    return [(START + datetime.timedelta(seconds=s)).strftime(
+        "%Y-%m-%dT%H:%M:%S+0000") for s in seconds]
+
+
+def messages(count, days, seed):
+    """count (time, words) messages, mixing lexicon words with others."""
+    rng = random.Random(seed)
+    vocabulary = [str(word) for word in stats.sentiments.keys[::50]]
+    vocabulary += ["notaword", "qwerty", ""]
+    return [(time, [rng.choice(vocabulary)
+                    for i in range(rng.randint(0, 12))])
+            for time in timeline(count, days, seed)]
+
+
+class TestIncrementalMetrics(unittest.TestCase):
+    """Test if the incremental metrics match the batch functions."""
+    def test_posts(self):
+        times = timeline(500, 120, seed=0)
+        metrics = IncrementalMetrics()
+        for i in range(0, len(times), 37):
+            metrics.addPosts(times[i:i + 37])
+            self.assertAlmostEqual(metrics.sleepRegularity(),
+                                   getSleepRegularity(times[:i + 37]))
+        self.assertTrue(metrics.sleepRegularity() < 1)
+
+        parsed = IncrementalMetrics()
+        parsed.addPosts(parseTimes(times))
+        self.assertEqual(parsed.hour_counts.tolist(),
+                         metrics.hour_counts.tolist())
+
+    def test_messages(self):
+        metrics = IncrementalMetrics()
+        words = []
+        for time, message in messages(300, 120, seed=1):
+            metrics.addMessage(message)
+            words.extend(message)
+            self.assertAlmostEqual(metrics.variability(),
+                                   getVariability(words))
+        self.assertNotEqual(metrics.variability(), 0)
+
+    def test_windows(self):
+        times = timeline(400, 120, seed=2)
+        parsed = parseTimes(times)
+        stream = messages(400, 120, seed=3)
+        for days in (7, 30, 90):
+            metrics = IncrementalMetrics(days)
+            for i, time in enumerate(times):
+                metrics.addPosts(times[i:i + 1])
+                cutoff = parsed[i] - stats.np.timedelta64(days, 'D')
+                recent = [t for t, p in zip(times, parsed)[:i + 1]
+                          if p >= cutoff]
+                self.assertAlmostEqual(metrics.sleepRegularity(),
+                                       getSleepRegularity(recent))
+
+            metrics = IncrementalMetrics(days)
+            for i, (time, message) in enumerate(stream):
+                metrics.addMessage(message, time)
+                cutoff = parseTimes([time])[0] - \
+                    stats.np.timedelta64(days, 'D')
+                words = []
+                for t, m in stream[:i + 1]:
+                    if parseTimes([t])[0] >= cutoff:
+                        words.extend(m)
+                self.assertAlmostEqual(metrics.variability(),
+                                       getVariability(words))
+
+    def test_window_needs_times(self):
+        self.assertRaises(ValueError, IncrementalMetrics(7).addMessage,
+                          ["good"])
+
+
+if __name__ == '__main__':
+    unittest.main()
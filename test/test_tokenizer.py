@@ -0,0 +1,147 @@
+import htmlentitydefs
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "app"))
+
+from nltk.util import ngrams
+
+import happyfuntokenizing
+from happyfuntokenizing import Tokenizer, word_re, emoticon_re, \
+    html_entity_digit_re, html_entity_alpha_re, amp
+
+SAMPLES = (
+    u"RT @ #happyfuncoding: this is a typical Twitter tweet :-)",
+    u"HTML entities &amp; other Web oddities can be an &aacute;cute "
+    u"<em class='grumpy'>pain</em> >:(",
+    u"It's perhaps noteworthy that phone numbers like +1 (800) 123-4567, "
+    u"(800) 123-4567, and 123-4567 are treated as words despite their "
+    u"whitespace.",
+    u"OMG can't believe it's Friday already!!! See you at 8:30 ;) #weekend",
+    u"Check this out http://t.co/AbC123 ... seriously LOL :D :P XD 8D",
+    u"@Someone I Don't Think So &#39;really&#39; =/ :-\\ ;-P",
+    u"Mac &amp; cheese &amp; a movie tonight, can&#39;t wait &lt;3 <3",
+    u"",
+    u"no emoticons or entities here at all",
+    u"\xc9COLE caf\xe9 na\xefve :D \u0130stanbul",
+)
+
+
+def legacy_html2unicode(s):
+    """The per-entity replace loops that Tokenizer used to decode HTML
+    entities. Note that "&amp;" was only replaced if the string had another
+    named entity."""
+    ents = set(html_entity_digit_re.findall(s))
+    for ent in ents:
+        try:
+            s = s.replace(ent, unichr(int(ent[2:-1])))
+        except:
+            pass
+    ents = set(html_entity_alpha_re.findall(s))
+    ents = filter((lambda x : x != amp), ents)
+    for ent in ents:
+        try:
+            s = s.replace(ent, unichr(htmlentitydefs.name2codepoint[ent[1:-1]]))
+        except:
+            pass
+        s = s.replace(amp, " and ")
+    return s
+
+
+def legacy_tokenize(tokenizer, s):
+    """What Tokenizer.tokenize did before tokenize_many: find the words with
+    word_re, then search every word with emoticon_re to decide its case.
+    "&amp;" is always decoded, as it is now."""
+    s = legacy_html2unicode(unicode(s)).replace(amp, " and ")
+    words = word_re.findall(s)
+    if tokenizer.preserve_case:
+        return words
+    return [x if emoticon_re.search(x) else x.lower() for x in words]
+
+
+def corpus(size, seed=0):
+    rng = random.Random(seed)
+    words = u" ".join(SAMPLES).split()
+    return list(SAMPLES) + [
+        u" ".join(rng.choice(words) for i in range(rng.randint(0, 30)))
+        for j in range(size)]
+
+
+class TestTokenizer(unittest.TestCase):
+    """Test if the single-pass scanner tokenizes like the per-regex path."""
+    def test_tokens(self):
+        strings = corpus(500)
+        for preserve_case in (False, True):
+            tokenizer = Tokenizer(preserve_case=preserve_case)
+            expected = [legacy_tokenize(tokenizer, s) for s in strings]
+            self.assertEqual([tokenizer.tokenize(s) for s in strings],
+                             expected)
+            self.assertEqual([list(tokens) for tokens in
+                              tokenizer.tokenize_many(strings)], expected)
+
+    def test_byte_strings(self):
+        tokenizer = Tokenizer()
+        self.assertEqual(tokenizer.tokenize("Hello World :D"),
+                         [u"hello", u"world", u":D"])
+        self.assertEqual(tokenizer.tokenize("caf\xc3\xa9 :P"),
+                         tokenizer.tokenize("caf\\xc3\\xa9 :P"))
+
+    def test_ngrams(self):
+        tokenizer = Tokenizer()
+        strings = corpus(100, seed=1)
+        for n in (2, 3):
+            expected = [list(ngrams(legacy_tokenize(tokenizer, s), n))
+                        for s in strings]
+            self.assertEqual([list(tokenizer.tokenize(s, n))
+                              for s in strings], expected)
+            self.assertEqual([list(grams) for grams in
+                              tokenizer.tokenize_many(strings, n)], expected)
+
+
+class TestHtmlEntities(unittest.TestCase):
+    """Test if entities decode as before, through a bounded FIFO cache."""
+    def setUp(self):
+        happyfuntokenizing.html_entity_cache.clear()
+        happyfuntokenizing.html_entity_cache_order.clear()
+        self.html2unicode = Tokenizer()._Tokenizer__html2unicode
+
+    def test_legacy(self):
+        for s in (u"don&#39;t", u"&aacute;cute &eacute;t&eacute;",
+                  u"&#60;b&#62; &lt;i&gt;", u"&unknown; &#;",
+                  u"&#99999999999; &#x41; &lt &", u"&#38;#38;",
+                  u"no entities", u""):
+            self.assertEqual(self.html2unicode(s), legacy_html2unicode(s))
+
+    def test_amp(self):
+        # "&amp;" used to be left alone without another named entity.
+        self.assertEqual(legacy_html2unicode(u"Mac &amp; cheese"),
+                         u"Mac &amp; cheese")
+        self.assertEqual(self.html2unicode(u"Mac &amp; cheese"),
+                         u"Mac  and  cheese")
+        self.assertEqual(self.html2unicode(u"Mac &amp; cheese &lt;3"),
+                         legacy_html2unicode(u"Mac &amp; cheese &lt;3"))
+        self.assertEqual(self.html2unicode(u"&amp;lt;"), u" and lt;")
+
+    def test_cache(self):
+        size = happyfuntokenizing.HTML_ENTITY_CACHE_SIZE
+        cache = happyfuntokenizing.html_entity_cache
+        ents = [u"&#%d;" % (1000 + i) for i in range(size + 10)]
+        for i, ent in enumerate(ents):
+            self.assertEqual(self.html2unicode(ent), unichr(1000 + i))
+            self.assertTrue(len(cache) <= size)
+        self.assertEqual(sorted(cache), sorted(ents[10:]))
+        self.assertEqual(list(happyfuntokenizing.html_entity_cache_order),
+                         ents[10:])
+        # A hit does not move an entity, so the oldest one still goes next.
+        self.html2unicode(ents[10])
+        self.html2unicode(u"&aacute;")
+        self.assertTrue(ents[10] not in cache)
+        self.assertEqual(cache[u"&aacute;"], u"\xe1")
+        self.assertEqual(len(cache), size)
+
+
+if __name__ == '__main__':
+    unittest.main()